@@ -0,0 +1,216 @@
+import cv2
+import os
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from counter_people import (
+    PeopleCounter, H264Writer, initialize_firebase, load_model, detection_stride,
+    clip_id, annotated_filename, upload_annotated_video, build_counter_record, cleanup,
+    DETECT_STRIDE, DETECT_FPS, DETECT_BATCH, ANNOTATED_VIDEO, CONFIG
+)
+from test2 import MovementScorer, build_moverate_record
+from ledger import STAGES, get_ledger
+from stream_download import open_blob
+from metrics import QUEUE_DEPTH, start_exporter, timed
+import rollups
+
+# Fused analysis stage: every clip is downloaded once and every frame is decoded
+# once, then fed to both the people counter and the movement scorer.
+# Clips from several cameras are analyzed side by side on a thread pool; each
+# pool thread loads its own model, since a YOLO predictor is not thread-safe.
+# Results are keyed by clip id and stages the ledger already holds are not
+# run again, so a retried clip neither duplicates documents nor rollups.
+
+_thread_state = threading.local()
+
+
+def thread_model():
+    """The calling thread's own detector, loaded on first use."""
+    if getattr(_thread_state, "model", None) is None:
+        _thread_state.model = load_model()
+    return _thread_state.model
+
+
+def create_pool(workers=None):
+    """Thread pool for analysis, one thread per core by default (cameras.json "workers")."""
+    workers = workers or CONFIG.worker_count
+    if workers > 1:
+        # split the cores between the clips instead of every clip using all of them
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze")
+
+
+# 1. Find clips that still need analysis
+def find_pending_videos(db, bucket, ledger=None):
+    """Return the clips missing a people_counter or moverate result, oldest first.
+
+    New uploads are found incrementally and the work list comes from the
+    ledger (ledger.py), so the cost does not grow with the archive. Clips
+    archived by live mode (live.py) are recorded as skipped.
+    """
+    ledger = ledger or get_ledger()
+    ledger.bootstrap(db, bucket)
+    ledger.discover(bucket)
+    pending = ledger.pending()
+    QUEUE_DEPTH.set(len(pending), queue="analysis")
+    return [bucket.blob(name) for name in pending]
+
+
+# 2. Analyze one clip
+def analyze_clip(db, bucket, model, blob, deadline=None, ledger=None, annotate=ANNOTATED_VIDEO):
+    """Count and score one clip; with annotate=False no video is drawn, encoded or uploaded.
+
+    Only the stages missing from the ledger are run, written and added to the rollups.
+    """
+    camera = CONFIG.camera_for_video(blob.name, blob.metadata)
+    ledger = ledger or get_ledger()
+    status = ledger.status(blob.name)
+    done = set(status["stages"]) if status else set()
+    missing = [stage for stage in STAGES if stage not in done]
+    if not missing:
+        return True
+    count = "people_counter" in missing
+    score = "moverate" in missing
+    annotate = annotate and count
+    output_filename = annotated_filename(blob.name) if annotate else None
+
+    cap = None
+    out = None
+    try:
+        # frames are decoded while the rest of the clip is still downloading
+        print(f"📥 Streaming {blob.name}...")
+        cap = open_blob(blob)
+        if not cap.isOpened():
+            raise RuntimeError(f"Cannot open video: {blob.name}")
+        ret, frame = cap.read()
+        if not ret:
+            raise RuntimeError("Cannot read video frames")
+
+        frame_h, frame_w = frame.shape[:2]
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if annotate:
+            out = H264Writer(output_filename, fps, frame_w, frame_h)
+
+        counter = scorer = None
+        if count:
+            counter = PeopleCounter(model, frame_w, frame_h,
+                                    stride=detection_stride(fps, DETECT_STRIDE, DETECT_FPS),
+                                    batch_size=DETECT_BATCH, fps=fps,
+                                    lines=camera.counting_lines(frame_w, frame_h), draw=annotate)
+        if score:
+            scorer = MovementScorer(frame_count, fps=fps)
+            scorer.start(frame)
+
+        print(f"🔍 Analyzing video ({', '.join(missing)})...")
+        while True:
+            with timed("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            if deadline:
+                deadline.check()
+            # The scorer must see the frame before the counter draws on it
+            if scorer:
+                scorer.update(frame)
+            if counter:
+                for drawn in counter.feed(frame):
+                    if out:
+                        out.write(drawn)
+        if counter:
+            for drawn in counter.flush():
+                if out:
+                    out.write(drawn)
+            print(f"Finished {camera.room}. Total In={counter.in_count}, Out={counter.out_count}, Total_count={counter.total_count}")
+
+        video_url = None
+        if out:
+            out.release()
+            video_url = upload_annotated_video(bucket, output_filename)
+
+        print("💾 Saving results...")
+        doc_id = clip_id(blob.name)
+        counter_record = move_record = None
+        batch = db.batch()
+        if counter:
+            counter_record = build_counter_record(counter, blob.name, video_url, camera.room)
+            batch.set(db.collection("people_counter").document(doc_id), counter_record)
+        if scorer:
+            _, move_record = build_moverate_record(blob.name, scorer.result(), camera.room, document_id=doc_id)
+            batch.set(db.collection("moverate").document(doc_id), move_record)
+        rollups.add(batch, db, camera.room, rollups.clip_time(blob.name) or datetime.now(rollups.LOCAL_TZ),
+                    people=counter_record, movement=move_record["overall_score"] if move_record else None)
+        with timed("firestore_write"):
+            batch.commit()
+        print(f"✅ {' and '.join(missing)} saved to Firestore!")
+
+        if counter:
+            ledger.record_stage(blob.name, "people_counter", {
+                "doc": doc_id, "in": counter.in_count, "out": counter.out_count,
+                "total_count": counter.total_count})
+        if scorer:
+            ledger.record_stage(blob.name, "moverate", {
+                "doc": doc_id, "overall_score": move_record["overall_score"],
+                "overall_level": move_record["overall_level"]})
+        return True
+
+    finally:
+        if cap is not None:
+            cap.release()  # stops the download and removes any temp file
+        if out:
+            out.abort()  # no-op after a successful release()
+        cleanup([output_filename] if output_filename else [])
+
+
+# 3. Analyze everything that is pending
+def _analyze_one(db, bucket, model, blob, deadline):
+    if deadline:
+        deadline.check()
+    ledger = get_ledger()
+    if not ledger.claim(blob.name):
+        return False  # another thread or process took it
+    print(f"\n✅ New video found: {blob.name}")
+    try:
+        analyze_clip(db, bucket, model or thread_model(), blob, deadline=deadline, ledger=ledger)
+        ledger.finish(blob.name)
+        return True
+    except Exception as e:
+        print(f"❌ Failed to analyze {blob.name}: {str(e)}")
+        traceback.print_exc()
+        ledger.fail(blob.name, e)
+        return False
+    except BaseException:
+        # interrupted (timeout / shutdown): not the clip's fault, try again next run
+        ledger.release(blob.name)
+        raise
+
+
+def process_pending(db, bucket, model=None, deadline=None, pool=None):
+    """Analyze every pending clip, in order on this thread or side by side on pool."""
+    pending = find_pending_videos(db, bucket)
+    if not pending:
+        print("❌ No new video found to process.")
+        return 0
+
+    if pool is None:
+        return sum(_analyze_one(db, bucket, model, blob, deadline) for blob in pending)
+
+    # the pool threads use their own models; a shared one would be used concurrently
+    futures = [pool.submit(_analyze_one, db, bucket, None, blob, deadline) for blob in pending]
+    wait(futures)
+    return sum(future.result() for future in futures)
+
+
+# 4. Main
+def main():
+    start_exporter("analyze_clip")
+    db, bucket = initialize_firebase()
+    with create_pool() as pool:
+        process_pending(db, bucket, pool=pool)
+
+
+if __name__ == "__main__":
+    main()
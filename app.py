@@ -1,34 +1,86 @@
 import matplotlib
 matplotlib.use('Agg')  # ใช้ Agg backend สำหรับการสร้างกราฟแบบไม่ต้องเปิดหน้าต่าง
 
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
-import matplotlib.pyplot as plt
-from flask import Flask, render_template, Response, jsonify
-from datetime import datetime
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from flask import Flask, render_template, Response, jsonify, request, abort, send_file, g
+from datetime import datetime, timedelta
 from io import BytesIO
-import pandas as pd
 import logging
+import os
+import threading
+import hashlib
+import json
+import time
 from dateutil import parser, tz
-from collections import deque
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FetchTimeout
+
+from config import get_config
+from dashboard_cache import DashboardCache
+from datastore import get_store, DESCENDING, MEDIA_URL
+import metrics
+import rollups
+import series_codec
+from video_queue import VideoQueue, PlaybackCursor
+from ledger import VIDEO_PREFIX
 
 # ตั้งค่า logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Firebase Initialization
-cred = credentials.Certificate("smart-class-e9661-firebase-adminsdk-fbsvc-bf137255f5.json")
-firebase_admin.initialize_app(cred, {
-    'storageBucket': "smart-class-e9661.appspot.com"
-})
-
-db = firestore.client()
-bucket = storage.bucket()
+# Firebase หรือที่เก็บในเครื่อง (ค่าจาก cameras.json ดู config.py และ datastore.py)
+CONFIG = get_config()
+store = get_store(CONFIG.dashboard_bucket)
+db = store.db
+bucket = store.bucket
 app = Flask(__name__)
 
-# ตัวแปรเก็บคิววิดีโอ
-video_queue = deque()
-current_video_index = 0
+# ระยะห่างสูงสุด (วินาที) ที่ยอมให้จับคู่ผล moverate / people_counter กับวิดีโอ
+MATCH_MAX_SECONDS = 900
+BANGKOK_TZ = tz.gettz("Asia/Bangkok")
+# collection ที่เก็บ timestamp เป็น ISO string (counter_people.py) แทน Firestore timestamp
+STRING_TIMESTAMP_COLLECTIONS = {"people_counter"}
+# แคชข้อมูลแดชบอร์ดจะโหลดใหม่อย่างน้อยทุก ๆ กี่วินาที (กรณี listener ไม่ทำงาน)
+CACHE_TTL_SECONDS = 60
+# เอกสารเก่าที่ไม่มี field room ถือว่าเป็นของกล้องตัวแรก
+DEFAULT_ROOM = CONFIG.cameras[0].room
+# query ฐานข้อมูลรันพร้อมกันใน thread pool ขนาดจำกัด; query ที่ช้ากว่านี้ (วินาที) ถือว่าล้มเหลว
+FETCH_WORKERS = 8
+QUERY_TIMEOUT_SECONDS = 10
+
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+def run_queries(*queries, timeout=QUERY_TIMEOUT_SECONDS):
+    """รัน query (ฟังก์ชันไม่มี argument) พร้อมกัน คืนผลตามลำดับ; โยน FetchTimeout ถ้าตัวใดช้าเกิน timeout
+
+    เอกสารที่อ่านใน pool ถูกนับเข้า request ที่เรียก (metrics.bind_request)
+    """
+    futures = [fetch_pool.submit(metrics.bind_request(query)) for query in queries]
+    deadline = time.monotonic() + timeout
+    return [future.result(timeout=max(0, deadline - time.monotonic())) for future in futures]
+
+# คิววิดีโอ (ซิงก์แบบเพิ่มเฉพาะของใหม่, thread-safe) แยกตามห้อง; None = ทุกห้อง
+# ตำแหน่งเล่นอยู่ใน playback.db จึงหมุนวิดีโอต่อกันได้แม้รันหลาย worker process (wsgi.py)
+playback_cursor = PlaybackCursor()
+video_queues = {None: VideoQueue(db, bucket, cursor=playback_cursor)}
+video_queues_lock = threading.Lock()
+
+def selected_room():
+    """ห้องจาก ?room= (None = ทุกห้อง); ห้องที่ไม่มีใน cameras.json ตอบ 404"""
+    room = request.args.get("room") or None
+    if room is not None and room not in CONFIG.rooms:
+        abort(404, description=f"Unknown room: {room}")
+    return room
+
+def doc_room(doc_data):
+    return doc_data.get("room") or DEFAULT_ROOM
+
+def get_video_queue(room=None):
+    with video_queues_lock:
+        if room not in video_queues:
+            video_queues[room] = VideoQueue(db, bucket, room=room, cursor=playback_cursor)
+        return video_queues[room]
 
 def format_timestamp(timestamp):
     """แปลง timestamp ให้อยู่ในรูปแบบที่อ่านง่าย (ปรับเป็น Asia/Bangkok)"""
@@ -58,203 +110,494 @@ def format_timestamp(timestamp):
             return timestamp.strftime('%Y-%m-%d %H:%M:%S')
         return "Unknown"
 
-def update_video_queue():
-    """อัปเดตคิววิดีโอจาก Storage และ Firestore"""
-    global video_queue
+def update_video_queue(room=None):
+    """อัปเดตคิววิดีโอจาก Storage และ Firestore (เฉพาะวิดีโอใหม่)"""
     try:
-        video_queue.clear()
-        
-        # ดึงข้อมูลจาก collection videos ใน Firestore
-        video_docs = db.collection("videos").order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-        
-        for doc in video_docs:
-            try:
-                video_data = doc.to_dict()
-                file_name = video_data.get("fileName", "")
-                
-                # ดึงข้อมูล blob จาก Storage
-                blob = bucket.blob(f"videos/{file_name}")
-                
-                if blob.exists():
-                    signed_url = blob.generate_signed_url(
-                        version="v4",
-                        expiration=3600,  # 1 ชั่วโมง
-                        method="GET"
-                    )
-                    
-                    video_queue.append({
-                        'url': signed_url,
-                        'name': file_name,
-                        'timestamp': video_data.get("timestamp"),
-                        'updated': blob.updated
-                    })
-                
-            except Exception as e:
-                logger.error(f"Error processing video document {doc.id}: {e}")
-
-        logger.info(f"Updated video queue with {len(video_queue)} videos")
+        get_video_queue(room).sync()
         return True
-
     except Exception as e:
         logger.error(f"Error updating video queue: {e}")
         return False
 
-def get_next_video():
+def get_next_video(room=None):
     """ดึงวิดีโอถัดไปจากคิว"""
-    global current_video_index, video_queue
-
-    if current_video_index >= len(video_queue) or not video_queue:
-        update_video_queue()
-        current_video_index = 0
+    return get_video_queue(room).next()
 
-    if not video_queue:
+def to_epoch(timestamp):
+    """แปลง timestamp (string หรือ datetime) เป็น epoch seconds, คืน None ถ้าแปลงไม่ได้"""
+    try:
+        dt = parser.parse(timestamp) if isinstance(timestamp, str) else timestamp
+        if not isinstance(dt, datetime):
+            return None
+        # ถ้า dt ยังไม่มี tzinfo ให้ถือเป็น UTC
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=tz.UTC)
+        return dt.timestamp()
+    except (ValueError, OverflowError, TypeError):
         return None
 
-    video = video_queue[current_video_index]
-    current_video_index += 1
-    return video
+def timestamp_bound(collection, epoch):
+    """สร้างขอบเขตของ range query ให้ตรงกับชนิดของ timestamp ที่ collection นั้นเก็บ"""
+    dt = datetime.fromtimestamp(epoch, tz=tz.UTC)
+    if collection in STRING_TIMESTAMP_COLLECTIONS:
+        # เก็บเป็น ISO string เวลาไทย (offset คงที่) จึงเทียบแบบ string ได้ตามลำดับเวลา
+        # ต้องมีหลักไมโครวินาทีเสมอเหมือนที่เขียนไว้ (isoformat() ตัดทิ้งเมื่อเป็น 0 ทำให้ลำดับ string ผิด)
+        return dt.astimezone(BANGKOK_TZ).isoformat(timespec="microseconds")
+    return dt
 
-def fetch_data_from_firestore():
-    """ดึงข้อมูลจาก Firestore และประมวลผล โดยใช้ timestamp จาก videos"""
-    try:
-        # ดึงข้อมูลจาก videos collection (ล่าสุด 10 รายการ)
-        video_docs = list(db.collection("videos")
-                         .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                         .limit(10).stream())
-        
-        # ดึงข้อมูลจาก moverate และ people_counter เพื่อนำมาเชื่อมกับข้อมูล videos
-        moverate_docs = list(db.collection("moverate").stream())
-        people_docs = list(db.collection("people_counter").stream())
-
-        data = []
-        for video_doc in video_docs:
-            try:
-                video_data = video_doc.to_dict()
-                video_ts = video_data.get("timestamp")
-                
-                if not video_ts:
-                    continue
-                
-                # แปลง timestamp ของ video เป็น datetime object สำหรับการเปรียบเทียบ
-                video_dt = parser.parse(video_ts) if isinstance(video_ts, str) else video_ts
-                
-                # หา moverate ที่ใกล้เคียงที่สุดกับ timestamp ของ video
-                matched_move = None
-                min_move_diff = float('inf')
-                for move_doc in moverate_docs:
-                    move_data = move_doc.to_dict()
-                    move_ts = move_data.get("timestamp")
-                    if move_ts:
-                        m_dt = parser.parse(move_ts) if isinstance(move_ts, str) else move_ts
-                        diff = abs((video_dt - m_dt).total_seconds())
-                        if diff < min_move_diff:
-                            min_move_diff = diff
-                            matched_move = move_data
-                
-                # หา people_counter ที่ใกล้เคียงที่สุดกับ timestamp ของ video
-                matched_people = None
-                min_people_diff = float('inf')
-                for pdoc in people_docs:
-                    pdata = pdoc.to_dict()
-                    pts = pdata.get("timestamp")
-                    if pts:
-                        p_dt = parser.parse(pts) if isinstance(pts, str) else pts
-                        diff = abs((video_dt - p_dt).total_seconds())
-                        if diff < min_people_diff:
-                            min_people_diff = diff
-                            matched_people = pdata
-                
-                # เพิ่มข้อมูลลงในรายการผลลัพธ์
-                data.append({
-                    "timestamp": format_timestamp(video_ts),
-                    "num_people": matched_people.get("total_count", 0) if matched_people else 0,
-                    "move_rate": matched_move.get("overall_level", "Unknown") if matched_move else "Unknown",
-                    "raw_timestamp": video_ts,
-                    "video_name": video_data.get("fileName", "")
-                })
-                
-            except Exception as e:
-                logger.error(f"Error processing video doc {video_doc.id}: {e}")
-
-        # เรียงข้อมูลตามเวลา (เก่าสุดไปใหม่สุด)
-        data.sort(key=lambda x: x.get("raw_timestamp", ""))
-        return data
+def fetch_time_index(collection, start_epoch, end_epoch, room=None):
+    """ดึงเอกสารในช่วงเวลา [start, end] แล้วแปลง timestamp ครั้งเดียว
 
-    except Exception as e:
-        logger.error(f"Error in fetch_data_from_firestore: {e}")
+    คืนค่า (times, docs) ที่เรียงตามเวลา สำหรับใช้ค้นหาแบบ binary search
+    ถ้าระบุ room จะกรองห้องหลังดึงข้อมูล (ไม่ต้องมี composite index เพิ่ม)
+    """
+    docs = (db.collection(collection)
+            .where("timestamp", ">=", timestamp_bound(collection, start_epoch))
+            .where("timestamp", "<=", timestamp_bound(collection, end_epoch))
+            .order_by("timestamp")
+            .stream())
+
+    index = []
+    reads = 0
+    for doc in docs:
+        reads += 1
+        doc_data = doc.to_dict()
+        if room is not None and doc_room(doc_data) != room:
+            continue
+        epoch = to_epoch(doc_data.get("timestamp"))
+        if epoch is not None:
+            index.append((epoch, doc_data))
+    metrics.count_reads(collection, reads)
+    index.sort(key=lambda item: item[0])
+    return [t for t, _ in index], [d for _, d in index]
+
+def find_nearest(times, docs, epoch, max_distance=MATCH_MAX_SECONDS):
+    """หาเอกสารที่เวลาใกล้ epoch ที่สุด (ไม่เกิน max_distance วินาที)"""
+    i = bisect_left(times, epoch)
+    best = None
+    best_diff = max_distance
+    for j in (i - 1, i):
+        if 0 <= j < len(times):
+            diff = abs(times[j] - epoch)
+            if diff <= best_diff and (best is None or diff < best_diff):
+                best, best_diff = docs[j], diff
+    return best
+
+def room_index(times, docs, room):
+    """กรอง (times, docs) ให้เหลือเฉพาะเอกสารของห้องเดียว"""
+    pairs = [(t, d) for t, d in zip(times, docs) if doc_room(d) == room]
+    return [t for t, _ in pairs], [d for _, d in pairs]
+
+def load_dashboard_data(max_distance=MATCH_MAX_SECONDS, room=None):
+    """ดึงข้อมูลจาก Firestore และประมวลผล โดยใช้ timestamp จาก videos
+
+    moverate และ people_counter ถูกดึงเฉพาะช่วงเวลารอบ ๆ วิดีโอที่แสดง
+    แล้วจับคู่กับวิดีโอแต่ละรายการด้วย binary search บนเวลาที่แปลงไว้แล้ว
+    ถ้าระบุ room จะแสดงเฉพาะวิดีโอและผลของห้องนั้น
+    (โยน exception ออกไปถ้าดึงข้อมูลไม่สำเร็จ เพื่อให้ DashboardCache เก็บข้อมูลเดิมไว้)
+    """
+    # ดึงข้อมูลจาก videos collection (ล่าสุด 10 รายการ)
+    # กรองห้องฝั่ง Firestore ต้องมี composite index (room, timestamp desc)
+    # เอกสารเก่าที่ไม่มี field room จะไม่ถูกเลือก ต้องรัน python backfill_rooms.py --apply หนึ่งครั้ง
+    query = db.collection("videos")
+    if room is not None:
+        query = query.where("room", "==", room)
+    [video_docs] = run_queries(lambda: list(query.order_by("timestamp", direction=DESCENDING)
+                                            .limit(10).stream()))
+    metrics.count_reads("videos", len(video_docs))
+
+    videos = []
+    for video_doc in video_docs:
+        video_data = video_doc.to_dict()
+        video_ts = video_data.get("timestamp")
+        video_epoch = to_epoch(video_ts) if video_ts else None
+        if video_epoch is None:
+            continue
+        videos.append((video_epoch, video_ts, video_data))
+
+    if not videos:
         return []
 
+    # ดึง moverate และ people_counter เฉพาะช่วงเวลาของวิดีโอ (+/- max_distance) พร้อมกัน
+    start_epoch = min(v[0] for v in videos) - max_distance
+    end_epoch = max(v[0] for v in videos) + max_distance
+    (move_times, move_docs), (people_times, people_docs) = run_queries(
+        lambda: fetch_time_index("moverate", start_epoch, end_epoch, room),
+        lambda: fetch_time_index("people_counter", start_epoch, end_epoch, room))
+
+    # ผลวิเคราะห์ต้องมาจากห้องเดียวกับวิดีโอ: แยก index ตามห้อง (ถ้าระบุ room ข้อมูลถูกกรองมาแล้ว)
+    indexes = {}
+    def indexes_for(video_room):
+        if room is not None:
+            return (move_times, move_docs), (people_times, people_docs)
+        if video_room not in indexes:
+            indexes[video_room] = (room_index(move_times, move_docs, video_room),
+                                   room_index(people_times, people_docs, video_room))
+        return indexes[video_room]
+
+    data = []
+    for video_epoch, video_ts, video_data in videos:
+        video_room = doc_room(video_data)
+        move_index, people_index = indexes_for(video_room)
+        matched_move = find_nearest(*move_index, video_epoch, max_distance)
+        matched_people = find_nearest(*people_index, video_epoch, max_distance)
+
+        # เพิ่มข้อมูลลงในรายการผลลัพธ์
+        data.append({
+            "timestamp": format_timestamp(video_ts),
+            "num_people": matched_people.get("total_count", 0) if matched_people else 0,
+            "move_rate": matched_move.get("overall_level", "Unknown") if matched_move else "Unknown",
+            "raw_timestamp": video_ts,
+            "video_name": video_data.get("fileName", ""),
+            "room": video_room
+        })
+
+    # เรียงข้อมูลตามเวลา (เก่าสุดไปใหม่สุด)
+    data.sort(key=lambda x: x.get("raw_timestamp", ""))
+    return data
+
+def fetch_data_from_firestore(room=None):
+    """ข้อมูลแดชบอร์ดจากแคชที่ใช้ร่วมกันทั้ง process (ไม่อ่าน Firestore ต่อ request)"""
+    return get_dashboard_cache(room).get()
+
+# แคชข้อมูลแดชบอร์ดแยกตามห้อง (สร้างเมื่อมีคนเปิดห้องนั้นครั้งแรก); None = ทุกห้อง
+dashboard_caches = {}
+dashboard_caches_lock = threading.Lock()
+
+def get_dashboard_cache(room=None):
+    with dashboard_caches_lock:
+        if room not in dashboard_caches:
+            dashboard_caches[room] = DashboardCache(
+                db, lambda: load_dashboard_data(room=room), ttl=CACHE_TTL_SECONDS)
+        return dashboard_caches[room]
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+    g.metrics_started = time.perf_counter()
+
+@app.after_request
+def finish_request_metrics(response):
+    # เวลาและจำนวนเอกสารที่อ่านจากฐานข้อมูลต่อ request (แยกตาม endpoint)
+    started = g.get("metrics_started")
+    if started is not None:
+        metrics.finish_request(request.endpoint or "unknown", time.perf_counter() - started)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """metrics รูปแบบ Prometheus ของแดชบอร์ดและของ worker ทุกตัว (ไฟล์ใน metrics.METRICS_DIR)"""
+    # process นี้ใช้ค่าปัจจุบันแทนไฟล์ของตัวเอง; worker แดชบอร์ดตัวอื่น (wsgi.py) มาจากไฟล์
+    others = [s for s in metrics.read_snapshots() if s.get("pid") != os.getpid()]
+    body = metrics.render([metrics.snapshot("dashboard")] + others)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
-    """หน้าแดชบอร์ดหลัก"""
-    data = fetch_data_from_firestore()
-    video = get_next_video()
-    return render_template('index.html', data=data, current_video=video)
+    """หน้าแดชบอร์ดหลัก (?room= แสดงเฉพาะห้องนั้น)"""
+    room = selected_room()
+    # วิดีโอถัดไป (อาจต้องซิงก์คิว) ดึงพร้อมกับข้อมูลแดชบอร์ด; ถ้าช้าเกินไปแสดงหน้าโดยไม่มีวิดีโอ
+    video_future = fetch_pool.submit(metrics.bind_request(get_next_video), room)
+    data = fetch_data_from_firestore(room)
+    try:
+        video = video_future.result(timeout=QUERY_TIMEOUT_SECONDS)
+    except FetchTimeout:
+        logger.error("Timed out waiting for the next video")
+        video = None
+    return render_template('index.html', data=data, current_video=video_payload(video) if video else None,
+                           rooms=CONFIG.rooms, room=room)
+
+def video_payload(video):
+    return {
+        "video_url": video['url'],
+        "video_name": video['name'],
+        "timestamp": format_timestamp(video['timestamp']),
+        "updated": video['updated'].isoformat() if hasattr(video['updated'], 'isoformat') else str(video['updated'])
+    }
 
 @app.route('/next_video')
 def next_video():
     """ดึงวิดีโอต่อไป (API)"""
-    video = get_next_video()
+    video = get_next_video(selected_room())
     if video:
-        return jsonify({
-            "video_url": video['url'],
-            "video_name": video['name'],
-            "timestamp": format_timestamp(video['timestamp']),
-            "updated": video['updated'].isoformat() if hasattr(video['updated'], 'isoformat') else str(video['updated'])
-        })
+        return jsonify(video_payload(video))
     return jsonify({"error": "No videos available"}), 404
 
-@app.route('/plot_move_rate')
-def plot_move_rate():
-    """สร้างกราฟระดับการเคลื่อนไหว"""
-    data = fetch_data_from_firestore()
-    if not data:
-        return "No data available", 404
+@app.route(MEDIA_URL + '<path:name>')
+def media(name):
+    """ไฟล์วิดีโอของที่เก็บในเครื่อง (store.backend = "local") ที่ public_url ชี้มา"""
+    if store.backend != "local":
+        abort(404)
+    blob = bucket.get_blob(name)
+    if blob is None:
+        abort(404)
+    # conditional=True รองรับ Range request ให้ <video> เลื่อนดูได้
+    return send_file(blob.local_path, mimetype=blob.content_type or 'video/mp4', conditional=True)
 
-    df = pd.DataFrame(data)
-    mapping = {"Very Low": 0, "Low": 1, "Medium": 2, "High": 3, "Very High": 4}
-    df["move_rate_value"] = df["move_rate"].map(mapping)
+MOVE_RATE_LEVELS = {"Very Low": 0, "Low": 1, "Medium": 2, "High": 3, "Very High": 4}
 
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df["timestamp"], df["move_rate_value"], marker='o')
-    ax.set_title("Movement Rate Over Time")
-    ax.set_xlabel("Time")
-    ax.set_ylabel("Movement Level")
-    ax.set_yticks(list(mapping.values()))
-    ax.set_yticklabels(list(mapping.keys()))
-    plt.xticks(rotation=45)
-    fig.tight_layout()
+# แคชรูปกราฟที่วาดแล้ว: (ชื่อกราฟ, ห้อง) -> (version ของข้อมูล, etag, png bytes)
+render_cache = {}
+render_lock = threading.Lock()
 
+def data_digest(data):
+    """ลายเซ็นของข้อมูล ใช้เป็น ETag (เหมือนกันทุก worker ถ้าข้อมูลเหมือนกัน)"""
+    return hashlib.sha1(repr(data).encode("utf-8")).hexdigest()[:16]
+
+def build_series(data):
+    """แปลงข้อมูลแดชบอร์ดเป็น series สำหรับวาดกราฟ"""
+    return {
+        "labels": [row["timestamp"] for row in data],
+        "num_people": [row["num_people"] for row in data],
+        "move_rate": [row["move_rate"] for row in data],
+        "move_rate_value": [MOVE_RATE_LEVELS.get(row["move_rate"]) for row in data],
+    }
+
+def render_png(fig):
+    FigureCanvasAgg(fig)
     buf = BytesIO()
     fig.savefig(buf, format='png')
-    buf.seek(0)
-    return Response(buf.getvalue(), mimetype='image/png')
+    return buf.getvalue()
 
-@app.route('/plot_people_count')
-def plot_people_count():
-    """สร้างกราฟจำนวนคน"""
-    data = fetch_data_from_firestore()
-    if not data:
-        return "No data available", 404
+def render_move_rate(series):
+    """วาดกราฟระดับการเคลื่อนไหว"""
+    # ใช้ Figure โดยตรงแทน pyplot จึงไม่มีรูปค้างอยู่ใน registry ของ pyplot
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    values = [float("nan") if v is None else v for v in series["move_rate_value"]]
+    ax.plot(series["labels"], values, marker='o')
+    ax.set_title("Movement Rate Over Time")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Movement Level")
+    ax.set_yticks(list(MOVE_RATE_LEVELS.values()))
+    ax.set_yticklabels(list(MOVE_RATE_LEVELS.keys()))
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return render_png(fig)
 
-    df = pd.DataFrame(data)
-    fig, ax = plt.subplots(figsize=(10, 5))
-    bars = ax.bar(df["timestamp"], df["num_people"])
+def render_people_count(series):
+    """วาดกราฟจำนวนคน"""
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    bars = ax.bar(series["labels"], series["num_people"])
     for bar in bars:
         ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(),
                 f'{int(bar.get_height())}', ha='center', va='bottom')
     ax.set_title("People Count Over Time")
     ax.set_xlabel("Time")
     ax.set_ylabel("Number of People")
-    plt.xticks(rotation=45)
+    ax.tick_params(axis='x', labelrotation=45)
     fig.tight_layout()
+    return render_png(fig)
 
-    buf = BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    return Response(buf.getvalue(), mimetype='image/png')
+CHART_RENDERERS = {
+    "move_rate": render_move_rate,
+    "people_count": render_people_count,
+}
+
+def get_chart(name, room=None):
+    """คืนค่า (etag, png) ของกราฟ วาดใหม่เฉพาะเมื่อข้อมูลเปลี่ยน version"""
+    version, data = get_dashboard_cache(room).snapshot()
+    if not data:
+        return None, None
+
+    key = (name, room)
+    cached = render_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+
+    with render_lock:
+        # request อื่นอาจวาด version นี้เสร็จแล้วระหว่างรอ lock
+        cached = render_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+        etag = f"{name}-{data_digest(data)}"
+        png = CHART_RENDERERS[name](build_series(data))
+        render_cache[key] = (version, etag, png)
+        logger.info(f"Rendered {name} chart for {room or 'all rooms'}, data version {version}")
+        return etag, png
+
+def conditional_response(etag, body, mimetype):
+    """ตอบ 304 ถ้า browser มีข้อมูล version นี้อยู่แล้ว (If-None-Match)"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # ให้ browser ถามทุกครั้ง แต่ได้แค่ 304 ถ้าข้อมูลไม่เปลี่ยน
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def chart_response(name):
+    etag, png = get_chart(name, selected_room())
+    if png is None:
+        return "No data available", 404
+    return conditional_response(etag, png, 'image/png')
+
+@app.route('/plot_move_rate')
+def plot_move_rate():
+    """กราฟระดับการเคลื่อนไหว (PNG จากแคช)"""
+    return chart_response("move_rate")
+
+@app.route('/plot_people_count')
+def plot_people_count():
+    """กราฟจำนวนคน (PNG จากแคช)"""
+    return chart_response("people_count")
+
+def series_payload(data):
+    series = build_series(data)
+    series["levels"] = list(MOVE_RATE_LEVELS.keys())
+    # ลายเซ็นของข้อมูล ไม่ใช่ version ของแคช (ตัวนับแยกกันในแต่ละ worker process)
+    series["version"] = data_digest(data)
+    return series
+
+@app.route('/api/series')
+def api_series():
+    """ข้อมูลกราฟแบบ JSON ให้หน้าเว็บวาดกราฟเอง"""
+    data = get_dashboard_cache(selected_room()).get()
+    series = series_payload(data)
+    return conditional_response(f"series-{series['version']}", json.dumps(series), 'application/json')
+
+# ส่ง comment ทุก ๆ กี่วินาทีเมื่อไม่มีข้อมูลใหม่ กัน proxy ตัดการเชื่อมต่อ
+EVENTS_KEEPALIVE_SECONDS = 15
+# browser เชื่อมต่อใหม่หลังหลุดภายในกี่มิลลิวินาที
+EVENTS_RETRY_MS = 5000
+# แต่ละสตรีมค้าง thread ของ worker ไว้หนึ่งตัว จึงจำกัดจำนวนต่อ worker ให้น้อยกว่า --threads
+# เกินจากนี้ตอบ 503 และหน้าเว็บเปลี่ยนไปใช้ polling แทน (thread ที่เหลือไว้ตอบ request ปกติ)
+MAX_EVENT_STREAMS = int(os.environ.get("SMARTCLASS_MAX_EVENT_STREAMS", "4"))
+EVENTS_BUSY_RETRY_SECONDS = 60
+event_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def newest_video_name(data):
+    # data เรียงเก่าสุดไปใหม่สุด (load_dashboard_data)
+    return data[-1].get("video_name") if data else None
+
+def event_stream(room):
+    """series เมื่อแคชแดชบอร์ดเปลี่ยน และ video เมื่อมีคลิปใหม่ (ทุกสตรีมรอแคชตัวเดียวกัน)"""
+    cache = get_dashboard_cache(room)
+    version, data = cache.snapshot()
+    yield f"retry: {EVENTS_RETRY_MS}\n\n"
+    yield sse("series", series_payload(data))
+    newest = newest_video_name(data)
+    while True:
+        new_version, data = cache.wait(version, EVENTS_KEEPALIVE_SECONDS)
+        if new_version == version:
+            yield ": keepalive\n\n"
+            continue
+        version = new_version
+        yield sse("series", series_payload(data))
+        if newest_video_name(data) not in (None, newest):
+            newest = newest_video_name(data)
+            video = get_video_queue(room).latest(newest)
+            if video:
+                yield sse("video", video_payload(video))
+
+def release_event_slot():
+    metrics.EVENT_STREAMS.inc(-1)
+    event_slots.release()
+
+@app.route('/events')
+def events():
+    """server-sent events: ข้อมูลกราฟ/ตาราง (series) และคลิปใหม่ (video) ทันทีที่มีการเปลี่ยนแปลง"""
+    if not event_slots.acquire(blocking=False):
+        response = Response("Too many event streams on this worker, use polling\n", status=503, mimetype='text/plain')
+        response.headers["Retry-After"] = str(EVENTS_BUSY_RETRY_SECONDS)
+        return response
+    metrics.EVENT_STREAMS.inc()
+    try:
+        response = Response(event_stream(selected_room()), mimetype='text/event-stream')
+    except BaseException:
+        release_event_slot()
+        raise
+    # คืนช่องตอน server ปิด response (browser ปิดหน้าเว็บ: server จะรู้ตอนเขียนครั้งถัดไป
+    # ไม่เกิน EVENTS_KEEPALIVE_SECONDS) ทำงานแม้ generator ยังไม่เคยเริ่ม
+    response.call_on_close(release_event_slot)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"   # nginx: ส่งทันทีไม่ต้อง buffer
+    return response
+
+HISTORY_DEFAULT_DAYS = 7
+
+def history_bound(name, default):
+    """?from= / ?to= เป็น ISO 8601 หรือ epoch วินาที (ไม่มี timezone ถือเป็นเวลาไทย)"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        epoch = float(value)
+    except ValueError:
+        epoch = None
+    try:
+        when = parser.isoparse(value) if epoch is None else datetime.fromtimestamp(epoch, rollups.LOCAL_TZ)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=rollups.LOCAL_TZ)
+        return when.astimezone(rollups.LOCAL_TZ)
+    except (ValueError, OverflowError, OSError):
+        # nan / inf / epoch หรือวันที่นอกช่วงที่ datetime รองรับ
+        abort(400, description=f"Bad {name}: {value}")
+
+@app.route('/api/history')
+def api_history():
+    """ประวัติจำนวนคนและการเคลื่อนไหวช่วง from..to จาก rollup (ไม่อ่านเอกสารดิบ)
+
+    เลือก rollup ที่หยาบที่สุดที่ยังได้ครบ points จุด แล้วรวมเหลือไม่เกิน points จุด
+    """
+    room = selected_room()
+    end = history_bound("to", datetime.now(rollups.LOCAL_TZ))
+    try:
+        default_start = end - timedelta(days=HISTORY_DEFAULT_DAYS)
+    except OverflowError:
+        abort(400, description="Bad to")
+    start = history_bound("from", default_start)
+    try:
+        points = int(request.args.get("points", rollups.HISTORY_POINTS))
+    except ValueError:
+        abort(400, description="Bad points")
+    if start >= end:
+        abort(400, description="from must be before to")
+    history = rollups.history(db, start, end, room, points=max(1, min(points, rollups.MAX_POINTS)))
+    return conditional_response(f"history-{data_digest(history)}", json.dumps(history), 'application/json')
+
+def clip_series(collection, field, video):
+    """series ของคลิปจากเอกสารแรกที่ field == video (None ถ้าไม่มี)"""
+    docs = list(db.collection(collection).where(field, "==", video).limit(1).stream())
+    metrics.count_reads(collection, len(docs))
+    data = docs[0].to_dict().get("series") if docs else None
+    return series_codec.decode(data) if data else None
+
+@app.route('/api/clip_series')
+def api_clip_series():
+    """ไทม์ไลน์รายวินาทีของคลิปจาก series ที่เก็บไว้ ไม่ต้องถอดรหัสวิดีโอ
+
+    ?video= เป็นชื่อไฟล์ (fileName / video_name ในแถวของแดชบอร์ด) หรือชื่อ blob เต็ม (videos/...)
+    """
+    video = request.args.get("video")
+    if not video:
+        abort(400, description="Missing video")
+    # moverate.video_path และ people_counter.video_name เก็บชื่อ blob เต็ม
+    blob_name = video if video.startswith(VIDEO_PREFIX) else VIDEO_PREFIX + video
+    try:
+        movement = clip_series("moverate", "video_path", blob_name)
+        people = clip_series("people_counter", "video_name", blob_name)
+    except ValueError as e:
+        abort(500, description=str(e))
+    if movement is None and people is None:
+        abort(404, description=f"No series for {video}")
+
+    result = {"video": video, "start": (movement or people)["start"], "step": (movement or people)["step"]}
+    if movement is not None:
+        scores = movement["movement"].astype(float)
+        result["movement"] = [round(score, 3) for score in scores.tolist()]
+        result["movement_level"] = [rollups.get_level(score) for score in scores.tolist()]
+    if people is not None:
+        result["occupancy"] = people["occupancy"].tolist()
+    return conditional_response(f"clip-{data_digest(result)}", json.dumps(result), 'application/json')
 
 if __name__ == "__main__":
+    # สำหรับพัฒนาเท่านั้น; ใช้งานจริงรันผ่าน wsgi.py (หลาย worker)
     # อัปเดตคิววิดีโอครั้งแรกก่อนเริ่มเซิร์ฟเวอร์
     update_video_queue()
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
\ No newline at end of file
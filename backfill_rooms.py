@@ -0,0 +1,69 @@
+from config import get_config
+from ledger import VIDEO_PREFIX
+from metrics import count_reads
+
+# One-time migration: add the "room" field to documents written before rooms
+# existed (cameras.json). The dashboard and the video queue ask Firestore for
+# one room's documents with where("room", "==", room), which never matches a
+# document without the field, so untagged videos / results would be hidden
+# from every room. The room comes from the clip's camera (blob name prefix,
+# see config.camera_for_video); clips from before the registry belong to the
+# first camera. Safe to run again: tagged documents are left alone.
+#
+#   python backfill_rooms.py            count untagged documents
+#   python backfill_rooms.py --apply    write the room field
+
+# ===== Config =====
+# collection -> field holding the clip it belongs to
+CLIP_FIELDS = {
+    "videos": "fileName",
+    "people_counter": "video_name",
+    "moverate": "video_path",
+}
+BATCH_SIZE = 400            # Firestore batches hold at most 500 writes
+
+
+# ===== Backfill =====
+def room_for(collection, data):
+    """Room of an untagged document, from the clip it was made from."""
+    name = data.get(CLIP_FIELDS[collection]) or ""
+    if collection == "videos":
+        name = f"{VIDEO_PREFIX}{name}"
+    return get_config().camera_for_video(name).room
+
+
+def backfill_rooms(db, apply=False, batch_size=BATCH_SIZE):
+    """Tag every document without a room; returns {collection: untagged count}."""
+    untagged = {}
+    for collection in CLIP_FIELDS:
+        updates = []
+        reads = 0
+        for doc in db.collection(collection).stream():
+            reads += 1
+            data = doc.to_dict()
+            if not data.get("room"):
+                updates.append((doc.id, room_for(collection, data)))
+        count_reads(collection, reads)
+        untagged[collection] = len(updates)
+        if not apply:
+            continue
+        for i in range(0, len(updates), batch_size):
+            batch = db.batch()
+            for doc_id, room in updates[i:i + batch_size]:
+                batch.set(db.collection(collection).document(doc_id), {"room": room}, merge=True)
+            batch.commit()
+    return untagged
+
+
+if __name__ == "__main__":
+    import argparse
+    from datastore import get_store
+
+    arg_parser = argparse.ArgumentParser(description="Add the room field to documents written before rooms")
+    arg_parser.add_argument("--apply", action="store_true", help="write the room field (default: only count)")
+    args = arg_parser.parse_args()
+
+    for name, count in backfill_rooms(get_store().db, apply=args.apply).items():
+        print(f"🏷️ {name}: {count} document(s) without a room{' tagged' if args.apply and count else ''}")
+    if not args.apply:
+        print("Run again with --apply to tag them")
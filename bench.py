@@ -0,0 +1,470 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import cv2
+import numpy as np
+
+from config import Camera, get_config
+
+# End-to-end benchmark on synthetic classroom clips, run against the local
+# store (datastore.py) so no network or camera is involved:
+#
+#   encode        synthetic frames -> H.264 clip (H264Writer)
+#   upload        clip -> store, with its videos document (uploadclip)
+#   decode        clip -> frames (stream_download.open_blob)
+#   detect_track  YOLO + tracker (PeopleCounter, metrics only)
+#   line_count    LineCounter on the generator's ground-truth tracks
+#   optical_flow  MovementScorer
+#   analyze_clip  the fused clip stage end to end, annotated output included
+#   dashboard     /, /plot_move_rate, /plot_people_count, /next_video, /api/series
+#
+# Stages report frames/s, endpoints ms/request, and peak RSS is sampled after
+# each stage. Results go to a JSON file; --baseline compares against an older
+# one and exits with 1 if anything got slower than --tolerance.
+#
+# The figures are drawn silhouettes, so the detector may not find them; the
+# detection counts are reported but are not an accuracy measure (eval_stride.py
+# is). Line counting is checked against the crossings the generator produced.
+
+DEFAULT_OUTPUT = "bench_results.json"
+ENDPOINTS = ["/", "/plot_move_rate", "/plot_people_count", "/next_video", "/api/series", "/api/history"]
+BENCH_CAMERA_ID = "bench"
+BENCH_ROOM = "BenchRoom"
+
+
+# ===== Synthetic clips =====
+class SyntheticClassroom:
+    """A static classroom with figures walking up and down across the counting line."""
+
+    def __init__(self, width, height, fps, figures, seed=0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.rng = np.random.default_rng(seed)
+        self.line = ((0, int(height * 0.55)), (width - 1, int(height * 0.45)))
+        self.background = self._background()
+        self.next_id = 1
+        self.figures = [self._spawn(initial=True) for _ in range(figures)]
+
+    def _background(self):
+        frame = np.full((self.height, self.width, 3), (200, 196, 188), dtype=np.uint8)
+        cv2.rectangle(frame, (0, 0), (self.width, int(self.height * 0.3)), (170, 160, 150), -1)
+        desk_w, desk_h = self.width // 10, self.height // 14
+        for row in range(3):
+            for col in range(5):
+                x = int(self.width * (0.08 + col * 0.18))
+                y = int(self.height * (0.38 + row * 0.2))
+                cv2.rectangle(frame, (x, y), (x + desk_w, y + desk_h), (60, 90, 130), -1)
+        return frame
+
+    def _spawn(self, initial=False):
+        size = self.height * self.rng.uniform(0.18, 0.28)
+        down = self.rng.random() < 0.5
+        if initial:
+            y = self.rng.uniform(0, self.height)
+        else:
+            y = -size / 2 if down else self.height + size / 2
+        figure = {
+            "id": self.next_id,
+            "x": self.rng.uniform(0.1, 0.9) * self.width,
+            "y": y,
+            "vy": (1 if down else -1) * self.rng.uniform(0.15, 0.35) * self.height / self.fps,
+            "size": size,
+            "color": tuple(int(c) for c in self.rng.integers(20, 235, 3)),
+            "phase": self.rng.uniform(0, 2 * np.pi),
+        }
+        self.next_id += 1
+        return figure
+
+    def _draw(self, frame, figure, frame_idx):
+        x, y, s = figure["x"], figure["y"], figure["size"]
+        swing = np.sin(figure["phase"] + frame_idx * 0.4) * s * 0.12
+        head = (int(x), int(y - s * 0.38))
+        cv2.circle(frame, head, int(s * 0.1), (150, 180, 220), -1)
+        cv2.ellipse(frame, (int(x), int(y - s * 0.08)), (int(s * 0.16), int(s * 0.22)), 0, 0, 360,
+                    figure["color"], -1)
+        for side in (-1, 1):
+            foot = (int(x + side * swing), int(y + s * 0.5))
+            cv2.line(frame, (int(x), int(y + s * 0.1)), foot, (50, 50, 60), max(2, int(s * 0.06)))
+
+    def frames(self, count):
+        """Yield (frame, boxes, ids); a figure leaving the frame comes back as a new track."""
+        for frame_idx in range(count):
+            frame = self.background.copy()
+            boxes, ids = [], []
+            for i, figure in enumerate(self.figures):
+                figure["y"] += figure["vy"]
+                if figure["y"] < -figure["size"] or figure["y"] > self.height + figure["size"]:
+                    figure = self.figures[i] = self._spawn()
+                self._draw(frame, figure, frame_idx)
+                half_w, half_h = figure["size"] * 0.25, figure["size"] / 2
+                boxes.append((figure["x"] - half_w, figure["y"] - half_h,
+                              figure["x"] + half_w, figure["y"] + half_h))
+                ids.append(figure["id"])
+            yield frame, np.array(boxes, dtype=np.float64).reshape(-1, 4), np.array(ids, dtype=np.int64)
+
+
+def expected_crossings(tracks, line):
+    """Crossings of the (full-width) line by the track centers, counted geometrically."""
+    (x1, y1), (x2, y2) = line
+    last_side = {}
+    crossings = 0
+    for boxes, ids in tracks:
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        sides = cy >= y1 + (y2 - y1) * (cx - x1) / (x2 - x1)
+        for tid, side in zip(ids.tolist(), sides.tolist()):
+            if tid in last_side and last_side[tid] != side:
+                crossings += 1
+            last_side[tid] = side
+    return crossings
+
+
+# ===== Measurement =====
+def peak_rss_mb():
+    """Peak resident memory of this process so far (None if it cannot be read)."""
+    try:
+        import resource
+    except ImportError:     # Windows
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1024 ** 2, 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def stage_result(frames, seconds, **extra):
+    return {
+        "frames": frames,
+        "seconds": round(seconds, 4),
+        "fps": round(frames / seconds, 2) if seconds else None,
+        **extra,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, timeout=10, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ===== Stages =====
+def configure(data_dir, width, height):
+    """Point the pipeline at a fresh local store and a single bench camera (before importing it)."""
+    config = get_config()
+    config.store = "local"
+    config.store_path = data_dir
+    config.cameras = [Camera(
+        id=BENCH_CAMERA_ID, room=BENCH_ROOM, stream_url="testsrc",
+        lines=[{"name": "door", "start": [0, int(height * 0.55)], "end": [width - 1, int(height * 0.45)]}],
+    )]
+    return config.cameras[0]
+
+
+def bench_encode(scene, path, frame_count):
+    from counter_people import H264Writer
+
+    writer = H264Writer(path, scene.fps, scene.width, scene.height)
+    tracks = []
+    seconds = 0.0
+    try:
+        for frame, boxes, ids in scene.frames(frame_count):
+            tracks.append((boxes, ids))
+            t0 = time.perf_counter()
+            writer.write(frame)
+            seconds += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        writer.release()
+        seconds += time.perf_counter() - t0
+    except BaseException:
+        writer.abort()
+        raise
+    return stage_result(frame_count, seconds, mbytes=round(os.path.getsize(path) / 1024 ** 2, 2)), tracks
+
+
+def bench_upload(db, bucket, path, camera):
+    from uploadclip import upload_to_firebase
+
+    t0 = time.perf_counter()
+    name = upload_to_firebase(db, bucket, path, camera)
+    seconds = time.perf_counter() - t0
+    size_mb = os.path.getsize(path) / 1024 ** 2
+    return {"ms": round(seconds * 1000, 2), "mb_per_s": round(size_mb / seconds, 1) if seconds else None,
+            "peak_rss_mb": peak_rss_mb()}, name
+
+
+def bench_analysis(blob, model, camera, stride, batch):
+    """decode, detect_track and optical_flow, timed separately in one pass over the clip."""
+    from counter_people import PeopleCounter
+    from stream_download import open_blob
+    from test2 import MovementScorer
+
+    timings = {"decode": 0.0, "detect_track": 0.0, "optical_flow": 0.0}
+    cap = open_blob(blob)
+    try:
+        t0 = time.perf_counter()
+        ret, frame = cap.read()
+        timings["decode"] += time.perf_counter() - t0
+        if not ret:
+            raise RuntimeError(f"Cannot read video frames: {blob.name}")
+        frame_h, frame_w = frame.shape[:2]
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        counter = PeopleCounter(model, frame_w, frame_h, stride=stride, verbose=False, batch_size=batch,
+                                fps=fps, lines=camera.counting_lines(frame_w, frame_h), draw=False)
+        scorer = MovementScorer(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), fps=fps)
+        scorer.start(frame)
+
+        frames = 1
+        while True:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            t1 = time.perf_counter()
+            timings["decode"] += t1 - t0
+            if not ret:
+                break
+            frames += 1
+            scorer.update(frame)
+            t2 = time.perf_counter()
+            counter.feed(frame)
+            t3 = time.perf_counter()
+            timings["optical_flow"] += t2 - t1
+            timings["detect_track"] += t3 - t2
+        t0 = time.perf_counter()
+        counter.flush()
+        timings["detect_track"] += time.perf_counter() - t0
+    finally:
+        cap.release()
+
+    return {
+        "decode": stage_result(frames, timings["decode"]),
+        "detect_track": stage_result(frames, timings["detect_track"], stride=stride, batch=batch,
+                                     counted_in=counter.in_count, counted_out=counter.out_count),
+        "optical_flow": stage_result(frames, timings["optical_flow"], mode=scorer.mode),
+    }
+
+
+def bench_line_count(tracks, line):
+    from line_counter import LineCounter
+
+    counter = LineCounter([("door", *line)])
+    t0 = time.perf_counter()
+    for frame_idx, (boxes, ids) in enumerate(tracks, start=1):
+        counter.update(frame_idx, boxes, ids)
+    seconds = time.perf_counter() - t0
+    return stage_result(len(tracks), seconds, counted=counter.in_count + counter.out_count,
+                        expected=expected_crossings(tracks, line))
+
+
+def bench_analyze_clip(db, bucket, blob, model, data_dir):
+    from analyze_clip import analyze_clip
+    from ledger import Ledger
+
+    ledger = Ledger(os.path.join(data_dir, "ledger.db"))
+    try:
+        t0 = time.perf_counter()
+        analyze_clip(db, bucket, model, blob, ledger=ledger, annotate=True)
+        seconds = time.perf_counter() - t0
+    finally:
+        ledger.close()
+    frames = int(cv2.VideoCapture(blob.local_path).get(cv2.CAP_PROP_FRAME_COUNT))
+    return stage_result(frames, seconds)
+
+
+def seed_history(db, rows, room):
+    """Older videos / people_counter / moverate documents and their rollups, so the dashboard queries have work to do."""
+    import rollups
+
+    now = datetime.now(timezone.utc)
+    bangkok = timezone(timedelta(hours=7))
+    rng = np.random.default_rng(1)
+    for start in range(0, rows, 400):
+        batch = db.batch()
+        for i in range(start, min(rows, start + 400)):
+            ts = now - timedelta(minutes=5 * (i + 1))
+            score = float(rng.uniform(0, 2.5))
+            batch.set(db.collection("videos").document(f"history_{i}"), {
+                "fileName": f"{BENCH_CAMERA_ID}_history_{i}.mp4", "room": room, "timestamp": ts})
+            people = {"room": room, "timestamp": ts.astimezone(bangkok).isoformat(timespec="microseconds"),
+                      "in": int(rng.integers(0, 10)), "out": int(rng.integers(0, 10)),
+                      "total_count": int(rng.integers(0, 40))}
+            batch.set(db.collection("people_counter").document(f"history_{i}"), people)
+            batch.set(db.collection("moverate").document(f"history_{i}"), {
+                "room": room, "timestamp": ts, "overall_score": round(score, 2),
+                "overall_level": rollups.get_level(score)})
+            rollups.add(batch, db, room, ts, people=people, movement=round(score, 2))
+        batch.commit()
+
+
+def bench_dashboard(requests):
+    import app as dashboard
+
+    client = dashboard.app.test_client()
+    results = {}
+    for endpoint in ENDPOINTS:
+        t0 = time.perf_counter()
+        response = client.get(endpoint)
+        cold_ms = (time.perf_counter() - t0) * 1000
+        samples = []
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            response = client.get(endpoint)
+            samples.append((time.perf_counter() - t0) * 1000)
+        results[endpoint] = {
+            "status": response.status_code,
+            "cold_ms": round(cold_ms, 2),
+            "mean_ms": round(float(np.mean(samples)), 2),
+            "p50_ms": round(float(np.percentile(samples, 50)), 2),
+            "p95_ms": round(float(np.percentile(samples, 95)), 2),
+            "requests": requests,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    for cache in list(dashboard.dashboard_caches.values()):
+        cache.stop()
+    return results
+
+
+def run(args, data_dir):
+    camera = configure(data_dir, args.width, args.height)
+    from counter_people import initialize_firebase, load_model
+
+    db, bucket = initialize_firebase()
+    frame_count = int(args.seconds * args.fps)
+    scene = SyntheticClassroom(args.width, args.height, args.fps, args.figures, seed=args.seed)
+    clip_path = os.path.join(data_dir, f"{camera.file_prefix}{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.mp4")
+
+    stages = {}
+    print(f"🎬 Encoding {frame_count} synthetic frames ({args.width}x{args.height} @ {args.fps} FPS)...")
+    stages["encode"], tracks = bench_encode(scene, clip_path, frame_count)
+
+    print("☁️ Uploading to the local store...")
+    stages["upload"], blob_name = bench_upload(db, bucket, clip_path, camera)
+    blob = bucket.get_blob(blob_name)
+
+    print(f"🧠 Loading the {args.backend} model...")
+    model = load_model(args.backend)
+
+    print("🔍 Decode / detect + track / optical flow...")
+    stages.update(bench_analysis(blob, model, camera, args.stride, args.batch))
+    stages["line_count"] = bench_line_count(tracks, scene.line)
+
+    print("🔁 Fused clip analysis (analyze_clip)...")
+    stages["analyze_clip"] = bench_analyze_clip(db, bucket, blob, load_model(args.backend), data_dir)
+
+    print(f"📊 Dashboard ({args.history} history rows, {args.requests} requests per endpoint)...")
+    seed_history(db, args.history, camera.room)
+    endpoints = bench_dashboard(args.requests)
+
+    return {
+        "version": git_version(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "system": platform.platform(),
+                     "machine": platform.machine(), "cpus": os.cpu_count(), "opencv": cv2.__version__},
+        "params": {key: getattr(args, key) for key in
+                   ("width", "height", "fps", "seconds", "figures", "seed", "backend", "stride", "batch",
+                    "history", "requests")},
+        "stages": stages,
+        "endpoints": endpoints,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# ===== Report =====
+def print_report(results):
+    print(f"\n{'stage':<14} {'fps':>10} {'seconds':>9} {'peak MB':>8}")
+    for name, stage in results["stages"].items():
+        if "fps" in stage:
+            print(f"{name:<14} {stage['fps'] or 0:>10.1f} {stage['seconds']:>9.3f} {stage['peak_rss_mb'] or 0:>8.0f}")
+        else:
+            print(f"{name:<14} {stage['ms']:>8.1f}ms {'':>9} {stage['peak_rss_mb'] or 0:>8.0f}")
+    print(f"\n{'endpoint':<20} {'status':>6} {'cold ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for endpoint, row in results["endpoints"].items():
+        print(f"{endpoint:<20} {row['status']:>6} {row['cold_ms']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}")
+    line = results["stages"]["line_count"]
+    print(f"\nLine counting: {line['counted']} of {line['expected']} generated crossings counted")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+
+
+def compare(results, baseline, tolerance):
+    """Print the change per metric against an older run; returns the regressions."""
+    metrics = []
+    for name, stage in results["stages"].items():
+        old = baseline.get("stages", {}).get(name, {})
+        if stage.get("fps") and old.get("fps"):
+            metrics.append((f"{name} fps", old["fps"], stage["fps"], True))
+        elif stage.get("ms") and old.get("ms"):
+            metrics.append((f"{name} ms", old["ms"], stage["ms"], False))
+    for endpoint, row in results["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(endpoint, {})
+        if old.get("p50_ms"):
+            metrics.append((f"{endpoint} p50 ms", old["p50_ms"], row["p50_ms"], False))
+    if results.get("peak_rss_mb") and baseline.get("peak_rss_mb"):
+        metrics.append(("peak RSS MB", baseline["peak_rss_mb"], results["peak_rss_mb"], False))
+
+    print(f"\nAgainst {baseline.get('version') or 'baseline'} (tolerance {tolerance:.0%}):")
+    regressions = []
+    for label, old, new, higher_is_better in metrics:
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = "❌" if worse > tolerance else "✅"
+        print(f"{mark} {label:<28} {old:>10.1f} -> {new:>10.1f} ({change:+.1%})")
+        if worse > tolerance:
+            regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic classroom clips")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--seconds", type=float, default=20, help="clip length")
+    parser.add_argument("--figures", type=int, default=6, help="people walking in the clip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="pytorch", choices=["pytorch", "onnx", "openvino"])
+    parser.add_argument("--stride", type=int, default=1, help="detection stride")
+    parser.add_argument("--batch", type=int, default=1, help="frames per detector call")
+    parser.add_argument("--history", type=int, default=500, help="older documents per collection for the dashboard")
+    parser.add_argument("--requests", type=int, default=20, help="requests per dashboard endpoint")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON results file")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown against --baseline")
+    parser.add_argument("--keep", metavar="DIR", help="keep the local store in DIR instead of a temp dir")
+    args = parser.parse_args()
+
+    data_dir = args.keep or tempfile.mkdtemp(prefix="smartclass-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        results = run(args, data_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import os
+import queue
+from collections import deque
+import threading
+import time
+import traceback
+
+import uploadclip
+from metrics import QUEUE_DEPTH, start_exporter
+
+# ===== Config =====
+SPOOL_DIR = "videos"                      # โฟลเดอร์พักไฟล์ segment ก่อนอัปโหลด (แยกโฟลเดอร์ย่อยตามกล้อง)
+QUEUE_SIZE = 4                            # จำนวนงานสูงสุดที่รอในแต่ละคิว (back-pressure)
+SPOOL_LIMIT_BYTES = 2 * 1024 ** 3         # พื้นที่สูงสุดของไฟล์ที่รออัปโหลด ถ้าเกินจะทิ้งไฟล์เก่าสุด
+TRANSCODE_SEGMENTS = False                # True = แปลงเป็น H.264 ก่อนอัปโหลด (เช่นกล้องส่ง H.265)
+RECORDER_RESTART_SECONDS = 5
+UPLOAD_ATTEMPTS = 5                       # อัปโหลดไม่สำเร็จติดกันเกินนี้จะพัก segment ไว้แล้วส่งเข้าคิวใหม่ภายหลัง
+UPLOAD_RETRY_MAX_SECONDS = 1800           # ระยะพักสูงสุด (เพิ่มเป็นเท่าตัวทุกครั้งที่พักซ้ำ)
+
+
+class CapturePipeline:
+    """บันทึก / แปลงไฟล์ / อัปโหลด / แจ้งตัววิเคราะห์ แบบทำงานพร้อมกัน
+
+    record (ffmpeg segment muxer, บันทึกต่อเนื่อง)
+      -> encode_q -> encode (ผ่านตรงถ้าเป็น stream copy)
+      -> upload_q -> upload (Storage + เอกสาร videos)
+      -> notify_q -> notify (เรียก on_uploaded เช่นสั่งให้ worker วิเคราะห์)
+
+    ทุกคิวมีขนาดจำกัด ถ้าอัปโหลดช้ากว่ากล้อง ไฟล์จะค้างใน SPOOL_DIR
+    และเมื่อเกิน SPOOL_LIMIT_BYTES จะลบ segment ที่เก่าที่สุดที่ยังไม่ได้อัปโหลดทิ้ง
+    segment ที่อัปโหลดไม่สำเร็จจะถูกพักแล้วส่งเข้าคิวใหม่ และไฟล์ที่ค้างใน spool_dir
+    จากครั้งก่อน (เช่นเครื่องดับ) จะถูกส่งเข้าคิวตอนเริ่ม
+    กล้องจึงถูกบันทึกต่อเนื่อง และเวลาต่อคลิปขึ้นกับขั้นที่ช้าที่สุด ไม่ใช่ผลรวมทุกขั้น
+    """
+
+    def __init__(self, db, bucket, camera=uploadclip.DEFAULT_CAMERA, source=None,
+                 spool_dir=None, on_uploaded=None, live=False):
+        self.db = db
+        self.bucket = bucket
+        self.camera = camera
+        self.live = live          # True = เก็บถาวรอย่างเดียว กล้องนี้ถูกวิเคราะห์สดอยู่แล้ว (live.py)
+        self.source = source or camera.stream_url
+        self.segment_sec = camera.clip_seconds
+        self.spool_dir = spool_dir or os.path.join(SPOOL_DIR, camera.id)
+        self.on_uploaded = on_uploaded
+
+        self.stop_event = threading.Event()
+        self.encode_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.upload_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.notify_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.backlog = deque()    # segment ที่บันทึกเสร็จแต่คิว encode ยังเต็ม (อยู่บนดิสก์)
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+        self.retry = []           # (เวลาที่จะส่งใหม่, path) ของ segment ที่อัปโหลดไม่สำเร็จ ใช้ in_flight_lock
+        self.failures = {}        # path -> จำนวนครั้งที่ถูกพัก
+        self.process = None
+        self.threads = []
+
+    # ----- helpers -----
+    def _put(self, q, item):
+        """ใส่งานลงคิว รอได้ถ้าคิวเต็ม (back-pressure) แต่หยุดรอเมื่อสั่งหยุด"""
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _remove(self, path):
+        with self.in_flight_lock:
+            self.in_flight.discard(path)
+        if path and os.path.exists(path):
+            os.remove(path)
+            print(f"🧹 ลบไฟล์ local แล้ว: {path}")
+
+    def _enforce_spool_limit(self, recording):
+        """ลบ segment เก่าสุดที่ยังไม่ได้เริ่มอัปโหลด เมื่อพื้นที่พักไฟล์เกินกำหนด"""
+        files = []
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith(".mp4") and path != recording:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= SPOOL_LIMIT_BYTES:
+                break
+            # ตรวจและลบภายใต้ lock เดียวกัน ไม่ให้ encode_loop รับไฟล์ไประหว่างนั้น
+            with self.in_flight_lock:
+                if path in self.in_flight:
+                    continue
+                os.remove(path)
+            total -= size
+            print(f"⚠️ พื้นที่พักไฟล์เต็ม ทิ้ง segment: {path}")
+
+    # ----- stage 1: record -----
+    def record_loop(self):
+        seen = set()
+        self._recover_spool(seen)
+        while not self.stop_event.is_set():
+            print(f"🔴 [{self.camera.id}] เริ่มบันทึกต่อเนื่อง ({self.segment_sec} วินาที/ไฟล์)...")
+            self.process, segment_list = uploadclip.record_segments(
+                self.source, out_dir=self.spool_dir, segment_sec=self.segment_sec,
+                prefix=self.camera.file_prefix
+            )
+            offset = 0
+            while not self.stop_event.is_set():
+                offset = self._read_segment_list(segment_list, offset, seen)
+                self._enforce_spool_limit(recording=self._newest_segment())
+                self._requeue_failed()
+                self._drain_backlog()
+                for name, depth in self.queue_depths().items():
+                    QUEUE_DEPTH.set(depth, queue=f"{self.camera.id}/{name}")
+                if self.process.poll() is not None:
+                    break
+                self.stop_event.wait(1)
+
+            if self.process.poll() is None:
+                self.process.terminate()
+                self.process.wait(timeout=10)
+            # segment สุดท้ายถูกปิดไฟล์ตอน ffmpeg จบ
+            self._read_segment_list(segment_list, offset, seen)
+            self._drain_backlog()
+
+            if not self.stop_event.is_set():
+                print(f"❌ [{self.camera.id}] ffmpeg หยุดทำงาน (code {self.process.returncode}), เริ่มใหม่ใน {RECORDER_RESTART_SECONDS} วินาที")
+                self.stop_event.wait(RECORDER_RESTART_SECONDS)
+
+    def _recover_spool(self, seen):
+        """ส่ง segment ที่ค้างใน spool_dir จากการทำงานครั้งก่อนเข้าคิว (เรียงตามชื่อ = ตามเวลา)"""
+        if not os.path.isdir(self.spool_dir):
+            return
+        names = sorted(n for n in os.listdir(self.spool_dir) if n.endswith(".mp4"))
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            seen.add(path)
+            self.backlog.append(path)
+        if names:
+            print(f"📦 [{self.camera.id}] พบ {len(names)} segment ค้างจากครั้งก่อน ส่งเข้าคิวอัปโหลด")
+
+    def _requeue_failed(self):
+        """ส่ง segment ที่พักไว้และครบเวลาแล้วกลับเข้า backlog"""
+        now = time.monotonic()
+        with self.in_flight_lock:
+            due = [path for at, path in self.retry if at <= now]
+            self.retry = [(at, path) for at, path in self.retry if at > now]
+        self.backlog.extend(due)
+
+    def _newest_segment(self):
+        segments = [os.path.join(self.spool_dir, n) for n in os.listdir(self.spool_dir) if n.endswith(".mp4")]
+        return max(segments, key=os.path.getmtime) if segments else None
+
+    def _read_segment_list(self, segment_list, offset, seen):
+        """อ่านบรรทัดใหม่ใน segment list (CSV: filename,start,end) แล้วส่งไฟล์ที่เสร็จแล้วต่อ"""
+        if not os.path.exists(segment_list):
+            return offset
+        if os.path.getsize(segment_list) < offset:
+            offset = 0  # ffmpeg เริ่มใหม่และเขียนไฟล์ใหม่ทับ
+        with open(segment_list) as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break  # ยังเขียนไม่จบบรรทัด
+                offset = f.tell()
+                name = line.split(",")[0].strip()
+                path = name if os.path.isabs(name) else os.path.join(self.spool_dir, name)
+                if name and path not in seen and os.path.exists(path):
+                    seen.add(path)
+                    self.backlog.append(path)
+        if len(seen) > 1000:
+            seen.clear()
+        return offset
+
+    def _drain_backlog(self):
+        """ส่ง segment ที่ค้างต่อให้ขั้น encode เท่าที่คิวรับได้ (ไม่รอ เพื่อให้ยังคุมพื้นที่ดิสก์ได้)"""
+        while self.backlog:
+            path = self.backlog[0]
+            if not os.path.exists(path):
+                self.backlog.popleft()  # ถูกทิ้งเพราะพื้นที่เต็ม
+                self.failures.pop(path, None)
+                continue
+            try:
+                self.encode_q.put_nowait(path)
+            except queue.Full:
+                return
+            self.backlog.popleft()
+
+    # ----- stage 2: encode -----
+    def encode_loop(self):
+        while True:
+            path = self._get(self.encode_q)
+            if path is None:
+                return
+            # จองไฟล์ก่อนตรวจว่ามีอยู่ _enforce_spool_limit จะได้ไม่ลบทิ้งระหว่างนั้น
+            with self.in_flight_lock:
+                self.in_flight.add(path)
+                exists = os.path.exists(path)
+            if not exists:
+                self._remove(path)
+                continue  # ถูกทิ้งเพราะพื้นที่เต็ม
+            if TRANSCODE_SEGMENTS and not path.endswith("_h264.mp4"):
+                path = self._transcode(path)
+            self._put(self.upload_q, path)
+
+    def _transcode(self, path):
+        """แปลงเป็น H.264 คืน path ที่จะอัปโหลด: ไฟล์ที่แปลงแล้ว หรือไฟล์ต้นฉบับถ้าแปลงไม่สำเร็จ"""
+        base, ext = os.path.splitext(path)
+        encoded = f"{base}_h264{ext}"
+        with self.in_flight_lock:
+            self.in_flight.add(encoded)
+        try:
+            ok = uploadclip.fix_mp4_metadata(path, encoded)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"❌ แปลงไฟล์ไม่สำเร็จ {path}: {str(e)}")
+            ok = False
+        if not ok:
+            # ไม่ลบไฟล์ต้นฉบับ อัปโหลดไฟล์เดิมแทน
+            print(f"⚠️ แปลงไฟล์ไม่สำเร็จ {path} อัปโหลดไฟล์ต้นฉบับแทน")
+            self._remove(encoded)
+            return path
+        self._remove(path)
+        return encoded
+
+    # ----- stage 3: upload -----
+    def upload_loop(self):
+        while True:
+            path = self._get(self.upload_q)
+            if path is None:
+                return
+            attempt = 0
+            while not self.stop_event.is_set():
+                attempt += 1
+                try:
+                    print(f"⬆️ กำลังอัปโหลด {path}...")
+                    blob_name = uploadclip.upload_to_firebase(self.db, self.bucket, path, self.camera, live=self.live)
+                    self.failures.pop(path, None)
+                    self._remove(path)
+                    self._put(self.notify_q, blob_name)
+                    break
+                except FileNotFoundError:
+                    print(f"⚠️ ไม่พบไฟล์ {path} (ถูกทิ้งไปแล้ว) ข้าม segment นี้")
+                    self.failures.pop(path, None)
+                    self._remove(path)
+                    break
+                except Exception as e:
+                    if attempt >= UPLOAD_ATTEMPTS:
+                        self._park(path, e)
+                        break
+                    # ระหว่างรอ คิวจะเต็มและไฟล์ใหม่จะพักอยู่บนดิสก์
+                    print(f"❌ อัปโหลดไม่สำเร็จ {path}: {str(e)}, ลองใหม่ใน {RECORDER_RESTART_SECONDS} วินาที "
+                          f"({attempt}/{UPLOAD_ATTEMPTS})")
+                    self.stop_event.wait(RECORDER_RESTART_SECONDS)
+
+    def _park(self, path, error):
+        """พัก segment ที่อัปโหลดไม่สำเร็จ ให้ segment ถัดไปได้อัปโหลดก่อน แล้วส่งเข้าคิวใหม่ภายหลัง
+
+        ระยะพักเพิ่มเป็นเท่าตัวทุกครั้ง ระหว่างพักไฟล์ไม่อยู่ใน in_flight
+        ถ้าพื้นที่เต็ม SPOOL_LIMIT_BYTES จึงทิ้งไฟล์นี้ได้ตามลำดับอายุ
+        """
+        failures = self.failures.get(path, 0) + 1
+        self.failures[path] = failures
+        delay = min(UPLOAD_RETRY_MAX_SECONDS, RECORDER_RESTART_SECONDS * 2 ** failures)
+        print(f"❌ อัปโหลดไม่สำเร็จ {path} ครบ {UPLOAD_ATTEMPTS} ครั้ง ลองใหม่ใน {delay} วินาที: {str(error)}")
+        with self.in_flight_lock:
+            self.in_flight.discard(path)
+            self.retry.append((time.monotonic() + delay, path))
+
+    # ----- stage 4: notify -----
+    def notify_loop(self):
+        while True:
+            blob_name = self._get(self.notify_q)
+            if blob_name is None:
+                return
+            if self.on_uploaded:
+                try:
+                    self.on_uploaded(blob_name)
+                except Exception as e:
+                    print(f"❌ แจ้งตัววิเคราะห์ไม่สำเร็จ: {str(e)}")
+
+    # ----- control -----
+    def start(self):
+        for target in (self.record_loop, self.encode_loop, self.upload_loop, self.notify_loop):
+            thread = threading.Thread(target=target, name=f"{self.camera.id}-{target.__name__}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+        for thread in self.threads:
+            thread.join(timeout=15)
+
+    def queue_depths(self):
+        return {
+            "encode": self.encode_q.qsize(),
+            "upload": self.upload_q.qsize(),
+            "notify": self.notify_q.qsize(),
+            "backlog": len(self.backlog),
+            "retry": len(self.retry),
+        }
+
+
+def start_all(db, bucket, cameras=None, on_uploaded=None, live=False):
+    """เริ่ม pipeline หนึ่งชุดต่อกล้อง (แต่ละกล้องมี ffmpeg และโฟลเดอร์พักไฟล์ของตัวเอง)"""
+    pipelines = [CapturePipeline(db, bucket, camera=camera, on_uploaded=on_uploaded, live=live)
+                 for camera in (cameras or uploadclip.CONFIG.cameras)]
+    for pipeline in pipelines:
+        pipeline.start()
+    return pipelines
+
+
+def main(source=None):
+    start_exporter("capture")
+    db, bucket = uploadclip.initialize_firebase()
+    if source:
+        pipelines = [CapturePipeline(db, bucket, source=source)]
+        pipelines[0].start()
+    else:
+        pipelines = start_all(db, bucket)
+    try:
+        while True:
+            time.sleep(60)
+            for pipeline in pipelines:
+                print(f"📊 [{pipeline.camera.id}] คิว: {pipeline.queue_depths()}")
+    except KeyboardInterrupt:
+        print("\n🛑 กำลังหยุด...")
+    finally:
+        for pipeline in pipelines:
+            pipeline.stop()
+
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,165 +1,488 @@
 import cv2
+import numpy as np
 from ultralytics import YOLO
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
 import subprocess
 import os
 
+from config import get_config
+from datastore import get_store
+from line_counter import LineCounter
+from ledger import get_ledger
+from metrics import BYTES, FRAMES, INFERENCE_SECONDS, start_exporter, timed
+from stream_download import open_blob
+import rollups
+import series_codec
+
 # ===== Config =====
-timestamp = datetime.now(ZoneInfo("Asia/Bangkok")).strftime("%Y-%m-%d_%H%M%S")
-VIDEO_PATH = "latest_video.mp4"
 MODEL_PATH = "yolov8n.pt"
-OUTPUT_FILENAME = f"{timestamp}.mp4"
-OUTPUT_PATH = OUTPUT_FILENAME
 CONF_THRESHOLD = 0.5
-FIREBASE_CRED_PATH = "smart-class-e9661-firebase-adminsdk-fbsvc-bf137255f5.json"
-FIREBASE_BUCKET = "smart-class-e9661.firebasestorage.app"
+DETECT_STRIDE = 1        # run the detector every N frames (1 = every frame)
+DETECT_FPS = None        # or: target detections per second (overrides DETECT_STRIDE)
+BACKEND = "pytorch"      # "pytorch", "onnx" (ONNX Runtime) or "openvino"
+DETECT_BATCH = 1         # frames per detector call; > 1 uses the batched predict + tracker path
+IMG_SIZE = 640
+MAX_TRACK_AGE = 60       # forget a track after this many detector runs without seeing it
+ANNOTATED_VIDEO = True   # False = metrics only: no drawing, encoding or upload, just the counts
+X264_PRESET = "veryfast"
+X264_CRF = 23
+# Cameras, rooms, counting lines, store and ffmpeg come from cameras.json (see config.py)
+CONFIG = get_config()
+DEFAULT_CAMERA = CONFIG.cameras[0]
+FFMPEG_PATH = CONFIG.ffmpeg_path
+
+
+def get_time_str():
+    return datetime.now(ZoneInfo("Asia/Bangkok")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_timestamp():
+    return datetime.now(ZoneInfo("Asia/Bangkok")).strftime("%Y-%m-%d_%H%M%S")
+
 
 # ===== Firebase Init =====
-print("Initializing Firebase...")
-cred = credentials.Certificate(FIREBASE_CRED_PATH)
-firebase_admin.initialize_app(cred, {'storageBucket': FIREBASE_BUCKET})
-db = firestore.client()
-bucket = storage.bucket()
-print("Firebase initialized.")
+def initialize_firebase():
+    """(db, bucket) of the configured store: Firebase, or local SQLite + files (see datastore.py)."""
+    store = get_store()
+    print(f"Using the {store.backend} store.")
+    return store.db, store.bucket
+
 
 # ===== Find New Video File =====
-print("Looking for new video file...")
+def find_new_video(db, bucket, ledger=None):
+    """Claim the oldest uploaded clip that has no people_counter result yet (see ledger.py)."""
+    print("Looking for new video file...")
+    ledger = ledger or get_ledger()
+    ledger.bootstrap(db, bucket)
+    ledger.discover(bucket)
+    for name in ledger.pending(stages=["people_counter"]):
+        if ledger.claim(name):
+            return bucket.blob(name)
+    return None
+
 
-# ดึงรายการที่เคยใช้ไปแล้ว
-used_video_names = set(
-    doc.to_dict().get("video_name")
-    for doc in db.collection("people_counter").stream()
-)
+# ===== Load Model =====
+EXPORT_FORMATS = {
+    "onnx": ("onnx", ".onnx"),
+    "openvino": ("openvino", "_openvino_model"),
+}
 
-# ดึง blob ทั้งหมดในโฟลเดอร์ "videos/"
-blobs = list(bucket.list_blobs(prefix="videos/"))
-new_blob = None
-for blob in sorted(blobs, key=lambda b: b.updated):
-    if blob.name.endswith(".mp4") and blob.name not in used_video_names:
-        new_blob = blob
-        break
 
-if not new_blob:
-    print("❌ No new video found to process.")
-    exit()
+def exported_model_path(backend):
+    fmt, suffix = EXPORT_FORMATS[backend]
+    return os.path.splitext(MODEL_PATH)[0] + suffix
 
-print(f"✅ New video found: {new_blob.name}")
-new_blob.download_to_filename(VIDEO_PATH)
 
-# ===== Load Model =====
-print("Loading YOLOv8 model...")
-model = YOLO(MODEL_PATH)
-print("Model loaded.")
-
-# ===== Video Setup =====
-cap = cv2.VideoCapture(VIDEO_PATH)
-if not cap.isOpened():
-    raise RuntimeError(f"Cannot open video: {VIDEO_PATH}")
-ret, frame = cap.read()
-if not ret:
-    raise RuntimeError("Cannot read video frames")
-frame_h, frame_w = frame.shape[:2]
-fps = cap.get(cv2.CAP_PROP_FPS) or 30
-fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-out = cv2.VideoWriter(OUTPUT_PATH, fourcc, fps, (frame_w, frame_h))
-print(f"Writing output to {OUTPUT_PATH}: {frame_w}x{frame_h} @ {fps:.1f} FPS")
-
-# ===== Line Position =====
-LINE_START = (0, frame_h - 50)
-LINE_END   = (frame_w - 1450, frame_h - 300)
-line_y = (LINE_START[1] + LINE_END[1]) / 2
-
-prev_positions = {}
-in_count = 0
-out_count = 0
-frame_idx = 0
-total_count = 0
+def load_model(backend=BACKEND):
+    """Load the detector for the given CPU backend.
 
-def get_time_str():
-    return datetime.now(ZoneInfo("Asia/Bangkok")).strftime("%Y-%m-%d %H:%M:%S")
+    ONNX Runtime and OpenVINO models are exported from MODEL_PATH the first
+    time they are requested and reused from disk afterwards.
+    """
+    if backend == "pytorch":
+        print("Loading YOLOv8 model...")
+        model = YOLO(MODEL_PATH)
+        print("Model loaded.")
+        return model
+
+    if backend not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    path = exported_model_path(backend)
+    if not os.path.exists(path):
+        print(f"Exporting {MODEL_PATH} for {backend} (one time)...")
+        # dynamic=True keeps the batch dimension free for batched predict
+        path = YOLO(MODEL_PATH).export(format=EXPORT_FORMATS[backend][0], imgsz=IMG_SIZE, dynamic=True)
+        print(f"Exported model cached at {path}")
+
+    print(f"Loading YOLOv8 model ({backend})...")
+    model = YOLO(path, task="detect")
+    print("Model loaded.")
+    return model
+
+
+def create_tracker(fps):
+    """ByteTracker with the same settings model.track() uses, for the batched path."""
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    from ultralytics.utils import IterableSimpleNamespace, yaml_load
+    from ultralytics.utils.checks import check_yaml
+
+    cfg = IterableSimpleNamespace(**yaml_load(check_yaml("bytetrack.yaml")))
+    return BYTETracker(args=cfg, frame_rate=max(1, int(round(fps))))
+
+
+def detection_stride(fps, stride=None, target_fps=None):
+    """Frames between detector runs, from a fixed stride or a target detection fps."""
+    if target_fps:
+        return max(1, round(fps / target_fps))
+    return max(1, int(stride or 1))
+
+
+# ===== People Counter =====
+class PeopleCounter:
+    """Tracks people frame by frame and counts crossings of the counting lines.
+
+    Frames are fed one at a time with process(), so the same decoded frame can
+    also be used by other analyzers (see analyze_clip.py).
+
+    With stride > 1 the detector/tracker only runs on every stride-th frame.
+    Crossings are counted between consecutive detections of a track, so a
+    person who crosses during skipped frames is still counted; on skipped
+    frames the boxes are carried forward along each track's last velocity.
+
+    With batch_size > 1, use feed()/flush() instead of process(): frames are
+    buffered until batch_size detection frames are waiting, the detector runs
+    once on the whole batch and the detections go through the tracker in
+    frame order.
+
+    With draw=False the frames are returned untouched (metrics only).
+    """
+
+    def __init__(self, model, frame_w, frame_h, stride=1, verbose=True, batch_size=1, fps=30, lines=None,
+                 draw=True):
+        self.model = model
+        self.draw = draw
+        self.stride = max(1, stride)
+        self.verbose = verbose
+        self.batch_size = max(1, batch_size)
+        self.tracker = create_tracker(fps / self.stride) if self.batch_size > 1 else None
+        self.pending = []
+        self._reset_track_state()
+        self.tracks = {}  # tid -> (box, velocity, frame_idx of detection, known), only when stride > 1
+        # (name, start, end) per counting line; default is the first camera's lines
+        self.lines = lines or DEFAULT_CAMERA.counting_lines(frame_w, frame_h)
+        self.line_counter = LineCounter(self.lines, max_age=MAX_TRACK_AGE * self.stride)
+        self.in_count = 0
+        self.out_count = 0
+        self.total_count = 0
+        self.frame_idx = 0
+        self.fps = fps or 30
+        self.occupancy = []       # total_count at the end of each second, see take_occupancy()
+        self.seconds_sampled = 0
+        if verbose:
+            for name, start, end in self.lines:
+                print(f"Counting line {name}: {start} -> {end}")
+            print(f"stride={self.stride}, batch={self.batch_size}")
+
+    def _reset_track_state(self):
+        """Start model.track() from a fresh tracker; persist=True would otherwise carry IDs over from the last clip."""
+        predictor = getattr(self.model, "predictor", None)
+        for tracker in getattr(predictor, "trackers", None) or []:
+            tracker.reset()
+
+    def _is_detection_frame(self, frame_idx):
+        return (frame_idx - 1) % self.stride == 0
+
+    def _detect(self, frame):
+        """Run the tracker on one frame, count crossings and return the boxes to draw."""
+        with INFERENCE_SECONDS.time(mode="track"):
+            results = self.model.track(frame, persist=True, classes=[0], conf=CONF_THRESHOLD, imgsz=IMG_SIZE,
+                                       verbose=False)[0]
+        if results.boxes.id is None:
+            return self._update(None, None)
+        return self._update(results.boxes.xyxy.cpu().numpy(), results.boxes.id.cpu().numpy())
+
+    def _update(self, boxes, ids):
+        """Count crossings for the tracked boxes of the current frame."""
+        if ids is None or len(ids) == 0:
+            self.tracks = {}
+            return None
+
+        if self.verbose:
+            print(f"\nFrame {self.frame_idx}: Detected IDs {ids.tolist()}")
+
+        known = self.line_counter.update(self.frame_idx, boxes, ids)
+        self.in_count = self.line_counter.in_count
+        self.out_count = self.line_counter.out_count
+        self.total_count = self.in_count - self.out_count
+
+        if self.stride > 1:
+            tracks = {}
+            for box, tid, seen in zip(boxes, ids, known):
+                last = self.tracks.get(tid)
+                velocity = (box - last[0]) / (self.frame_idx - last[2]) if last else np.zeros_like(box)
+                tracks[tid] = (box, velocity, self.frame_idx, seen)
+            self.tracks = tracks
+
+        # A track's first sighting only records its position and is not drawn
+        return list(zip(boxes[known], ids[known]))
+
+    def _carry(self):
+        """Boxes for a skipped frame, extrapolated from the last detections."""
+        if not self.tracks:
+            return None
+        return [
+            (box + velocity * (self.frame_idx - seen_at), tid)
+            for tid, (box, velocity, seen_at, known) in self.tracks.items()
+            if known
+        ]
+
+    def _annotate(self, frame, visible):
+        if visible is None or not self.draw:
+            return frame
+
+        for box, tid in visible:
+            x1, y1, x2, y2 = map(int, box)
+            cx = int((x1 + x2) / 2)
+            cy = int((y1 + y2) / 2)
+
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 87, 212), 2)
+            cv2.circle(frame, (cx, cy), 4, (0, 0, 255), -1)
+            cv2.putText(frame, f"ID{int(tid)}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (78, 151, 255), 2)
+
+        for _, start, end in self.lines:
+            cv2.line(frame, start, end, (250, 192, 23), 6)
+        cv2.putText(frame, f"In: {self.in_count}", (1600, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(frame, f"Out: {self.out_count}", (1600, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        cv2.putText(frame, f"Total_count: {self.total_count}", (1600, 110), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2)
+        return frame
+
+    def _sample(self):
+        """Record the running occupancy once per completed second of video."""
+        while (self.seconds_sampled + 1) * self.fps <= self.frame_idx:
+            self.occupancy.append(self.total_count)
+            self.seconds_sampled += 1
+
+    def take_occupancy(self, final=False):
+        """Per-second occupancy since the last call; final=True adds the trailing partial second."""
+        series, self.occupancy = self.occupancy, []
+        if final and self.frame_idx > self.seconds_sampled * self.fps:
+            series.append(self.total_count)
+        return series
+
+    def process(self, frame):
+        """Track one frame, update the counts and draw annotations onto it."""
+        FRAMES.inc(stage="people_counter")
+        self.frame_idx += 1
+        if self._is_detection_frame(self.frame_idx):
+            visible = self._detect(frame)
+        else:
+            visible = self._carry()
+        self._sample()
+        return self._annotate(frame, visible)
+
+    def feed(self, frame):
+        """Queue a frame; returns the annotated frames that are ready, in order."""
+        if self.batch_size == 1:
+            return [self.process(frame)]
+
+        self.pending.append(frame)
+        first_idx = self.frame_idx + 1
+        detections = sum(self._is_detection_frame(first_idx + i) for i in range(len(self.pending)))
+        if detections < self.batch_size:
+            return []
+        return self._run_batch()
+
+    def flush(self):
+        """Process whatever is still buffered at the end of the clip."""
+        return self._run_batch() if self.pending else []
+
+    def _run_batch(self):
+        frames, self.pending = self.pending, []
+        first_idx = self.frame_idx + 1
+        detect_frames = [f for i, f in enumerate(frames) if self._is_detection_frame(first_idx + i)]
+        results = iter(())
+        if detect_frames:
+            with INFERENCE_SECONDS.time(mode="batch"):
+                results = iter(self.model.predict(detect_frames, classes=[0], conf=CONF_THRESHOLD,
+                                                  imgsz=IMG_SIZE, verbose=False))
+        FRAMES.inc(len(frames), stage="people_counter")
+
+        done = []
+        for frame in frames:
+            self.frame_idx += 1
+            if self._is_detection_frame(self.frame_idx):
+                tracked = self.tracker.update(next(results).boxes.cpu().numpy(), frame)
+                if len(tracked):
+                    visible = self._update(tracked[:, :4], tracked[:, 4])
+                else:
+                    visible = self._update(None, None)
+            else:
+                visible = self._carry()
+            self._sample()
+            done.append(self._annotate(frame, visible))
+        return done
+
+
+# ===== H.264 Output =====
+class H264Writer:
+    """cv2.VideoWriter replacement that pipes raw BGR frames into one libx264 encoder.
+
+    The annotated clip is encoded once, in a separate process that runs
+    alongside detection, instead of mp4v followed by a full re-encode.
+    """
+
+    def __init__(self, output_filename, fps, frame_w, frame_h):
+        self.output_filename = output_filename
+        self.process = subprocess.Popen([
+            FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{frame_w}x{frame_h}", "-r", f"{fps:.3f}",
+            "-i", "pipe:0",
+            "-c:v", "libx264", "-preset", X264_PRESET, "-crf", str(X264_CRF), "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart", output_filename
+        ], stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        # the frame's own buffer is written, no intermediate bytes copy
+        with timed("encode"):
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        FRAMES.inc(stage="encode")
+
+    def release(self):
+        """Finish the file; raises if the encoder failed."""
+        if self.process.stdin.closed:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.output_filename} (code {self.process.returncode})")
+
+    def abort(self):
+        """Stop the encoder without finishing the file (error path)."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+
+def clip_id(blob_name):
+    """Result id of a clip: its file name without extension (unique per clip, so a retry overwrites)."""
+    return os.path.splitext(os.path.basename(blob_name))[0]
+
+
+def annotated_filename(blob_name):
+    return f"{clip_id(blob_name)}_counted.mp4"
 
-print(f"Counting line: {LINE_START} -> {LINE_END}, line_y={line_y}")
-print("Starting processing...")
-
-# ===== Frame Loop =====
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    frame_idx += 1
-    results = model.track(frame, persist=True, classes=[0], conf=CONF_THRESHOLD, verbose=False)[0]
-    boxes = results.boxes.xyxy.cpu().numpy()
-
-    if results.boxes.id is None:
-        out.write(frame)
-        continue
-
-    ids = results.boxes.id.cpu().numpy()
-    print(f"\nFrame {frame_idx}: Detected IDs {ids.tolist()}")
-
-    for box, tid in zip(boxes, ids):
-        x1, y1, x2, y2 = map(int, box)
-        cx = int((x1 + x2) / 2)
-        cy = int((y1 + y2) / 2)
-
-        if tid not in prev_positions:
-            prev_positions[tid] = (cx, cy)
-            continue
-
-        px, py = prev_positions[tid]
-        if py < line_y <= cy:
-            out_count += 1
-        elif py >= line_y > cy:
-            in_count += 1
-
-        total_count = in_count - out_count
-        prev_positions[tid] = (cx, cy)
-
-        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 87, 212), 2)
-        cv2.circle(frame, (cx, cy), 4, (0, 0, 255), -1)
-        cv2.putText(frame, f"ID{int(tid)}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (78, 151, 255), 2)
-
-    cv2.line(frame, LINE_START, LINE_END, (250, 192, 23), 6)
-    cv2.putText(frame, f"In: {in_count}", (1600, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    cv2.putText(frame, f"Out: {out_count}", (1600, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-    cv2.putText(frame, f"Total_count: {total_count}", (1600, 110), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2)
-    out.write(frame)
-
-cap.release()
-out.release()
-print(f"Finished. Total In={in_count}, Out={out_count}, Total_count={total_count}")
-
-# ===== Convert to H.264 MP4 =====
-converted_filename = f"Room901_{OUTPUT_FILENAME}"
-subprocess.run([
-    "C:/ffmpeg/ffmpeg.exe", "-i", OUTPUT_FILENAME, "-c:v", "libx264",
-    "-preset", "fast", "-movflags", "+faststart", "-y", converted_filename
-])
 
 # ===== Upload to Firebase =====
-time_now = datetime.now(ZoneInfo("Asia/Bangkok"))
-blob = bucket.blob(f"counter_videos/{converted_filename}")
-blob.upload_from_filename(converted_filename, content_type='video/mp4')
-blob.make_public()
-video_url = blob.public_url
-print(f"Uploaded to Firebase: {video_url}")
+def upload_annotated_video(bucket, converted_filename):
+    blob = bucket.blob(f"counter_videos/{converted_filename}")
+    with timed("upload"):
+        blob.upload_from_filename(converted_filename, content_type='video/mp4')
+        blob.make_public()
+    BYTES.inc(os.path.getsize(converted_filename), direction="upload")
+    print(f"Uploaded to Firebase: {blob.public_url}")
+    return blob.public_url
+
 
 # ===== Save Metadata to Firestore =====
-db.collection("people_counter").document(timestamp).set({
-    "timestamp": time_now.isoformat(),
-    "in": in_count,
-    "out": out_count,
-    "total_count": total_count,
-    "video_name": new_blob.name,
-    "video_url": video_url
-})
-print("Uploaded counts to Firestore.")
-
-# ===== Cleanup =====
-for f in [VIDEO_PATH, OUTPUT_FILENAME, converted_filename]:
-    if os.path.exists(f):
-        os.remove(f)
-        print(f"Removed file: {f}")
+def build_counter_record(counter, video_name, video_url, room=DEFAULT_CAMERA.room):
+    """people_counter document for a finished clip, with its per-second occupancy series."""
+    return {
+        "room": room,
+        # always with microseconds, so stored strings sort by time (see app.timestamp_bound)
+        "timestamp": datetime.now(ZoneInfo("Asia/Bangkok")).isoformat(timespec="microseconds"),
+        "in": counter.in_count,
+        "out": counter.out_count,
+        "total_count": counter.total_count,
+        "lines": counter.line_counter.per_line(),
+        "video_name": video_name,
+        "video_url": video_url,
+        "series": series_codec.encode(occupancy=counter.take_occupancy(final=True))
+    }
+
+
+def cleanup(paths):
+    for f in paths:
+        if os.path.exists(f):
+            os.remove(f)
+            print(f"Removed file: {f}")
+
+
+def count_video(db, bucket, new_blob, ledger, annotate=ANNOTATED_VIDEO):
+    """Count one clip, upload the annotated video (unless metrics only) and record the people_counter stage."""
+    camera = CONFIG.camera_for_video(new_blob.name, new_blob.metadata)
+    output_filename = annotated_filename(new_blob.name) if annotate else None
+    print(f"✅ New video found: {new_blob.name} ({camera.room})")
+
+    model = load_model()
+
+    # ===== Video Setup =====
+    # decoding starts while the clip is still downloading (stream_download.py)
+    cap = open_blob(new_blob)
+    out = None
+    try:
+        if not cap.isOpened():
+            raise RuntimeError(f"Cannot open video: {new_blob.name}")
+        ret, frame = cap.read()
+        if not ret:
+            raise RuntimeError("Cannot read video frames")
+        frame_h, frame_w = frame.shape[:2]
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        if annotate:
+            out = H264Writer(output_filename, fps, frame_w, frame_h)
+            print(f"Writing output to {output_filename}: {frame_w}x{frame_h} @ {fps:.1f} FPS")
+        else:
+            print("Metrics only: no annotated video")
+
+        stride = detection_stride(fps, DETECT_STRIDE, DETECT_FPS)
+        counter = PeopleCounter(model, frame_w, frame_h, stride=stride, batch_size=DETECT_BATCH, fps=fps,
+                                lines=camera.counting_lines(frame_w, frame_h), draw=annotate)
+        print("Starting processing...")
+
+        # ===== Frame Loop =====
+        while True:
+            with timed("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            for done in counter.feed(frame):
+                if out:
+                    out.write(done)
+        for done in counter.flush():
+            if out:
+                out.write(done)
+        print(f"Finished. Total In={counter.in_count}, Out={counter.out_count}, Total_count={counter.total_count}")
+
+        video_url = None
+        if out:
+            out.release()
+            video_url = upload_annotated_video(bucket, output_filename)
+
+        counter_record = build_counter_record(counter, new_blob.name, video_url, camera.room)
+        batch = db.batch()
+        batch.set(db.collection("people_counter").document(clip_id(new_blob.name)), counter_record)
+        rollups.add(batch, db, camera.room,
+                    rollups.clip_time(new_blob.name) or datetime.now(rollups.LOCAL_TZ), people=counter_record)
+        with timed("firestore_write"):
+            batch.commit()
+        print("Uploaded counts to Firestore.")
+
+        ledger.record_stage(new_blob.name, "people_counter", {
+            "doc": clip_id(new_blob.name), "in": counter.in_count, "out": counter.out_count,
+            "total_count": counter.total_count})
+
+    # ===== Cleanup =====
+    finally:
+        cap.release()  # stops the download and removes any temp file
+        if out:
+            out.abort()  # no-op after a successful release()
+        cleanup([output_filename] if output_filename else [])
+
+
+def main():
+    start_exporter("counter_people")
+    db, bucket = initialize_firebase()
+    ledger = get_ledger()
+
+    new_blob = find_new_video(db, bucket, ledger)
+    if not new_blob:
+        print("❌ No new video found to process.")
+        return
+
+    try:
+        count_video(db, bucket, new_blob, ledger)
+        ledger.finish(new_blob.name)
+    except Exception as e:
+        ledger.fail(new_blob.name, e)
+        raise
+    except BaseException:
+        ledger.release(new_blob.name)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+
+from datastore import DESCENDING
+
+logger = logging.getLogger(__name__)
+
+# collection ที่ต้องเฝ้าดู และจำนวนเอกสารล่าสุดที่ listener ติดตาม
+# (videos ติดตาม 10 รายการที่แดชบอร์ดแสดง, ผลวิเคราะห์ติดตามแค่รายการล่าสุดก็พอรู้ว่ามีของใหม่)
+WATCHED_QUERIES = {
+    "videos": 10,
+    "moverate": 1,
+    "people_counter": 1,
+}
+
+
+class DashboardCache:
+    """แคชข้อมูลแดชบอร์ด (videos ที่จับคู่กับ moverate / people_counter แล้ว) ใช้ร่วมกันทั้ง process
+
+    - Firestore on_snapshot listener แจ้งเมื่อมีข้อมูลใหม่ แล้ว thread เบื้องหลังโหลดข้อมูลใหม่
+    - ระหว่างที่ listener ทำงานอยู่ ข้อมูลถือว่าเป็นปัจจุบันเสมอ ไม่ต้องโหลดซ้ำตามเวลา
+    - ถ้าลงทะเบียน listener ไม่ได้ (เช่น local store) หรือ listener หยุดเพราะ error
+      จะโหลดซ้ำทุก ttl วินาที (polling fallback) และพยายามลงทะเบียนใหม่ทุก ttl
+    - version เพิ่มขึ้นทุกครั้งที่ข้อมูลเปลี่ยน ใช้เป็นตัวบอกว่าต้องวาดกราฟใหม่หรือไม่
+
+    จำนวนการอ่าน Firestore จึงขึ้นกับจำนวนการเปลี่ยนแปลง ไม่ใช่จำนวนคนที่เปิดหน้าเว็บ
+    สตรีม /events ทุกตัวรอการเปลี่ยนแปลงด้วย wait() จากการโหลดครั้งเดียวกัน
+    """
+
+    def __init__(self, db, loader, ttl=60, debounce=1.0):
+        self.db = db
+        self.loader = loader
+        self.ttl = ttl
+        self.debounce = debounce
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._refresh_lock = threading.Lock()
+        self._data = []
+        self._version = 0
+        self._loaded_at = None
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._watches = []
+        self._lost = False          # listener เคยทำงานแล้วหยุดเพราะ error และยังลงทะเบียนใหม่ไม่ได้
+        self._thread = None
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def start(self):
+        """เริ่ม listener และ thread โหลดข้อมูล (เรียกซ้ำได้)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="dashboard-cache", daemon=True)
+
+        self._listen()
+        self._thread.start()
+
+    def _listen(self):
+        """ลงทะเบียน listener ทุก collection; คืน False (และใช้ polling) ถ้าไม่สำเร็จ"""
+        watches = []
+        try:
+            for name, limit in WATCHED_QUERIES.items():
+                query = (self.db.collection(name)
+                         .order_by("timestamp", direction=DESCENDING)
+                         .limit(limit))
+                watches.append(query.on_snapshot(self._on_snapshot))
+        except Exception as e:
+            self._unsubscribe(watches)
+            logger.warning(f"Firestore listeners unavailable, polling every {self.ttl}s: {e}")
+            return False
+        self._watches = watches
+        logger.info("Dashboard cache listening on %s", ", ".join(WATCHED_QUERIES))
+        return True
+
+    def _listening(self):
+        """True ถ้า listener ทุกตัวยังทำงาน (Watch หยุดถาวรเมื่อ RPC error จะได้ is_active เป็น False)"""
+        return bool(self._watches) and all(getattr(watch, "is_active", True) for watch in self._watches)
+
+    @staticmethod
+    def _unsubscribe(watches):
+        for watch in watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Error closing Firestore listener: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._dirty.set()
+        self._unsubscribe(self._watches)
+        self._watches = []
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        if changes:
+            self._dirty.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            changed = self._dirty.wait(timeout=self.ttl)
+            if self._stop.is_set():
+                break
+            if changed:
+                # รวมการแจ้งเตือนที่มาติด ๆ กัน (เช่น moverate + people_counter ที่เขียนพร้อมกัน)
+                time.sleep(self.debounce)
+                self._dirty.clear()
+            elif self._listening():
+                continue  # listener ยังทำงาน ไม่มีอะไรเปลี่ยน ไม่ต้องอ่าน Firestore
+            elif self._watches or self._lost:
+                # listener หยุดเพราะ error: ลงทะเบียนใหม่ (ลองทุก ttl ถ้ายังไม่ได้ ระหว่างนี้ใช้ polling)
+                # แล้วโหลดครั้งหนึ่งเผื่อพลาดการเปลี่ยนแปลงระหว่างนั้น
+                logger.warning("Firestore listener stopped, re-registering")
+                self._unsubscribe(self._watches)
+                self._watches = []
+                self._lost = not self._listen()
+            self.refresh()
+
+    def _is_stale(self, max_age):
+        with self._lock:
+            return self._loaded_at is None or time.monotonic() - self._loaded_at > max_age
+
+    def refresh(self, max_age=None):
+        """โหลดข้อมูลใหม่จาก Firestore; ถ้าโหลดไม่สำเร็จจะเก็บข้อมูลเดิมไว้
+
+        ถ้าระบุ max_age จะข้ามการโหลดเมื่อข้อมูลยังใหม่กว่านั้น
+        (request อื่นอาจโหลดเสร็จไปแล้วระหว่างรอ lock)
+        """
+        with self._refresh_lock:
+            if max_age is not None and not self._is_stale(max_age):
+                return True
+            try:
+                data = self.loader()
+            except Exception as e:
+                logger.error(f"Error refreshing dashboard cache: {e}")
+                return False
+            self._store(data)
+        return True
+
+    def _store(self, data):
+        with self._lock:
+            if data != self._data or self._loaded_at is None:
+                self._data = data
+                self._version += 1
+                self._changed.notify_all()
+                logger.info(f"Dashboard cache updated to version {self._version} ({len(data)} rows)")
+            self._loaded_at = time.monotonic()
+
+    def snapshot(self):
+        """คืนค่า (version, data) ล่าสุด; โหลดทันทีถ้ายังไม่เคยโหลด
+        หรือข้อมูลเก่าเกิน ttl ขณะที่ไม่มี listener คอยแจ้ง"""
+        self.start()
+        max_age = float("inf") if self._listening() else 2 * self.ttl
+        if self._is_stale(max_age):
+            self.refresh(max_age=max_age)
+        with self._lock:
+            return self._version, self._data
+
+    def get(self):
+        return self.snapshot()[1]
+
+    def wait(self, version, timeout):
+        """รอจนข้อมูลเปลี่ยนจาก version ที่ระบุ (หรือหมดเวลา) แล้วคืนค่า (version, data) ล่าสุด"""
+        self.start()
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._data
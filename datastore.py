@@ -0,0 +1,545 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import get_config
+
+# Storage / database layer shared by every module.
+#
+# All code works on a (db, bucket) pair through the subset of the Firestore and
+# Cloud Storage client API it already used: collection().document().set(),
+# add(), where / order_by / limit / stream, batch(), bucket.blob(), get_blob(),
+# list_blobs(prefix, start_offset), upload_from_filename, download_as_bytes.
+# Increment / Maximum field transforms are supported on both. get_store()
+# returns one of two backends behind that API:
+#
+#   firebase   Firestore + Cloud Storage (default)
+#   local      documents in SQLite (timestamp and room indexed) and blobs as
+#              files under store.path, so an edge box runs the pipeline and the
+#              dashboard without a network round trip per operation; changes
+#              are pushed to Firebase in batches with `python datastore.py --sync`
+#
+# Choose with cameras.json "store": {"backend": "local", "path": "data"}.
+# Local blobs are served by the dashboard at MEDIA_URL (app.py); on sync, URLs
+# pointing there are rewritten to the Storage public URL.
+
+# ===== Config =====
+DB_FILE = "store.db"
+BLOB_DIR = "blobs"
+MEDIA_URL = "/media/"
+SYNC_BATCH = 400            # Firestore batches hold at most 500 writes
+SYNC_SECONDS = 60
+URL_FIELDS = ("url", "video_url")
+
+try:
+    from firebase_admin import firestore
+    SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+    DESCENDING = firestore.Query.DESCENDING
+    Increment = firestore.Increment
+    Maximum = firestore.Maximum
+except ImportError:         # local-only box without firebase_admin
+    SERVER_TIMESTAMP = object()
+    DESCENDING = "DESCENDING"
+
+    class Increment:
+        def __init__(self, value):
+            self.value = value
+
+    class Maximum:
+        def __init__(self, value):
+            self.value = value
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    ts REAL,                      -- data.timestamp as epoch seconds (ISO string or datetime)
+    updated_at REAL NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (collection, id)
+);
+CREATE INDEX IF NOT EXISTS documents_ts ON documents (collection, ts);
+CREATE INDEX IF NOT EXISTS documents_room_ts ON documents (collection, json_extract(data, '$.room'), ts);
+CREATE INDEX IF NOT EXISTS documents_unsynced ON documents (synced) WHERE synced = 0;
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    content_type TEXT,
+    metadata TEXT,
+    updated REAL NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+OPERATORS = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+FIELD_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+
+
+# ===== Values =====
+def _encode(value):
+    """Document value -> JSON-safe value; datetimes and bytes are kept as tagged strings."""
+    if value is SERVER_TIMESTAMP:
+        value = datetime.now(timezone.utc)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)   # Firestore treats naive times as UTC
+        return {"__datetime__": value.astimezone(timezone.utc).isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if hasattr(value, "item"):
+        return value.item()    # numpy scalar
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {"__datetime__"}:
+            return datetime.fromisoformat(value["__datetime__"])
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _apply_transform(current, value):
+    if isinstance(value, Increment):
+        return (current or 0) + value.value
+    if isinstance(value, Maximum):
+        return value.value if current is None else max(current, value.value)
+    return value
+
+
+def _epoch(value):
+    """Sort key of a timestamp value: ISO strings and datetimes compare by instant."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+# ===== Local documents =====
+class LocalSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return self._data
+
+
+class LocalDocument:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        with self.store.transaction() as conn:
+            self.store.put_document(conn, self.collection, self.id, data, merge)
+
+    def get(self):
+        rows = self.store.query("SELECT data FROM documents WHERE collection = ? AND id = ?",
+                                (self.collection, self.id))
+        return LocalSnapshot(self, _decode(json.loads(rows[0]["data"])) if rows else None)
+
+    def delete(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM documents WHERE collection = ? AND id = ?", (self.collection, self.id))
+
+
+class LocalQuery:
+    """where / order_by / limit / stream over one collection, translated to SQL."""
+
+    def __init__(self, store, collection, filters=(), order=(), count=None):
+        self.store = store
+        self.collection = collection
+        self._filters = filters
+        self._order = order
+        self._count = count
+
+    def _copy(self, **changes):
+        args = {"filters": self._filters, "order": self._order, "count": self._count, **changes}
+        return LocalQuery(self.store, self.collection, **args)
+
+    def where(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator for the local store: {op}")
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=self._order + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    @staticmethod
+    def _column(field):
+        # the timestamp field is indexed as epoch seconds; everything else is read from the JSON
+        if field == "timestamp":
+            return "ts"
+        if not FIELD_NAME.fullmatch(field):
+            raise ValueError(f"Invalid field name: {field}")
+        return f"json_extract(data, '$.{field}')"
+
+    def stream(self):
+        clauses, params = ["collection = ?"], [self.collection]
+        for field, op, value in self._filters:
+            clauses.append(f"{self._column(field)} {OPERATORS[op]} ?")
+            params.append(_epoch(value) if field == "timestamp" else value)
+        sql = f"SELECT id, data FROM documents WHERE {' AND '.join(clauses)}"
+        if self._order:
+            sql += " ORDER BY " + ", ".join(
+                f"{self._column(field)} {'DESC' if direction == DESCENDING else 'ASC'}"
+                for field, direction in self._order)
+        if self._count is not None:
+            sql += " LIMIT ?"
+            params.append(self._count)
+        for row in self.store.query(sql, params):
+            yield LocalSnapshot(LocalDocument(self.store, self.collection, row["id"]),
+                                _decode(json.loads(row["data"])))
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        # no change feed; DashboardCache falls back to polling
+        raise NotImplementedError("The local store has no snapshot listeners")
+
+
+class LocalCollection(LocalQuery):
+    def __init__(self, store, name):
+        super().__init__(store, name)
+
+    def document(self, doc_id=None):
+        return LocalDocument(self.store, self.collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class LocalBatch:
+    """Writes applied together in one SQLite transaction on commit()."""
+
+    def __init__(self, store):
+        self.store = store
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+
+    def commit(self):
+        with self.store.transaction() as conn:
+            for reference, data, merge in self._writes:
+                self.store.put_document(conn, reference.collection, reference.id, data, merge)
+        self._writes = []
+
+
+class LocalDatabase:
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return LocalCollection(self.store, name)
+
+    def batch(self):
+        return LocalBatch(self.store)
+
+
+# ===== Local blobs =====
+class LocalBlob:
+    """A file under <store.path>/blobs with the Storage blob attributes the pipeline reads."""
+
+    def __init__(self, bucket, name, row=None):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.content_type = None
+        self.size = None
+        self.md5_hash = None
+        self.updated = None
+        if row is not None:
+            self._load(row)
+
+    def _load(self, row):
+        self.metadata = json.loads(row["metadata"]) if row["metadata"] else None
+        self.content_type = row["content_type"]
+        self.size = row["size"]
+        self.md5_hash = row["md5"]
+        self.updated = datetime.fromtimestamp(row["updated"], timezone.utc)
+
+    @property
+    def local_path(self):
+        return os.path.join(self.bucket.root, *self.name.split("/"))
+
+    @property
+    def public_url(self):
+        return MEDIA_URL + self.name
+
+    def exists(self):
+        return bool(self.bucket.store.query("SELECT 1 FROM blobs WHERE name = ?", (self.name,)))
+
+    def reload(self):
+        rows = self.bucket.store.query("SELECT * FROM blobs WHERE name = ?", (self.name,))
+        if not rows:
+            raise FileNotFoundError(f"No such blob: {self.name}")
+        self._load(rows[0])
+
+    def upload_from_filename(self, filename, content_type=None):
+        os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+        temp_path = f"{self.local_path}.part"
+        md5 = hashlib.md5()
+        with open(filename, "rb") as src, open(temp_path, "wb") as dst:
+            for data in iter(lambda: src.read(1024 * 1024), b""):
+                md5.update(data)
+                dst.write(data)
+        os.replace(temp_path, self.local_path)
+
+        self.size = os.path.getsize(self.local_path)
+        self.md5_hash = base64.b64encode(md5.digest()).decode()
+        self.content_type = content_type or self.content_type
+        self.updated = datetime.now(timezone.utc)
+        with self.bucket.store.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO blobs (name, size, md5, content_type, metadata, updated, synced) "
+                         "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                         (self.name, self.size, self.md5_hash, self.content_type,
+                          json.dumps(self.metadata) if self.metadata else None, self.updated.timestamp()))
+
+    def download_as_bytes(self, start=None, end=None, raw_download=False):
+        # end is inclusive, as in Storage ranged downloads
+        with open(self.local_path, "rb") as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.local_path, filename)
+
+    def make_public(self):
+        pass    # served by the dashboard at MEDIA_URL
+
+    def generate_signed_url(self, **kwargs):
+        return self.public_url
+
+    def delete(self):
+        with self.bucket.store.transaction() as conn:
+            conn.execute("DELETE FROM blobs WHERE name = ?", (self.name,))
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
+
+
+class LocalBucket:
+    def __init__(self, store):
+        self.store = store
+        self.name = "local"
+        self.root = os.path.join(store.root, BLOB_DIR)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        rows = self.store.query("SELECT * FROM blobs WHERE name = ?", (name,))
+        return LocalBlob(self, name, rows[0]) if rows else None
+
+    def list_blobs(self, prefix=None, start_offset=None):
+        prefix = prefix or ""
+        # the primary key keeps names sorted, so both bounds are one index range
+        start = max(prefix, start_offset or "")
+        rows = self.store.query("SELECT * FROM blobs WHERE name >= ? AND substr(name, 1, ?) = ? ORDER BY name",
+                                (start, len(prefix), prefix))
+        return [LocalBlob(self, row["name"], row) for row in rows]
+
+
+# ===== Stores =====
+class LocalStore:
+    """Documents and blobs on this machine (SQLite + files), safe to share between threads."""
+
+    backend = "local"
+
+    def __init__(self, root=None):
+        self.root = root or get_config().store_path
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, DB_FILE), timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.db = LocalDatabase(self)
+        self.bucket = LocalBucket(self)
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def put_document(self, conn, collection, doc_id, data, merge=False):
+        current = {}
+        if merge:
+            row = conn.execute("SELECT data FROM documents WHERE collection = ? AND id = ?",
+                               (collection, doc_id)).fetchone()
+            if row:
+                current = _decode(json.loads(row["data"]))
+        # Increment / Maximum apply to the stored value, inside this transaction like on Firestore
+        data = {**current, **{key: _apply_transform(current.get(key), value) for key, value in data.items()}}
+        encoded = _encode(data)
+        conn.execute("INSERT OR REPLACE INTO documents (collection, id, data, ts, updated_at, synced) "
+                     "VALUES (?, ?, ?, ?, ?, 0)",
+                     (collection, doc_id, json.dumps(encoded), _epoch(_decode(encoded.get("timestamp"))),
+                      time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT under the store lock (ROLLBACK on error)."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.store._conn.execute("BEGIN IMMEDIATE")
+        return self.store._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.store._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.store._lock.release()
+
+
+class FirebaseStore:
+    """Firestore + Cloud Storage clients (the original backend)."""
+
+    backend = "firebase"
+
+    def __init__(self, bucket_name=None, credentials_path=None):
+        import firebase_admin
+        from firebase_admin import credentials, storage
+
+        config = get_config()
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(credentials_path or config.credentials)
+            firebase_admin.initialize_app(cred, {'storageBucket': bucket_name or config.bucket})
+        self.db = firestore.client()
+        self.bucket = storage.bucket(bucket_name or config.bucket)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(bucket_name=None):
+    """Process-wide store of the configured backend (bucket_name picks the Storage bucket)."""
+    config = get_config()
+    key = (config.store, bucket_name if config.store == "firebase" else None)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = FirebaseStore(bucket_name) if config.store == "firebase" else LocalStore()
+        return _stores[key]
+
+
+# ===== Sync to Firebase =====
+def _remote_urls(data, bucket):
+    """Point local media URLs at the same blob in Storage."""
+    for field in URL_FIELDS:
+        value = data.get(field)
+        if isinstance(value, str) and value.startswith(MEDIA_URL):
+            data[field] = bucket.blob(value[len(MEDIA_URL):]).public_url
+    return data
+
+
+def sync_to_firebase(local, remote, batch_size=SYNC_BATCH):
+    """Push blobs and documents changed since the last sync; returns (blobs, documents).
+
+    Blobs go first so the URLs in the documents resolve once they arrive.
+    Documents are written in Firestore batches of batch_size. A row rewritten
+    while it was being pushed stays unsynced and goes out on the next call.
+    """
+    blob_count = 0
+    for row in local.query("SELECT * FROM blobs WHERE synced = 0 ORDER BY name"):
+        blob = remote.bucket.blob(row["name"])
+        blob.metadata = json.loads(row["metadata"]) if row["metadata"] else None
+        blob.upload_from_filename(LocalBlob(local.bucket, row["name"]).local_path,
+                                  content_type=row["content_type"])
+        blob.make_public()
+        with local.transaction() as conn:
+            conn.execute("UPDATE blobs SET synced = 1 WHERE name = ? AND updated = ?", (row["name"], row["updated"]))
+        blob_count += 1
+
+    doc_count = 0
+    last = ("", "")
+    while True:
+        rows = local.query("SELECT collection, id, data, updated_at FROM documents "
+                           "WHERE synced = 0 AND (collection, id) > (?, ?) ORDER BY collection, id LIMIT ?",
+                           (*last, batch_size))
+        if not rows:
+            break
+        batch = remote.db.batch()
+        for row in rows:
+            data = _remote_urls(_decode(json.loads(row["data"])), remote.bucket)
+            batch.set(remote.db.collection(row["collection"]).document(row["id"]), data)
+        batch.commit()
+        with local.transaction() as conn:
+            conn.executemany("UPDATE documents SET synced = 1 WHERE collection = ? AND id = ? AND updated_at = ?",
+                             [(row["collection"], row["id"], row["updated_at"]) for row in rows])
+        doc_count += len(rows)
+        last = (rows[-1]["collection"], rows[-1]["id"])
+    return blob_count, doc_count
+
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Local store maintenance")
+    arg_parser.add_argument("--sync", action="store_true", help="push local changes to Firebase")
+    arg_parser.add_argument("--every", type=int, default=0, metavar="SECONDS",
+                            help=f"keep syncing every SECONDS (e.g. {SYNC_SECONDS})")
+    args = arg_parser.parse_args()
+
+    local_store = LocalStore()
+    pending = local_store.query("SELECT (SELECT COUNT(*) FROM blobs WHERE synced = 0) AS blobs, "
+                                "(SELECT COUNT(*) FROM documents WHERE synced = 0) AS documents")[0]
+    print(f"🗄️ {local_store.root}: {pending['blobs']} blob(s), {pending['documents']} document(s) not synced")
+    if args.sync:
+        remote_store = FirebaseStore()
+        while True:
+            blobs, documents = sync_to_firebase(local_store, remote_store)
+            print(f"☁️ Synced {blobs} blob(s) and {documents} document(s) to Firebase")
+            if not args.every:
+                break
+            time.sleep(args.every)
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+
+from counter_people import PeopleCounter, load_model, BACKEND
+
+# Replays reference clips through PeopleCounter at several detection strides and
+# reports in/out count error and throughput, to pick the fastest stride that
+# still counts exactly.
+#
+# Manifest (JSON):
+#   {"clips": [{"path": "reference/clip1.mp4", "in": 3, "out": 2}, ...]}
+# Clips without "in"/"out" use the stride-1 result as their reference.
+
+
+def load_manifest(paths, manifest_path):
+    clips = []
+    if manifest_path:
+        with open(manifest_path) as f:
+            clips.extend(json.load(f)["clips"])
+    clips.extend({"path": p} for p in paths)
+    return clips
+
+
+def run_clip(path, stride, backend=BACKEND, batch_size=1):
+    """Count one clip at the given stride; returns counts and timings."""
+    # ติดตามด้วย persist=True เก็บ state ไว้ในโมเดล จึงโหลดใหม่ทุกครั้งเพื่อเริ่มจาก tracker ว่าง
+    model = load_model(backend)
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {path}")
+    ret, frame = cap.read()
+    if not ret:
+        cap.release()
+        raise RuntimeError(f"Cannot read video frames: {path}")
+
+    frame_h, frame_w = frame.shape[:2]
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    counter = PeopleCounter(model, frame_w, frame_h, stride=stride, verbose=False,
+                            batch_size=batch_size, fps=fps)
+
+    frames = 0
+    process_time = 0.0
+    started = time.perf_counter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        t0 = time.perf_counter()
+        counter.feed(frame)
+        process_time += time.perf_counter() - t0
+        frames += 1
+    t0 = time.perf_counter()
+    counter.flush()
+    process_time += time.perf_counter() - t0
+    total_time = time.perf_counter() - started
+    cap.release()
+
+    return {
+        "in": counter.in_count,
+        "out": counter.out_count,
+        "frames": frames,
+        "process_s": process_time,
+        "total_s": total_time,
+    }
+
+
+def evaluate(clips, strides, backend=BACKEND, batch_size=1):
+    """Run every clip at every stride and summarize error and speed per stride."""
+    runs = {}
+    for clip in clips:
+        for stride in sorted(set(strides) | {1}):
+            print(f"🔍 {clip['path']} @ stride {stride}...")
+            runs[(clip["path"], stride)] = run_clip(clip["path"], stride, backend, batch_size)
+
+    summary = []
+    for stride in strides:
+        abs_error = 0
+        exact = 0
+        frames = 0
+        process_s = 0.0
+        total_s = 0.0
+        for clip in clips:
+            run = runs[(clip["path"], stride)]
+            ref = clip if "in" in clip and "out" in clip else runs[(clip["path"], 1)]
+            error = abs(run["in"] - ref["in"]) + abs(run["out"] - ref["out"])
+            abs_error += error
+            exact += error == 0
+            frames += run["frames"]
+            process_s += run["process_s"]
+            total_s += run["total_s"]
+        summary.append({
+            "stride": stride,
+            "abs_count_error": abs_error,
+            "exact_clips": exact,
+            "clips": len(clips),
+            "counter_fps": frames / process_s if process_s else 0.0,
+            "end_to_end_fps": frames / total_s if total_s else 0.0,
+        })
+
+    per_clip = [
+        {"path": path, "stride": stride, **run}
+        for (path, stride), run in runs.items()
+    ]
+    return summary, per_clip
+
+
+def print_summary(summary):
+    print(f"\n{'stride':>6} {'error':>6} {'exact':>8} {'counter fps':>12} {'e2e fps':>9}")
+    for row in summary:
+        print(f"{row['stride']:>6} {row['abs_count_error']:>6} "
+              f"{row['exact_clips']:>3}/{row['clips']:<4} "
+              f"{row['counter_fps']:>12.1f} {row['end_to_end_fps']:>9.1f}")
+
+    exact = [row for row in summary if row["abs_count_error"] == 0]
+    if exact:
+        best = max(exact, key=lambda row: row["counter_fps"])
+        print(f"\n✅ Fastest exact setting: DETECT_STRIDE = {best['stride']}")
+    else:
+        print("\n❌ No stride reproduced the reference counts exactly")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate counting accuracy vs. speed per detection stride")
+    parser.add_argument("clips", nargs="*", help="reference clips (reference = stride 1 result)")
+    parser.add_argument("--manifest", help="JSON manifest with expected in/out counts")
+    parser.add_argument("--strides", default="1,2,3,4,6", help="comma-separated strides to test")
+    parser.add_argument("--backend", default=BACKEND, choices=["pytorch", "onnx", "openvino"])
+    parser.add_argument("--batch", type=int, default=1, help="frames per detector call")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    clips = load_manifest(args.clips, args.manifest)
+    if not clips:
+        parser.error("no clips given")
+    missing = [c["path"] for c in clips if not os.path.exists(c["path"])]
+    if missing:
+        parser.error(f"clips not found: {', '.join(missing)}")
+
+    strides = [int(s) for s in args.strides.split(",")]
+    summary, per_clip = evaluate(clips, strides, args.backend, args.batch)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"backend": args.backend, "batch": args.batch,
+                       "summary": summary, "runs": per_clip}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import get_config
+
+# Durable per-clip processing ledger (SQLite).
+#
+# Every clip under videos/ gets one row with its status, attempt count and the
+# results of each analysis stage. Discovery is incremental: each camera's clip
+# names sort by time (<camera id>_YYYY-mm-dd_HHMMSS.mp4), so the ledger keeps
+# the last name listed per prefix and asks Storage only for names after it.
+# A clip can be uploaded after a later one (upload retries, segments spooled
+# across a restart), so every LOOKBACK_EVERY_SECONDS the listing starts
+# DISCOVERY_LOOKBACK_SECONDS of recording time behind the cursor instead;
+# clips already known are ignored. Older stragglers need --rescan.
+# Finding work is an indexed query on status, so neither step grows with the
+# size of the archive.
+#
+#   python ledger.py            show status counts
+#   python ledger.py --rescan   list the whole bucket once (clips with other names)
+#   python ledger.py --retry    reset failed clips so they are attempted again
+
+# ===== Config =====
+LEDGER_PATH = os.environ.get("SMARTCLASS_LEDGER", "ledger.db")
+VIDEO_PREFIX = "videos/"
+LEGACY_PREFIX = "camera_"     # clips recorded before cameras.json
+STAGES = ("people_counter", "moverate")
+MAX_ATTEMPTS = 3
+STALE_CLAIM_SECONDS = 3600    # a "running" clip older than this was left by a crashed worker
+DISCOVERY_LOOKBACK_SECONDS = 7 * 86400   # how far behind the cursor late uploads are looked for
+LOOKBACK_EVERY_SECONDS = 600
+CLIP_TIME = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{6})")
+STAGE_LIST = ", ".join(f"'{stage}'" for stage in STAGES)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    name TEXT PRIMARY KEY,
+    camera TEXT,
+    room TEXT,
+    uploaded TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',   -- pending | running | done | failed | skipped
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    claimed_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS clips_status ON clips (status, uploaded);
+CREATE TABLE IF NOT EXISTS stages (
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    result TEXT,
+    done_at REAL,
+    PRIMARY KEY (name, stage)
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    prefix TEXT PRIMARY KEY,
+    last_name TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def lookback_name(prefix, cursor, seconds=DISCOVERY_LOOKBACK_SECONDS):
+    """Name of a clip recorded `seconds` before the cursor clip (the cursor itself if its name has no time)."""
+    match = CLIP_TIME.search(cursor or "")
+    if not match:
+        return cursor
+    recorded = datetime.strptime(match.group(1), "%Y-%m-%d_%H%M%S")
+    return f"{prefix}{(recorded - timedelta(seconds=seconds)).strftime('%Y-%m-%d_%H%M%S')}"
+
+
+class Ledger:
+    """Processing ledger shared by the analysis threads of one process.
+
+    Several processes may open the same file; claims use IMMEDIATE
+    transactions so a clip is only handed to one of them.
+    """
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lookback_at = None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+                return cursor.rowcount
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ----- discovery -----
+    def prefixes(self):
+        """Storage prefixes listed incrementally: one per camera plus the legacy name."""
+        names = [camera.file_prefix for camera in get_config().cameras] + [LEGACY_PREFIX]
+        return [f"{VIDEO_PREFIX}{name}" for name in dict.fromkeys(names)]
+
+    def discover(self, bucket, full=False):
+        """Add clips uploaded since the last call; full=True lists the whole bucket once.
+
+        Returns the number of new clips.
+        """
+        if full:
+            return self._add_blobs(bucket.list_blobs(prefix=VIDEO_PREFIX))
+
+        now = time.monotonic()
+        lookback = self._lookback_at is None or now - self._lookback_at >= LOOKBACK_EVERY_SECONDS
+        if lookback:
+            self._lookback_at = now
+
+        added = 0
+        for prefix in self.prefixes():
+            rows = self._query("SELECT last_name FROM cursors WHERE prefix = ?", (prefix,))
+            cursor = rows[0]["last_name"] if rows else None
+            start = lookback_name(prefix, cursor) if lookback else cursor
+            # start_offset is inclusive; clips already listed are ignored by INSERT OR IGNORE
+            blobs = list(bucket.list_blobs(prefix=prefix, start_offset=start))
+            added += self._add_blobs(blobs)
+            if blobs:
+                last = max(blob.name for blob in blobs)
+                self._write("INSERT INTO cursors (prefix, last_name) VALUES (?, ?) "
+                            "ON CONFLICT(prefix) DO UPDATE SET last_name = MAX(last_name, excluded.last_name)",
+                            (prefix, last))
+        return added
+
+    def _add_blobs(self, blobs):
+        from uploadclip import analyzed_live
+
+        config = get_config()
+        now = time.time()
+        rows = []
+        for blob in blobs:
+            if not blob.name.endswith(".mp4"):
+                continue
+            camera = config.camera_for_video(blob.name, blob.metadata)
+            status = "skipped" if analyzed_live(blob) else "pending"
+            uploaded = blob.updated.isoformat() if blob.updated else None
+            rows.append((blob.name, camera.id, camera.room, uploaded, status, now))
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO clips (name, camera, room, uploaded, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+                added = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def bootstrap(self, db, bucket):
+        """First run only: list the bucket once and mark results already in Firestore as done."""
+        if self._query("SELECT value FROM meta WHERE key = 'bootstrapped'"):
+            return False
+        print("📒 Building the clip ledger from the existing bucket and results (one time)...")
+        self.discover(bucket, full=True)
+        self._seed_cursors()
+        from metrics import count_reads
+
+        for collection, field, stage in (("people_counter", "video_name", "people_counter"),
+                                         ("moverate", "video_path", "moverate")):
+            reads = 0
+            for doc in db.collection(collection).stream():
+                reads += 1
+                data = doc.to_dict()
+                if data.get(field):
+                    self.record_stage(data[field], stage, {"doc": doc.id})
+            count_reads(collection, reads)
+        self._write("INSERT OR REPLACE INTO meta (key, value) VALUES ('bootstrapped', ?)", (str(time.time()),))
+        return True
+
+    def _seed_cursors(self):
+        """Point every incremental cursor at the newest clip the full listing found."""
+        for prefix in self.prefixes():
+            rows = self._query("SELECT MAX(name) AS last FROM clips WHERE substr(name, 1, ?) = ?",
+                               (len(prefix), prefix))
+            if rows[0]["last"]:
+                self._write("INSERT OR REPLACE INTO cursors (prefix, last_name) VALUES (?, ?)",
+                            (prefix, rows[0]["last"]))
+
+    # ----- work queue -----
+    def pending(self, stages=STAGES, limit=None):
+        """Clips still missing one of the given stages, oldest upload first."""
+        placeholders = ",".join("?" * len(stages))
+        sql = f"""
+            SELECT c.name FROM clips c
+            WHERE (c.status IN ('pending', 'failed') OR (c.status = 'running' AND c.claimed_at < ?))
+              AND c.attempts < ?
+              AND (SELECT COUNT(*) FROM stages s WHERE s.name = c.name AND s.stage IN ({placeholders})) < ?
+            ORDER BY c.uploaded, c.name
+        """
+        params = [time.time() - STALE_CLAIM_SECONDS, MAX_ATTEMPTS, *stages, len(stages)]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [row["name"] for row in self._query(sql, params)]
+
+    def claim(self, name):
+        """Mark a clip as running; False if another thread or process already has it."""
+        return self._write(
+            "UPDATE clips SET status = 'running', attempts = attempts + 1, claimed_at = ?, updated_at = ? "
+            "WHERE name = ? AND attempts < ? "
+            "AND (status IN ('pending', 'failed') OR (status = 'running' AND claimed_at < ?))",
+            (time.time(), time.time(), name, MAX_ATTEMPTS, time.time() - STALE_CLAIM_SECONDS)) == 1
+
+    def release(self, name):
+        """Give a claimed clip back without counting the attempt (interrupted, not failed)."""
+        self._write("UPDATE clips SET status = 'pending', attempts = MAX(attempts - 1, 0), claimed_at = NULL, "
+                    "updated_at = ? WHERE name = ? AND status = 'running'", (time.time(), name))
+
+    def record_stage(self, name, stage, result=None):
+        """Store a stage result; a clip that is not running is marked done once every stage is."""
+        self._write("INSERT OR REPLACE INTO stages (name, stage, result, done_at) VALUES (?, ?, ?, ?)",
+                    (name, stage, json.dumps(result or {}), time.time()))
+        self._write(f"UPDATE clips SET status = 'done', updated_at = ? WHERE name = ? AND status = 'pending' "
+                    f"AND (SELECT COUNT(*) FROM stages WHERE stages.name = clips.name AND stage IN ({STAGE_LIST})) = ?",
+                    (time.time(), name, len(STAGES)))
+
+    def finish(self, name):
+        """End a successful run: done if every stage is recorded, otherwise back to pending."""
+        self._write(f"UPDATE clips SET status = CASE WHEN (SELECT COUNT(*) FROM stages "
+                    f"WHERE stages.name = clips.name AND stage IN ({STAGE_LIST})) = ? THEN 'done' ELSE 'pending' END, "
+                    f"attempts = 0, error = NULL, claimed_at = NULL, updated_at = ? WHERE name = ?",
+                    (len(STAGES), time.time(), name))
+
+    def fail(self, name, error):
+        self._write("UPDATE clips SET status = 'failed', error = ?, updated_at = ? WHERE name = ?",
+                    (str(error)[:500], time.time(), name))
+
+    def retry_failed(self):
+        return self._write("UPDATE clips SET status = 'pending', attempts = 0, updated_at = ? "
+                           "WHERE status = 'failed'", (time.time(),))
+
+    # ----- inspection -----
+    def status(self, name):
+        rows = self._query("SELECT * FROM clips WHERE name = ?", (name,))
+        if not rows:
+            return None
+        clip = dict(rows[0])
+        clip["stages"] = {
+            row["stage"]: json.loads(row["result"] or "{}")
+            for row in self._query("SELECT stage, result FROM stages WHERE name = ?", (name,))
+        }
+        return clip
+
+    def counts(self):
+        return {row["status"]: row["n"] for row in
+                self._query("SELECT status, COUNT(*) AS n FROM clips GROUP BY status")}
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Process-wide ledger, opened on first use."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger()
+        return _ledger
+
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Clip processing ledger")
+    arg_parser.add_argument("--rescan", action="store_true", help="list the whole bucket once")
+    arg_parser.add_argument("--retry", action="store_true", help="retry clips that failed MAX_ATTEMPTS times")
+    args = arg_parser.parse_args()
+
+    ledger = get_ledger()
+    if args.rescan:
+        from uploadclip import initialize_firebase
+        _, bucket = initialize_firebase()
+        print(f"📒 {ledger.discover(bucket, full=True)} new clip(s) found")
+    if args.retry:
+        print(f"📒 {ledger.retry_failed()} failed clip(s) reset")
+    print(f"📒 {ledger.counts()}")
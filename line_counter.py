@@ -0,0 +1,119 @@
+import numpy as np
+
+# ===== Line Counter =====
+# Counts tracked people crossing one or more counting lines. All tracks of a
+# frame are handled in one vectorized step, and tracks that have not been seen
+# for max_age frames are evicted so memory stays flat on long recordings.
+#
+# Direction: a line goes from `start` to `end`. Moving from the left-hand side
+# of that direction (in image coordinates, where y points down) to the
+# right-hand side counts as "out", the opposite as "in". For the default
+# classroom line, drawn from the bottom-left corner up to the right, that
+# means walking down the image is "out", as before.
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+class LineCounter:
+    def __init__(self, lines, max_age=60):
+        """lines: list of (name, start, end) with start/end as (x, y)."""
+        self.names = [name for name, _, _ in lines]
+        self.starts = np.array([start for _, start, _ in lines], dtype=np.float64).reshape(-1, 2)
+        self.ends = np.array([end for _, _, end in lines], dtype=np.float64).reshape(-1, 2)
+        self.max_age = max_age
+
+        self.in_counts = np.zeros(len(lines), dtype=np.int64)
+        self.out_counts = np.zeros(len(lines), dtype=np.int64)
+
+        # Per-track state, kept sorted by id for searchsorted lookups
+        self._ids = np.empty(0, dtype=np.int64)
+        self._pos = np.empty((0, 2), dtype=np.float64)
+        self._seen = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        """Number of tracks currently remembered."""
+        return len(self._ids)
+
+    @property
+    def in_count(self):
+        return int(self.in_counts.sum())
+
+    @property
+    def out_count(self):
+        return int(self.out_counts.sum())
+
+    def per_line(self):
+        return [
+            {"name": name, "in": int(i), "out": int(o)}
+            for name, i, o in zip(self.names, self.in_counts, self.out_counts)
+        ]
+
+    def _crossings(self, prev, cur):
+        """(L, K) masks of tracks moving prev -> cur across each line, per direction."""
+        a = self.starts[:, None, :]           # (L, 1, 2)
+        b = self.ends[:, None, :]
+        p = prev[None, :, :]                  # (1, K, 2)
+        q = cur[None, :, :]
+        ab = b - a
+
+        # Side of the line before/after the move
+        d_prev = _cross(ab[..., 0], ab[..., 1], p[..., 0] - a[..., 0], p[..., 1] - a[..., 1])
+        d_cur = _cross(ab[..., 0], ab[..., 1], q[..., 0] - a[..., 0], q[..., 1] - a[..., 1])
+
+        # The line's end points must lie on different sides of the movement,
+        # so passing beyond the end of the segment does not count
+        pq = q - p
+        d_a = _cross(pq[..., 0], pq[..., 1], a[..., 0] - p[..., 0], a[..., 1] - p[..., 1])
+        d_b = _cross(pq[..., 0], pq[..., 1], b[..., 0] - p[..., 0], b[..., 1] - p[..., 1])
+        within = d_a * d_b <= 0
+
+        crossed_out = (d_prev < 0) & (d_cur >= 0) & within
+        crossed_in = (d_prev >= 0) & (d_cur < 0) & within
+        return crossed_in, crossed_out
+
+    def update(self, frame_idx, boxes, ids):
+        """Update counts with one frame's tracked boxes (N x 4 xyxy) and ids (N).
+
+        Returns a boolean mask of the tracks that were already known before
+        this frame (a track's first sighting only records its position).
+        """
+        ids = np.asarray(ids).astype(np.int64)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        centers = np.empty((len(ids), 2), dtype=np.float64)
+        centers[:, 0] = (boxes[:, 0] + boxes[:, 2]) / 2
+        centers[:, 1] = (boxes[:, 1] + boxes[:, 3]) / 2
+
+        if len(self._ids):
+            idx = np.searchsorted(self._ids, ids)
+            idx = np.minimum(idx, len(self._ids) - 1)
+            known = self._ids[idx] == ids
+        else:
+            idx = np.zeros(len(ids), dtype=np.int64)
+            known = np.zeros(len(ids), dtype=bool)
+
+        if known.any():
+            slots = idx[known]
+            crossed_in, crossed_out = self._crossings(self._pos[slots], centers[known])
+            self.in_counts += crossed_in.sum(axis=1)
+            self.out_counts += crossed_out.sum(axis=1)
+            self._pos[slots] = centers[known]
+            self._seen[slots] = frame_idx
+
+        new = ~known
+        if new.any():
+            new_ids, first = np.unique(ids[new], return_index=True)
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._pos = np.concatenate([self._pos, centers[new][first]])
+            self._seen = np.concatenate([self._seen, np.full(len(new_ids), frame_idx, dtype=np.int64)])
+            order = np.argsort(self._ids, kind="stable")
+            self._ids, self._pos, self._seen = self._ids[order], self._pos[order], self._seen[order]
+
+        self._evict(frame_idx)
+        return known
+
+    def _evict(self, frame_idx):
+        keep = frame_idx - self._seen <= self.max_age
+        if not keep.all():
+            self._ids, self._pos, self._seen = self._ids[keep], self._pos[keep], self._seen[keep]
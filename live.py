@@ -0,0 +1,282 @@
+import cv2
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from capture_pipeline import CapturePipeline
+from counter_people import (
+    PeopleCounter, initialize_firebase, load_model, detection_stride,
+    DETECT_STRIDE, DETECT_FPS, DETECT_BATCH, CONFIG
+)
+from test2 import MovementScorer, build_moverate_record
+from metrics import FRAMES, QUEUE_DEPTH, start_exporter, timed
+import rollups
+import series_codec
+
+# Live mode: frames are read straight from the camera stream and counted /
+# scored in-process, and a people_counter + moverate update is published every
+# PUBLISH_SECONDS. Recording and upload still run, but only as archival: the
+# clips are tagged so the clip analyzer does not process them a second time.
+#
+# The archive recorder opens its own stream session, so the camera must allow
+# two RTSP clients (most IP cameras allow several).
+
+# ===== Config =====
+PUBLISH_SECONDS = 60        # length of one published window
+FRAME_QUEUE_SECONDS = 5     # frames buffered between the reader and the analyzer
+RECONNECT_SECONDS = 5
+DEFAULT_FPS = 25
+
+
+# ===== Stream Reader =====
+class FrameReader:
+    """Reads the stream on its own thread so decoding keeps up with the camera.
+
+    When the analyzer falls behind, the oldest buffered frame is dropped
+    rather than letting the RTSP socket buffer overflow and corrupt frames.
+    """
+
+    def __init__(self, source, stop_event, name="live-reader"):
+        self.source = source
+        self.stop_event = stop_event
+        self.frames = None
+        self.fps = DEFAULT_FPS
+        self.dropped = 0
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            return None
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        if self.frames is None:
+            self.frames = queue.Queue(maxsize=max(1, int(self.fps * FRAME_QUEUE_SECONDS)))
+        return cap
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            cap = self._open()
+            if cap is None:
+                print(f"❌ Cannot open stream {self.source}, retrying in {RECONNECT_SECONDS}s")
+                self.stop_event.wait(RECONNECT_SECONDS)
+                continue
+            self.connected.set()
+            try:
+                while not self.stop_event.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        print(f"❌ Stream read failed, reconnecting in {RECONNECT_SECONDS}s")
+                        break
+                    self._push(frame)
+            finally:
+                cap.release()
+            self.stop_event.wait(RECONNECT_SECONDS)
+
+    def _push(self, frame):
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                    FRAMES.inc(stage="live_dropped")
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=1):
+        """Next frame, or None if nothing arrived within timeout."""
+        if self.frames is None:
+            self.connected.wait(timeout)
+            return None
+        try:
+            frame = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        QUEUE_DEPTH.set(self.frames.qsize(), queue=self.thread.name)
+        return frame
+
+
+# ===== Live Analyzer =====
+class LiveAnalyzer:
+    """Tracks, counts and scores one camera's stream and publishes rolling results.
+
+    Each published window writes one people_counter document (crossings in
+    the window, plus the running occupancy since the analyzer started) and
+    one moverate document, in a single batch.
+    """
+
+    def __init__(self, db, bucket, camera, model=None, interval=PUBLISH_SECONDS, archive=True):
+        self.db = db
+        self.bucket = bucket
+        self.camera = camera
+        self.model = model
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.reader = FrameReader(camera.stream_url, self.stop_event, name=f"live-reader-{camera.id}")
+        self.archive = CapturePipeline(db, bucket, camera=camera, live=True) if archive else None
+        self.thread = None
+
+    # ----- control -----
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"live-{self.camera.id}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=15)
+
+    # ----- analysis loop -----
+    def run(self):
+        if self.model is None:
+            self.model = load_model()   # one model per analyzer thread
+        if self.archive:
+            self.archive.start()
+        self.reader.start()
+        try:
+            self._analyze()
+        except Exception as e:
+            print(f"❌ [{self.camera.id}] Live analysis stopped: {str(e)}")
+            traceback.print_exc()
+        finally:
+            self.stop_event.set()
+            if self.archive:
+                self.archive.stop()
+
+    def _first_frame(self):
+        while not self.stop_event.is_set():
+            frame = self.reader.get()
+            if frame is not None:
+                return frame
+        return None
+
+    def _analyze(self):
+        frame = self._first_frame()
+        if frame is None:
+            return
+
+        fps = self.reader.fps
+        frame_h, frame_w = frame.shape[:2]
+        window_frames = max(1, int(fps * self.interval))
+        counter = PeopleCounter(self.model, frame_w, frame_h,
+                                stride=detection_stride(fps, DETECT_STRIDE, DETECT_FPS),
+                                verbose=False, batch_size=DETECT_BATCH, fps=fps,
+                                lines=self.camera.counting_lines(frame_w, frame_h), draw=False)
+        scorer = MovementScorer(window_frames, fps=fps)
+        scorer.start(frame)
+        print(f"🔴 [{self.camera.id}] Live analysis: {frame_w}x{frame_h} @ {fps:.1f} FPS, "
+              f"publishing every {self.interval}s")
+
+        published = {"in": 0, "out": 0, "lines": counter.line_counter.per_line()}
+        window_start = time.monotonic()
+        while not self.stop_event.is_set():
+            frame = self.reader.get()
+            if frame is not None:
+                # metrics only: nothing is drawn, encoded or uploaded per frame
+                scorer.update(frame)
+                counter.feed(frame)
+
+            if time.monotonic() - window_start >= self.interval and scorer.current_frame > 0:
+                published = self._publish(counter, scorer, published, time.monotonic() - window_start)
+                scorer = scorer.next_window(window_frames)
+                window_start = time.monotonic()
+
+    # ----- publishing -----
+    def _publish(self, counter, scorer, published, elapsed):
+        """Write the results of the window that just ended; returns the new baseline."""
+        # the window's averages are over the frames that actually arrived
+        scorer.frame_count = scorer.current_frame
+        window_in = counter.in_count - published["in"]
+        window_out = counter.out_count - published["out"]
+        lines = counter.line_counter.per_line()
+        window_lines = [
+            {"name": now["name"], "in": now["in"] - before["in"], "out": now["out"] - before["out"]}
+            for now, before in zip(lines, published["lines"])
+        ]
+
+        timestamp = datetime.now(ZoneInfo("Asia/Bangkok"))
+        window_start = timestamp.timestamp() - elapsed
+        source = f"live/{self.camera.id}"
+        people_record = {
+            "room": self.camera.room,
+            "timestamp": timestamp.isoformat(timespec="microseconds"),
+            "in": window_in,
+            "out": window_out,
+            "total_count": window_in - window_out,
+            "occupancy": counter.total_count,
+            "lines": window_lines,
+            "window_seconds": round(elapsed, 1),
+            "dropped_frames": self.reader.dropped,
+            "source": "live",
+            "video_name": None,
+            "video_url": None,
+            "series": series_codec.encode(occupancy=counter.take_occupancy(), start=window_start)
+        }
+        move_id, move_record = build_moverate_record(source, scorer.result(), self.camera.room,
+                                                     series_start=window_start)
+        move_record["source"] = "live"
+        move_record["window_seconds"] = round(elapsed, 1)
+
+        try:
+            batch = self.db.batch()
+            batch.set(self.db.collection("people_counter")
+                      .document(f"{self.camera.id}_{timestamp.strftime('%Y-%m-%d_%H%M%S')}"), people_record)
+            batch.set(self.db.collection("moverate").document(move_id), move_record)
+            rollups.add(batch, self.db, self.camera.room, timestamp,
+                        people=people_record, movement=move_record["overall_score"])
+            with timed("firestore_write"):
+                batch.commit()
+            print(f"📡 [{self.camera.id}] In={window_in} Out={window_out} "
+                  f"Occupancy={counter.total_count} Move={move_record['overall_level']}")
+        except Exception as e:
+            # the counts stay in the counter; the next window publishes from the same baseline
+            print(f"❌ [{self.camera.id}] Failed to publish live results: {str(e)}")
+            return published
+        return {"in": counter.in_count, "out": counter.out_count, "lines": lines}
+
+
+def start_all(db, bucket, cameras=None, interval=PUBLISH_SECONDS, archive=True):
+    """Start one live analyzer (with its own model and archive recorder) per camera."""
+    analyzers = [LiveAnalyzer(db, bucket, camera, interval=interval, archive=archive)
+                 for camera in (cameras or CONFIG.cameras)]
+    for analyzer in analyzers:
+        analyzer.start()
+    return analyzers
+
+
+def main():
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Live people counting and movement scoring")
+    arg_parser.add_argument("--camera", action="append", help="camera id from cameras.json (default: all)")
+    arg_parser.add_argument("--interval", type=int, default=PUBLISH_SECONDS, help="seconds per published window")
+    arg_parser.add_argument("--no-archive", action="store_true", help="do not record and upload clips")
+    args = arg_parser.parse_args()
+
+    cameras = [CONFIG.camera(camera_id) for camera_id in args.camera] if args.camera else CONFIG.cameras
+    if None in cameras:
+        arg_parser.error(f"unknown camera, expected one of: {', '.join(c.id for c in CONFIG.cameras)}")
+
+    start_exporter("live")
+    db, bucket = initialize_firebase()
+    analyzers = start_all(db, bucket, cameras, interval=args.interval, archive=not args.no_archive)
+    try:
+        while any(analyzer.thread.is_alive() for analyzer in analyzers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping live analysis...")
+    finally:
+        for analyzer in analyzers:
+            analyzer.stop()
+
+
+if __name__ == "__main__":
+    main()
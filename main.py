@@ -1,16 +1,177 @@
 import time
-import subprocess
+import queue
+import signal
+import threading
+import traceback
 
-def run_script(script_name):
-    print(f"🔄 Running {script_name}...")
-    result = subprocess.run(["python3", script_name])
-    print(f"✅ {script_name} finished with code {result.returncode}\n")
+import analyze_clip
+import counter_people
+import live
+import uploadclip
+from capture_pipeline import start_all
+from metrics import QUEUE_DEPTH, start_exporter
 
-if __name__ == "__main__":
-    while True:
-        run_script("uploadclip.py")        # 1. บันทึกและอัปโหลดวิดีโอ
-        run_script("counter_people.py")    # 2. นับจำนวนคนจากวิดีโอที่อัปโหลด
-        run_script("test2.py")          # 3. วิเคราะห์การเคลื่อนไหว
+# ===== Config =====
+# "continuous" = บันทึกต่อเนื่องและอัปโหลดคู่ขนาน (capture_pipeline.py)
+# "periodic"   = บันทึกคลิปเดียวทุก CYCLE_SECONDS
+# "live"       = วิเคราะห์จากสตรีมกล้องโดยตรง ส่งผลทุก live.PUBLISH_SECONDS (คลิปอัปโหลดไว้เก็บถาวร)
+# ทุกโหมดบันทึกทุกกล้องใน cameras.json พร้อมกัน
+CAPTURE_MODE = "continuous"
+CYCLE_SECONDS = 300          # บันทึกคลิปใหม่ทุก 5 นาที (โหมด periodic)
+JOB_TIMEOUTS = {             # เวลาสูงสุดของแต่ละงาน (วินาที)
+    "capture": 240,
+    "analyze": 900,
+}
+
+
+class JobInterrupted(BaseException):
+    """Raised inside a running job when it times out or the worker is stopping.
+
+    Derives from BaseException so the jobs' own `except Exception` handlers
+    do not swallow it.
+    """
+
+
+class Deadline:
+    """Cooperative per-job timeout; long loops call check() once per frame."""
+
+    def __init__(self, name, seconds, stop_event):
+        self.name = name
+        self.expires_at = time.monotonic() + seconds
+        self.stop_event = stop_event
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self):
+        if self.stop_event.is_set():
+            raise JobInterrupted(f"{self.name}: worker is shutting down")
+        if time.monotonic() > self.expires_at:
+            raise JobInterrupted(f"{self.name}: timed out")
+
+
+class Worker:
+    """Resident pipeline worker for every camera in cameras.json.
+
+    Firebase is initialized once. Each camera is captured by its own pipeline
+    (or capture thread in periodic mode); analysis runs as jobs pulled from an
+    internal queue by a single job thread, which spreads the pending clips over
+    a pool of analysis threads sized to the machine's cores. Each pool thread
+    loads the YOLO model once and keeps it.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.cameras = uploadclip.CONFIG.cameras
+        self.pipelines = []
+        self.capture_threads = []
+        self.live_analyzers = []
+        self.jobs = queue.Queue()
+        self.pending = set()
+        self.pending_lock = threading.Lock()
 
-        print("⏳ รอ 5 นาทีเพื่อประมวลผลรอบถัดไป...\n")
-        time.sleep(300)  # 5 นาที
+        print("🔄 Initializing worker...")
+        start_exporter("worker")
+        self.db, self.bucket = counter_people.initialize_firebase()
+        self.pool = analyze_clip.create_pool()
+        print(f"✅ Worker ready: {len(self.cameras)} camera(s), {uploadclip.CONFIG.worker_count} analysis thread(s)")
+
+    # ----- job queue -----
+    def submit(self, name):
+        """Queue a job unless the same job is already waiting."""
+        with self.pending_lock:
+            if name in self.pending:
+                return False
+            self.pending.add(name)
+        self.jobs.put(name)
+        QUEUE_DEPTH.set(self.jobs.qsize(), queue="jobs")
+        return True
+
+    def run_capture(self, camera, deadline):
+        if uploadclip.capture_clip(self.db, self.bucket, camera, deadline=deadline):
+            self.submit("analyze")
+
+    def run_analyze(self, deadline):
+        analyze_clip.process_pending(self.db, self.bucket, deadline=deadline, pool=self.pool)
+
+    def run_job(self, kind, handler, name=None):
+        name = name or kind
+        deadline = Deadline(name, JOB_TIMEOUTS[kind], self.stop_event)
+        started = time.monotonic()
+        print(f"🔄 Running {name}...")
+        try:
+            handler(deadline)
+            print(f"✅ {name} finished in {time.monotonic() - started:.1f}s\n")
+        except JobInterrupted as e:
+            print(f"⏹️ {e}")
+        except Exception as e:
+            print(f"❌ {name} failed: {str(e)}")
+            traceback.print_exc()
+
+    def job_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                name = self.jobs.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self.pending_lock:
+                self.pending.discard(name)
+            QUEUE_DEPTH.set(self.jobs.qsize(), queue="jobs")
+            self.run_job(name, {"analyze": self.run_analyze}[name])
+
+    def capture_loop(self, camera):
+        """Periodic mode: capture one clip of this camera every CYCLE_SECONDS."""
+        next_capture = time.monotonic()
+        while not self.stop_event.is_set():
+            if time.monotonic() >= next_capture:
+                self.run_job("capture", lambda deadline: self.run_capture(camera, deadline),
+                             name=f"capture {camera.id}")
+                next_capture += CYCLE_SECONDS
+                print(f"⏳ [{camera.id}] Next capture in {CYCLE_SECONDS // 60} minutes")
+            self.stop_event.wait(1)
+
+    # ----- scheduler -----
+    def run(self):
+        job_thread = threading.Thread(target=self.job_loop, name="jobs")
+        job_thread.start()
+
+        if CAPTURE_MODE == "continuous":
+            # ทุก segment ที่อัปโหลดเสร็จจะสั่งงานวิเคราะห์ (งานที่รออยู่แล้วจะไม่ถูกเพิ่มซ้ำ)
+            self.pipelines = start_all(self.db, self.bucket, self.cameras,
+                                       on_uploaded=lambda blob_name: self.submit("analyze"))
+        elif CAPTURE_MODE == "live":
+            # ผลถูกส่งจากสตรีมโดยตรง งานวิเคราะห์คลิปเหลือแค่คลิปค้างจากโหมดอื่น
+            self.live_analyzers = live.start_all(self.db, self.bucket, self.cameras)
+        else:
+            for camera in self.cameras:
+                thread = threading.Thread(target=self.capture_loop, args=(camera,), name=f"capture-{camera.id}")
+                thread.start()
+                self.capture_threads.append(thread)
+
+        # งานวิเคราะห์ค้างจากรอบก่อน (ถ้ามี) ทำก่อนเลย
+        self.submit("analyze")
+        try:
+            while not self.stop_event.is_set():
+                self.stop_event.wait(1)
+        finally:
+            self.stop_event.set()
+            for pipeline in self.pipelines:
+                pipeline.stop()
+            for analyzer in self.live_analyzers:
+                analyzer.stop()
+            for thread in self.capture_threads:
+                thread.join()
+            job_thread.join()
+            self.pool.shutdown()
+            print("🛑 Worker stopped")
+
+    def stop(self, *args):
+        print("\n🛑 Stopping worker (finishing current frame)...")
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    worker = Worker()
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()
@@ -0,0 +1,302 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Process metrics in the Prometheus text format, without extra dependencies.
+#
+# Every script records into the module-level metrics below. Worker processes
+# call start_exporter(name), which writes a JSON snapshot to METRICS_DIR every
+# EXPORT_SECONDS and once more at exit; the dashboard serves its own metrics
+# plus every fresh snapshot at /metrics (app.py), each sample labelled with
+# its process name and pid.
+#
+#   smartclass_stage_seconds{stage}           time per stage call (download, decode,
+#                                             optical_flow, encode, upload, firestore_write, ...)
+#   smartclass_frames_total{stage}            frames through a stage
+#   smartclass_inference_seconds{mode}        detector call latency (track / batch)
+#   smartclass_queue_depth{queue}             items waiting per queue
+#   smartclass_bytes_total{direction}         bytes downloaded / uploaded
+#   smartclass_firestore_reads_total{collection}
+#   smartclass_firestore_reads_per_request{endpoint}
+#   smartclass_http_request_seconds{endpoint}
+#   smartclass_event_streams                  open /events connections
+
+# ===== Config =====
+METRICS_DIR = os.environ.get("SMARTCLASS_METRICS_DIR", "metrics")
+EXPORT_SECONDS = 15
+STALE_SECONDS = 300          # snapshots older than this belong to a stopped process
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+# ===== Metric types =====
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """[(suffix, labels, value)] for the text format."""
+        raise NotImplementedError
+
+    def snapshot(self):
+        return {"name": self.name, "help": self.documentation, "type": self.kind, "samples": self.samples()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", dict(zip(self.label_names, key)), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", dict(zip(self.label_names, key)), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(("_bucket", {**labels, "le": f"{bound:g}"}, cumulative))
+                samples.append(("_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, count))
+        return samples
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram("smartclass_stage_seconds", "Wall time of one call of a pipeline stage", ["stage"])
+FRAMES = Counter("smartclass_frames_total", "Frames processed by a pipeline stage", ["stage"])
+INFERENCE_SECONDS = Histogram("smartclass_inference_seconds", "Latency of one detector call", ["mode"])
+QUEUE_DEPTH = Gauge("smartclass_queue_depth", "Items waiting in a queue", ["queue"])
+BYTES = Counter("smartclass_bytes_total", "Bytes transferred to or from storage", ["direction"])
+FIRESTORE_READS = Counter("smartclass_firestore_reads_total", "Documents read from the database", ["collection"])
+READS_PER_REQUEST = Histogram("smartclass_firestore_reads_per_request",
+                              "Documents read while serving one HTTP request", ["endpoint"], COUNT_BUCKETS)
+HTTP_SECONDS = Histogram("smartclass_http_request_seconds", "Time to serve one HTTP request", ["endpoint"])
+EVENT_STREAMS = Gauge("smartclass_event_streams", "Open server-sent event streams")
+
+
+def timed(stage):
+    """with timed("upload"): ... records smartclass_stage_seconds{stage="upload"}."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+# ===== Per-request reads =====
+_request = threading.local()
+
+
+class _RequestReads:
+    """Documents read for one HTTP request, possibly from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, count):
+        with self._lock:
+            self.count += count
+
+
+def start_request():
+    _request.reads = _RequestReads()
+
+
+def count_reads(collection, count):
+    """Record documents read; also charged to the HTTP request this thread is serving."""
+    if count:
+        FIRESTORE_READS.inc(count, collection=collection)
+        reads = getattr(_request, "reads", None)
+        if reads is not None:
+            reads.add(count)
+
+
+def bind_request(fn):
+    """fn, charging its reads to the calling thread's HTTP request when run on a pool thread."""
+    reads = getattr(_request, "reads", None)
+    if reads is None:
+        return fn
+
+    def run(*args, **kwargs):
+        _request.reads = reads
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _request.reads = None
+
+    return run
+
+
+def finish_request(endpoint, seconds):
+    reads = getattr(_request, "reads", None)
+    _request.reads = None
+    READS_PER_REQUEST.observe(reads.count if reads is not None else 0, endpoint=endpoint)
+    HTTP_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+# ===== Text format =====
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(snapshots):
+    """Prometheus text for several process snapshots, one HELP/TYPE block per metric."""
+    families = {}
+    for process in snapshots:
+        for family in process["families"]:
+            merged = families.setdefault(family["name"], {**family, "samples": []})
+            merged["samples"].extend(
+                (suffix, {**labels, "process": process["process"], "pid": process["pid"]}, value)
+                for suffix, labels, value in family["samples"])
+
+    lines = []
+    for name, family in families.items():
+        if not family["samples"]:
+            continue
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for suffix, labels, value in family["samples"]:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(process):
+    return {"process": process, "pid": os.getpid(), "time": time.time(),
+            "families": [metric.snapshot() for metric in REGISTRY]}
+
+
+# ===== Shared file export =====
+def _snapshot_path(process, directory):
+    return os.path.join(directory, f"{process}-{os.getpid()}.json")
+
+
+def write_snapshot(process, directory=METRICS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(process, directory)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot(process), f)
+    os.replace(f"{path}.tmp", path)   # readers never see a half-written file
+
+
+def read_snapshots(directory=METRICS_DIR, max_age=STALE_SECONDS):
+    """Snapshots written by worker processes in the last max_age seconds."""
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - data.get("time", 0) <= max_age:
+            snapshots.append(data)
+    return snapshots
+
+
+_exporter = None
+
+
+def start_exporter(process, directory=METRICS_DIR, interval=EXPORT_SECONDS):
+    """Write this process's metrics to directory every interval seconds (once per process)."""
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+
+    def run():
+        while True:
+            try:
+                write_snapshot(process, directory)
+            except OSError as e:
+                print(f"⚠️ Could not write metrics: {e}")
+            time.sleep(interval)
+
+    def final():
+        # one-shot scripts exit before the first interval; the file expires after STALE_SECONDS
+        try:
+            write_snapshot(process, directory)
+        except OSError:
+            pass
+
+    _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    _exporter.start()
+    atexit.register(final)
+    return _exporter
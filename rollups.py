@@ -0,0 +1,249 @@
+import re
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from datastore import Increment, Maximum
+from metrics import count_reads
+
+# Pre-aggregated history: every people_counter / moverate result is added to a
+# per-minute, per-hour and per-day rollup document of its room, in the same
+# batch that stores the result. A history query then reads at most
+# MAX_BUCKETS small documents of one resolution instead of the raw collections.
+#
+# Rollup document (rollups_minute / rollups_hour / rollups_day), id <room>_<start>:
+#   room, resolution, timestamp (bucket start, Bangkok time)
+#   people_sum, people_samples, people_max    people present per result
+#   in, out                                   crossings
+#   move_sum, move_samples                    movement scores
+#
+# Results are bucketed by the time the clip was recorded (from its name) when
+# known, otherwise by the result's own timestamp. A clip retried after its
+# batch committed is counted twice; `python rollups.py --rebuild` recomputes
+# every rollup from the raw collections.
+#
+# Firestore needs a composite index (room, timestamp) on each rollup collection.
+
+# ===== Config =====
+LOCAL_TZ = ZoneInfo("Asia/Bangkok")
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}      # finest first
+COLLECTIONS = {name: f"rollups_{name}" for name in RESOLUTIONS}
+HISTORY_POINTS = 200          # default points returned by history()
+MAX_POINTS = 2000
+MAX_BUCKETS = 2000            # most rollup documents one history query may read
+CLIP_TIME = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{6})")
+
+
+def get_level(score):
+    """Movement level of an overall_score (shared with test2.py)."""
+    if score < 0.5: return "Very Low"
+    elif score < 1.0: return "Low"
+    elif score < 1.5: return "Medium"
+    elif score < 2.0: return "High"
+    else: return "Very High"
+
+
+# ===== Buckets =====
+def bucket_start(when, resolution):
+    """Start of the bucket holding `when`; buckets follow Bangkok days."""
+    local = when.astimezone(LOCAL_TZ)
+    if resolution == "minute":
+        return local.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def doc_id(room, resolution, start):
+    return f"{room}_{start.strftime('%Y%m%d%H%M' if resolution != 'day' else '%Y%m%d')}"
+
+
+def clip_time(name):
+    """Recording time from a clip name (<camera>_YYYY-mm-dd_HHMMSS.mp4), or None."""
+    match = CLIP_TIME.search(name or "")
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y-%m-%d_%H%M%S").replace(tzinfo=LOCAL_TZ)
+
+
+def result_time(name, timestamp):
+    """Bucket time of a stored result: its clip's recording time, else its timestamp."""
+    when = clip_time(name)
+    if when is None and isinstance(timestamp, str):
+        when = datetime.fromisoformat(timestamp)
+    elif when is None:
+        when = timestamp or datetime.now(LOCAL_TZ)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=LOCAL_TZ)     # people_counter timestamps are Bangkok wall time
+    return when
+
+
+def people_present(record):
+    """People in the room for one people_counter record (live windows carry occupancy)."""
+    return record.get("occupancy", record.get("total_count", 0)) or 0
+
+
+# ===== Ingest =====
+def add(batch, db, room, when, people=None, movement=None):
+    """Add one result to the room's minute / hour / day rollups, as writes in batch.
+
+    people: a people_counter record; movement: a moverate overall_score.
+    """
+    fields = {}
+    if people is not None:
+        present = people_present(people)
+        fields.update({
+            "people_sum": Increment(present),
+            "people_samples": Increment(1),
+            "people_max": Maximum(present),
+            "in": Increment(people.get("in", 0)),
+            "out": Increment(people.get("out", 0)),
+        })
+    if movement is not None:
+        fields.update({"move_sum": Increment(float(movement)), "move_samples": Increment(1)})
+    if not fields:
+        return
+    for resolution in RESOLUTIONS:
+        start = bucket_start(when, resolution)
+        batch.set(db.collection(COLLECTIONS[resolution]).document(doc_id(room, resolution, start)),
+                  {"room": room, "resolution": resolution, "timestamp": start, **fields}, merge=True)
+
+
+# ===== Query =====
+def choose_resolution(start, end, points):
+    """Coarsest resolution that still gives `points` buckets, within MAX_BUCKETS reads."""
+    span = (end - start).total_seconds()
+    chosen = None
+    for name, seconds in RESOLUTIONS.items():
+        buckets = span / seconds
+        if buckets > MAX_BUCKETS:
+            continue
+        if chosen is None or buckets >= points:
+            chosen = name
+    return chosen or "day"
+
+
+def history(db, start, end, room=None, points=HISTORY_POINTS):
+    """People and movement between start and end, downsampled to at most `points` bins."""
+    points = max(1, min(points, MAX_POINTS))
+    resolution = choose_resolution(start, end, points)
+    width = RESOLUTIONS[resolution]
+    span = (end - start).total_seconds()
+    bins = max(1, min(points, int(span // width) or 1))
+    bin_seconds = span / bins
+
+    query = db.collection(COLLECTIONS[resolution])
+    if room is not None:
+        query = query.where("room", "==", room)
+    query = query.where("timestamp", ">=", bucket_start(start, resolution)).where("timestamp", "<", end)
+    docs = [doc.to_dict() for doc in query.order_by("timestamp").stream()]
+    count_reads(COLLECTIONS[resolution], len(docs))
+
+    totals = [{"people_sum": 0, "people_samples": 0, "people_max": None, "in": 0, "out": 0,
+               "move_sum": 0.0, "move_samples": 0} for _ in range(bins)]
+    for doc in docs:
+        offset = (doc["timestamp"] if isinstance(doc["timestamp"], datetime)
+                  else datetime.fromisoformat(doc["timestamp"])) - start
+        i = min(bins - 1, max(0, int(offset.total_seconds() // bin_seconds)))
+        total = totals[i]
+        for key in ("people_sum", "people_samples", "in", "out", "move_sum", "move_samples"):
+            total[key] += doc.get(key, 0) or 0
+        if doc.get("people_max") is not None:
+            total["people_max"] = max(total["people_max"] or 0, doc["people_max"])
+
+    labels, people_avg, people_max, crossings_in, crossings_out, move_score, move_level = [], [], [], [], [], [], []
+    for i, total in enumerate(totals):
+        labels.append((start + timedelta(seconds=i * bin_seconds)).astimezone(LOCAL_TZ).isoformat())
+        people = total["people_sum"] / total["people_samples"] if total["people_samples"] else None
+        score = total["move_sum"] / total["move_samples"] if total["move_samples"] else None
+        people_avg.append(round(people, 2) if people is not None else None)
+        people_max.append(total["people_max"])
+        crossings_in.append(total["in"])
+        crossings_out.append(total["out"])
+        move_score.append(round(score, 2) if score is not None else None)
+        move_level.append(get_level(score) if score is not None else None)
+
+    return {
+        "room": room,
+        "from": start.astimezone(LOCAL_TZ).isoformat(),
+        "to": end.astimezone(LOCAL_TZ).isoformat(),
+        "resolution": resolution,
+        "bin_seconds": bin_seconds,
+        "labels": labels,
+        "people_avg": people_avg,
+        "people_max": people_max,
+        "in": crossings_in,
+        "out": crossings_out,
+        "move_score": move_score,
+        "move_level": move_level,
+    }
+
+
+# ===== Rebuild =====
+def rebuild(db, batch_size=400):
+    """Recompute every rollup from people_counter and moverate (one full scan of each)."""
+    from config import get_config
+
+    default_room = get_config().cameras[0].room
+    buckets = {}
+
+    def bucket(room, resolution, when):
+        start = bucket_start(when, resolution)
+        return buckets.setdefault((resolution, doc_id(room, resolution, start)), {
+            "room": room, "resolution": resolution, "timestamp": start,
+            "people_sum": 0, "people_samples": 0, "people_max": 0, "in": 0, "out": 0,
+            "move_sum": 0.0, "move_samples": 0})
+
+    reads = 0
+    for doc in db.collection("people_counter").stream():
+        reads += 1
+        data = doc.to_dict()
+        when = result_time(data.get("video_name"), data.get("timestamp"))
+        present = people_present(data)
+        for resolution in RESOLUTIONS:
+            total = bucket(data.get("room") or default_room, resolution, when)
+            total["people_sum"] += present
+            total["people_samples"] += 1
+            total["people_max"] = max(total["people_max"], present)
+            total["in"] += data.get("in", 0) or 0
+            total["out"] += data.get("out", 0) or 0
+    count_reads("people_counter", reads)
+
+    reads = 0
+    for doc in db.collection("moverate").stream():
+        reads += 1
+        data = doc.to_dict()
+        if data.get("overall_score") is None:
+            continue
+        when = result_time(data.get("video_path"), data.get("timestamp"))
+        for resolution in RESOLUTIONS:
+            total = bucket(data.get("room") or default_room, resolution, when)
+            total["move_sum"] += float(data["overall_score"])
+            total["move_samples"] += 1
+    count_reads("moverate", reads)
+
+    items = list(buckets.items())
+    for i in range(0, len(items), batch_size):
+        batch = db.batch()
+        for (resolution, name), data in items[i:i + batch_size]:
+            batch.set(db.collection(COLLECTIONS[resolution]).document(name), data)
+        batch.commit()
+    return len(items)
+
+
+if __name__ == "__main__":
+    import argparse
+    from datastore import get_store
+
+    arg_parser = argparse.ArgumentParser(description="People / movement rollups")
+    arg_parser.add_argument("--rebuild", action="store_true", help="recompute all rollups from the raw results")
+    arg_parser.add_argument("--days", type=int, default=7, help="show the last N days")
+    arg_parser.add_argument("--room")
+    args = arg_parser.parse_args()
+
+    store = get_store()
+    if args.rebuild:
+        print(f"📈 {rebuild(store.db)} rollup document(s) written")
+    now = datetime.now(LOCAL_TZ)
+    result = history(store.db, now - timedelta(days=args.days), now, args.room, points=args.days)
+    for label, people, level in zip(result["labels"], result["people_avg"], result["move_level"]):
+        print(f"{label[:10]}  people={people}  movement={level}")
@@ -0,0 +1,77 @@
+import struct
+
+import numpy as np
+
+# Compact per-second series stored with each analysis result, in the bytes
+# field "series" of its moverate (movement) and people_counter (occupancy)
+# document. A 5-minute clip takes 24 + 300 * 2 bytes per channel.
+#
+# Layout (little-endian):
+#
+#   offset  size  field
+#   0       4     magic b"SCSR"
+#   4       2     version (1)
+#   6       2     channels, bit mask: 1 = movement, 2 = occupancy
+#   8       8     start, float64 epoch seconds of the first sample (0 = clip start)
+#   16      4     step, float32 seconds per sample (1.0)
+#   20      4     count, uint32 samples per channel
+#   24            one array of `count` samples per channel, in bit order:
+#                   movement   float16  smoothed movement score averaged over the second
+#                   occupancy  int16    running in - out at the end of the second
+#
+# Every array starts at an even offset, so decode() returns read-only NumPy
+# views of the bytes without copying.
+
+# ===== Layout =====
+MAGIC = b"SCSR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdfI")
+CHANNELS = (                   # (bit, name, dtype), in storage order
+    (1, "movement", np.dtype("<f2")),
+    (2, "occupancy", np.dtype("<i2")),
+)
+
+
+# ===== Encode / decode =====
+def encode(movement=None, occupancy=None, start=0.0, step=1.0):
+    """Pack per-second arrays (all the same length) into one series blob."""
+    values = {"movement": movement, "occupancy": occupancy}
+    mask = 0
+    arrays = []
+    count = None
+    for bit, name, dtype in CHANNELS:
+        if values[name] is None:
+            continue
+        array = np.asarray(values[name], dtype=np.float64)
+        if count is not None and len(array) != count:
+            raise ValueError(f"Series channels differ in length: {name} has {len(array)}, expected {count}")
+        count = len(array)
+        if dtype.kind == "i":
+            info = np.iinfo(dtype)
+            array = np.clip(np.round(array), info.min, info.max)
+        mask |= bit
+        arrays.append(array.astype(dtype))
+    if not mask:
+        raise ValueError("A series needs at least one channel")
+    header = HEADER.pack(MAGIC, VERSION, mask, float(start), float(step), count)
+    return header + b"".join(array.tobytes() for array in arrays)
+
+
+def decode(data):
+    """Series blob -> {"start", "step", "count", <channel>: ndarray view} (no copy)."""
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise ValueError("Series is shorter than its header")
+    magic, version, mask, start, step, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a smartclass series")
+    if version != VERSION:
+        raise ValueError(f"Unsupported series version: {version}")
+
+    series = {"start": start, "step": step, "count": count}
+    offset = HEADER.size
+    for bit, name, dtype in CHANNELS:
+        if mask & bit:
+            series[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += count * dtype.itemsize
+    return series
@@ -0,0 +1,255 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import get_config
+from metrics import BYTES, timed
+
+# Streaming clip download: the blob is fetched in parallel ranged chunks and
+# written, in order, into an ffmpeg decoder, so analysis starts on the first
+# frames while the rest of the clip is still downloading.
+#
+# Streaming needs the MP4 index (moov) before the media data, which is how
+# every clip recorded with +faststart is laid out. Other clips are downloaded
+# the same parallel way into a temp file and opened with cv2.VideoCapture.
+# Either way the bytes are checked against the blob's MD5 before end of stream
+# is reported (a mismatch raises ChecksumError from read(), so results of a
+# corrupt download are never saved), and temp files are removed on release().
+# Blobs of the local store (datastore.py) are already files and are opened
+# in place.
+
+# ===== Config =====
+CHUNK_BYTES = 8 * 1024 ** 2     # size of one ranged request
+PARALLEL_CHUNKS = 4             # ranged requests in flight
+FFPROBE_PATH = os.path.join(os.path.dirname(get_config().ffmpeg_path),
+                            "ffprobe" + os.path.splitext(get_config().ffmpeg_path)[1])
+
+
+class ChecksumError(IOError):
+    """The downloaded bytes do not match the MD5 stored with the blob."""
+
+
+# ===== MP4 layout =====
+def is_faststart(head):
+    """True if the top-level moov box comes before mdat in the first bytes of an MP4."""
+    offset = 0
+    while offset + 8 <= len(head):
+        size, kind = struct.unpack(">I4s", head[offset:offset + 8])
+        if size == 1 and offset + 16 <= len(head):
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if kind == b"moov":
+            return True
+        if kind == b"mdat" or size < 8:
+            return False
+        offset += size
+    return False
+
+
+def probe_stream(head):
+    """Width, height, fps and frame count of the first video stream, from the start of the file."""
+    result = subprocess.run(
+        [FFPROBE_PATH, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height,avg_frame_rate,nb_frames,duration",
+         "-of", "json", "pipe:0"],
+        input=head, capture_output=True, timeout=30)
+    streams = json.loads(result.stdout or b"{}").get("streams") or []
+    if not streams:
+        raise RuntimeError(f"ffprobe could not read the clip header: {result.stderr.decode(errors='ignore')}")
+    stream = streams[0]
+    num, _, den = stream.get("avg_frame_rate", "0/1").partition("/")
+    fps = float(num) / float(den) if den and float(den) else 0.0
+    frame_count = int(stream.get("nb_frames") or 0)
+    if not frame_count and stream.get("duration") and fps:
+        frame_count = int(float(stream["duration"]) * fps)
+    return int(stream["width"]), int(stream["height"]), fps or 30.0, frame_count
+
+
+# ===== Parallel ranged download =====
+class ChunkFetcher:
+    """Downloads a blob as ordered chunks with PARALLEL_CHUNKS ranged requests in flight."""
+
+    def __init__(self, blob, chunk_bytes=CHUNK_BYTES, parallel=PARALLEL_CHUNKS):
+        self.blob = blob
+        self.chunk_bytes = chunk_bytes
+        self.parallel = parallel
+        self.md5 = hashlib.md5()
+
+    def _fetch(self, start):
+        end = min(start + self.chunk_bytes, self.blob.size) - 1
+        # raw_download: the bytes exactly as stored, so the MD5 can be checked
+        with timed("download"):
+            data = self.blob.download_as_bytes(start=start, end=end, raw_download=True)
+        BYTES.inc(len(data), direction="download")
+        return data
+
+    def chunks(self):
+        """Yield the blob's bytes in order; the MD5 is checked after the last chunk."""
+        starts = list(range(0, self.blob.size, self.chunk_bytes))
+        with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="download") as pool:
+            futures = {}
+            try:
+                for i, start in enumerate(starts):
+                    # keep PARALLEL_CHUNKS requests ahead of the one being consumed
+                    for ahead in starts[i:i + self.parallel]:
+                        if ahead not in futures:
+                            futures[ahead] = pool.submit(self._fetch, ahead)
+                    data = futures.pop(start).result()
+                    self.md5.update(data)
+                    yield data
+            finally:
+                # stopped early (release() / error): drop the requests not started yet
+                for future in futures.values():
+                    future.cancel()
+        self.verify()
+
+    def verify(self):
+        if not self.blob.md5_hash:
+            print(f"⚠️ No MD5 stored for {self.blob.name} (composite object), skipping checksum")
+            return
+        expected = base64.b64decode(self.blob.md5_hash)
+        if self.md5.digest() != expected:
+            raise ChecksumError(f"MD5 mismatch for {self.blob.name}")
+
+
+def download_to_file(blob, path):
+    """Parallel ranged download into path, MD5-checked."""
+    if getattr(blob, "local_path", None):
+        shutil.copyfile(blob.local_path, path)
+        return path
+    fetcher = ChunkFetcher(blob)
+    with open(path, "wb") as f:
+        for data in fetcher.chunks():
+            f.write(data)
+    return path
+
+
+# ===== Captures =====
+class StreamCapture:
+    """cv2.VideoCapture-like reader over frames decoded while the clip downloads."""
+
+    def __init__(self, blob, head, chunks):
+        self.name = blob.name
+        self.width, self.height, self.fps, self.frame_count = probe_stream(head)
+        self.frame_bytes = self.width * self.height * 3
+        self.error = None
+        self.stop_event = threading.Event()
+        self.process = subprocess.Popen(
+            [get_config().ffmpeg_path, "-hide_banner", "-loglevel", "error",
+             "-i", "pipe:0", "-map", "0:v:0", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.feeder = threading.Thread(target=self._feed, args=(head, chunks),
+                                       name="download-feed", daemon=True)
+        self.feeder.start()
+
+    def _feed(self, head, chunks):
+        try:
+            self.process.stdin.write(head)
+            for data in chunks:
+                if self.stop_event.is_set():
+                    break
+                self.process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            pass  # decoder stopped (release() or ffmpeg error), reported by read()
+        except BaseException as e:
+            self.error = e
+        finally:
+            chunks.close()
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+    def isOpened(self):
+        return not self.stop_event.is_set()
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_COUNT: self.frame_count,
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+        }.get(prop, 0)
+
+    def read(self):
+        # a fresh writable buffer per frame, so the frame can be drawn on without a copy
+        buffer = bytearray(self.frame_bytes)
+        if self.process.stdout.readinto(buffer) < self.frame_bytes:
+            self._finish()
+            return False, None
+        return True, np.frombuffer(buffer, np.uint8).reshape(self.height, self.width, 3)
+
+    def grab(self):
+        return self.read()[0]
+
+    def _finish(self):
+        """End of stream: surface download / checksum / decoder errors instead of a short clip."""
+        self.feeder.join()
+        returncode = self.process.wait()
+        if self.error is not None:
+            raise self.error
+        if returncode != 0 and not self.stop_event.is_set():
+            raise RuntimeError(f"ffmpeg could not decode {self.name} (code {returncode})")
+
+    def release(self):
+        self.stop_event.set()
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.feeder.join(timeout=5)
+        self.process.stdout.close()
+
+
+class FileCapture:
+    """cv2.VideoCapture on a temp file that is deleted on release()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+    def release(self):
+        self.cap.release()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_blob(blob):
+    """Open a Storage clip for decoding: streamed if it is faststart, else via a temp file.
+
+    Always call release() (or use it in try/finally); it stops the download
+    and removes any temp file.
+    """
+    if getattr(blob, "local_path", None):
+        return cv2.VideoCapture(blob.local_path)
+    if blob.size is None or blob.md5_hash is None:
+        blob.reload()
+    fetcher = ChunkFetcher(blob)
+    chunks = fetcher.chunks()
+    head = next(chunks, b"")
+
+    if is_faststart(head):
+        return StreamCapture(blob, head, chunks)
+
+    print(f"⚠️ {blob.name} is not faststart, downloading before decoding")
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
+    try:
+        with temp_file:
+            temp_file.write(head)
+            for data in chunks:
+                temp_file.write(data)
+        return FileCapture(temp_file.name)
+    except BaseException:
+        os.remove(temp_file.name)
+        raise
@@ -1,7 +1,5 @@
 import cv2
 import numpy as np
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
 from datetime import datetime
 import traceback
 import os
@@ -9,22 +7,26 @@ import uuid
 import tempfile
 import time
 
+from config import get_config
+from datastore import get_store, SERVER_TIMESTAMP
+from ledger import get_ledger
+from stream_download import download_to_file, open_blob
+from metrics import FRAMES, start_exporter, timed
+import rollups
+import series_codec
+from rollups import get_level
+
+CONFIG = get_config()
+
 # 1. Initialize Firebase
 def initialize_firebase():
     try:
-        if not firebase_admin._apps:
-            cred_path = 'smart-class-e9661-firebase-adminsdk-fbsvc-bf137255f5.json'
-            if not os.path.exists(cred_path):
-                raise FileNotFoundError("Credentials file not found")
-            
-            cred = credentials.Certificate(cred_path)
-            firebase_admin.initialize_app(cred, {
-                'storageBucket': 'smart-class-e9661.firebasestorage.app'  # <<== ตรงนี้แก้จาก .app เป็น .com
-            })
-            
-            db = firestore.client()
-            print("✅ Firebase connection successful")
-            return db
+        if CONFIG.store == "firebase" and not os.path.exists(CONFIG.credentials):
+            raise FileNotFoundError("Credentials file not found")
+
+        db = get_store().db
+        print(f"✅ {CONFIG.store.capitalize()} store connection successful")
+        return db
     except Exception as e:
         print(f"❌ Firebase connection error: {str(e)}")
         traceback.print_exc()
@@ -33,14 +35,20 @@ def initialize_firebase():
 # 2. Download video from Firebase Storage
 def download_video_from_storage(storage_path):
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(storage_path)
-        if not blob.exists():
+        bucket = get_store().bucket
+        blob = bucket.get_blob(storage_path)
+        if blob is None:
             print(f"❌ Video not found in storage: {storage_path}")
             return None
         
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-        blob.download_to_filename(temp_file.name)
+        temp_file.close()
+        try:
+            # ranged chunks in parallel, MD5-checked (stream_download.py)
+            download_to_file(blob, temp_file.name)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
         print(f"✅ Downloaded video to: {temp_file.name}")
         return temp_file.name
     except Exception as e:
@@ -49,22 +57,205 @@ def download_video_from_storage(storage_path):
         return None
 
 # 3. Analyze video
-def analyze_video(video_path):
+SCORING_MODE = "farneback"   # "farneback", "dis" (DIS optical flow) or "diff" (frame-difference energy)
+SCORING_STRIDE = 1           # score every N-th frame pair; skipped frames repeat the last score
+ROI_MASK_PATH = None         # grayscale image, white = area to score (hide windows, the board, ...)
+
+# raw score -> Farneback-equivalent score (score = a * raw + b), so that
+# get_level() thresholds mean the same thing in every mode.
+# None = not fitted yet; the mode is refused until it is. Fit it on footage
+# from the classroom cameras and paste the printed constants here:
+#   python test2.py --calibrate <mode> clip1.mp4 clip2.mp4 ...
+CALIBRATION = {
+    "farneback": (1.0, 0.0),     # the reference scale
+    "dis": None,
+    "diff": None,
+}
+
+def load_roi_mask(path):
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise FileNotFoundError(f"ROI mask not found: {path}")
+    return mask
+
+class MovementScorer:
+    """Frame-by-frame movement scoring, so a decoded frame can be shared with
+    the people counter (see analyze_clip.py).
+
+    Part and overall averages are kept as running sums, so memory does not
+    grow with the length of the clip. One average per second of video is kept
+    for the stored series (series_codec.py).
+    """
+
+    def __init__(self, frame_count, total_parts=10, scale=0.35, alpha=0.7,
+                 mode=SCORING_MODE, roi_mask=ROI_MASK_PATH, stride=SCORING_STRIDE, fps=30, calibration=None):
+        if mode not in CALIBRATION:
+            raise ValueError(f"Unknown scoring mode: {mode}")
+        calibration = calibration or CALIBRATION[mode]
+        if calibration is None:
+            raise ValueError(f"Scoring mode {mode} is not calibrated; run: python test2.py --calibrate {mode} <clips>")
+        self.frame_count = frame_count
+        self.total_parts = total_parts
+        self.frames_per_part = max(1, frame_count // total_parts)
+        self.scale = scale
+        self.alpha = alpha
+        self.mode = mode
+        self.stride = max(1, stride)
+        self.fps = fps or 30
+        self.calibration = calibration
+        self.roi_mask = load_roi_mask(roi_mask) if isinstance(roi_mask, str) else roi_mask
+        self.dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST) if mode == "dis" else None
+
+        self.prev_gray = None
+        self.gap = 0              # frames between prev_gray and the current frame
+        self.mask = None
+        self.part_scores = []
+        self.part_sum = 0
+        self.overall_sum = 0
+        self.second_sums = []     # per-second score sums; the last second may be partial
+        self.second_frames = []
+        self.prev_movement_score = 0
+        self.current_frame = 0
+
+    def _prepare(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale)
+
+    def start(self, frame):
+        self.prev_gray = self._prepare(frame)
+        if self.roi_mask is not None:
+            h, w = self.prev_gray.shape[:2]
+            mask = cv2.resize(self.roi_mask, (w, h), interpolation=cv2.INTER_NEAREST)
+            self.mask = np.where(mask > 0, 255, 0).astype(np.uint8)
+
+    def raw_score(self, prev_gray, gray):
+        """Movement between two prepared frames, before calibration and smoothing."""
+        if self.mode == "diff":
+            energy = cv2.absdiff(prev_gray, gray)
+            return cv2.mean(energy, mask=self.mask)[0]
+
+        if self.mode == "dis":
+            flow = self.dis.calc(prev_gray, gray, None)
+        else:
+            flow = cv2.calcOpticalFlowFarneback(
+                prev_gray, gray, None, 0.5, 3, 15, 3, 5, 1.2, 0
+            )
+        if self.mask is None:
+            magnitude = np.sqrt(flow[...,0]**2 + flow[...,1]**2)
+            return np.mean(magnitude)
+        return cv2.mean(cv2.magnitude(flow[...,0], flow[...,1]), mask=self.mask)[0]
+
+    def calibrated(self, raw):
+        a, b = self.calibration
+        return a * raw + b
+
+    def update(self, frame):
+        self.gap += 1
+        if self.current_frame % self.stride == 0:
+            with timed("optical_flow"):
+                gray = self._prepare(frame)
+                # Movement across a strided pair is spread over the frames it spans
+                raw = self.raw_score(self.prev_gray, gray)
+            FRAMES.inc(stage="optical_flow")
+            current_score = self.calibrated(raw / self.gap if self.gap > 1 else raw)
+            self.prev_gray = gray
+            self.gap = 0
+            current_score = self.smooth(current_score)
+        else:
+            # Skipped frame: no decode work beyond reading, hold the last score
+            current_score = self.prev_movement_score
+
+        self.add_score(current_score)
+
+    def smooth(self, current_score):
+        """EMA of a calibrated pair score; a zero or NaN score holds the last one."""
+        if current_score == 0 or np.isnan(current_score):
+            return self.prev_movement_score
+        return self.alpha * self.prev_movement_score + (1-self.alpha) * current_score
+
+    def replay(self, pair_scores, updates):
+        """Apply `updates` update() calls whose calibrated pair scores were computed
+        elsewhere (see score_parallel); pair_scores maps update index -> score."""
+        for _ in range(updates):
+            if self.current_frame % self.stride == 0:
+                current_score = self.smooth(pair_scores[self.current_frame])
+            else:
+                current_score = self.prev_movement_score
+            self.add_score(current_score)
+
+    def add_score(self, current_score):
+        """Accumulate one smoothed per-frame score into the part/overall averages."""
+        self.overall_sum += current_score
+        self.part_sum += current_score
+        self.prev_movement_score = current_score
+
+        second = int(self.current_frame / self.fps)
+        if second >= len(self.second_sums):
+            self.second_sums.append(0)
+            self.second_frames.append(0)
+        self.second_sums[-1] += current_score
+        self.second_frames[-1] += 1
+
+        if self.current_frame % self.frames_per_part == 0:
+            if self.current_frame > 0:
+                self.part_scores.append(self.part_sum / self.frames_per_part)
+            self.part_sum = 0
+
+        self.current_frame += 1
+
+    def next_window(self, frame_count):
+        """Scorer for the next window of a live stream (see live.py).
+
+        The previous frame and the smoothed score carry over, so the first
+        frame of the new window is scored against the last one of this window.
+        """
+        scorer = MovementScorer(frame_count, self.total_parts, self.scale, self.alpha,
+                                self.mode, self.roi_mask, self.stride, self.fps)
+        scorer.prev_gray = self.prev_gray
+        scorer.gap = self.gap
+        scorer.mask = self.mask
+        scorer.prev_movement_score = self.prev_movement_score
+        return scorer
+
+    def result(self):
+        overall_avg = self.overall_sum / self.frame_count if self.frame_count > 0 else 0
+        part_scores = list(self.part_scores)
+        while len(part_scores) < self.total_parts:
+            part_scores.append(0)
+
+        return {
+            'overall': overall_avg,
+            'parts': part_scores[:self.total_parts],
+            'frame_count': self.frame_count,
+            'mode': self.mode,
+            'per_second': [total / frames for total, frames in zip(self.second_sums, self.second_frames)]
+        }
+
+def analyze_video(video_path, workers=1, **scorer_options):
+    """Score a local clip; workers > 1 scores long clips in segments on a process pool."""
     if not os.path.exists(video_path):
         print(f"❌ Video file not found: {video_path}")
         return None
+    if workers > 1:
+        return score_parallel(video_path, workers, **scorer_options)
+    return score_capture(cv2.VideoCapture(video_path), **scorer_options)
 
-    cap = cv2.VideoCapture(video_path)
+def analyze_blob(blob, **scorer_options):
+    """Score a Storage clip while it downloads (stream_download.py); no temp file is left behind."""
+    cap = open_blob(blob)
+    try:
+        return score_capture(cap, **scorer_options)
+    finally:
+        cap.release()
+
+def score_capture(cap, **scorer_options):
     if not cap.isOpened():
         print("❌ Could not open video file")
         return None
 
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    total_parts = 10
-    frames_per_part = max(1, frame_count // total_parts)
-    scale = 0.35
-    alpha = 0.7
+    scorer_options.setdefault("fps", cap.get(cv2.CAP_PROP_FPS) or 30)
+    scorer = MovementScorer(frame_count, **scorer_options)
 
     ret, prev_frame = cap.read()
     if not ret:
@@ -72,129 +263,284 @@ def analyze_video(video_path):
         cap.release()
         return None
 
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    prev_gray = cv2.resize(prev_gray, None, fx=scale, fy=scale)
-
-    part_scores = []
-    movement_scores = []
-    overall_sum = 0
-    prev_movement_score = 0
-    current_frame = 0
+    scorer.start(prev_frame)
 
     while cap.isOpened():
+        if scorer.stride > 1 and scorer.current_frame % scorer.stride != 0:
+            # Skipped frames only need to be demuxed, not decoded
+            if not cap.grab():
+                break
+            scorer.update(None)
+            continue
         ret, frame = cap.read()
         if not ret:
             break
+        scorer.update(frame)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.resize(gray, None, fx=scale, fy=scale)
-
-        flow = cv2.calcOpticalFlowFarneback(
-            prev_gray, gray, None, 0.5, 3, 15, 3, 5, 1.2, 0
-        )
-        magnitude = np.sqrt(flow[...,0]**2 + flow[...,1]**2)
-        current_score = np.mean(magnitude)
-
-        if current_score == 0 or np.isnan(current_score):
-            current_score = prev_movement_score
-        else:
-            current_score = alpha * prev_movement_score + (1-alpha) * current_score
-
-        overall_sum += current_score
-        movement_scores.append(current_score)
-        prev_movement_score = current_score
+    cap.release()
+    # cv2.destroyAllWindows()
 
-        if current_frame % frames_per_part == 0 and current_frame > 0:
-            part_avg = np.mean(movement_scores[-frames_per_part:])
-            part_scores.append(part_avg)
+    return scorer.result()
+
+# ===== Segment-parallel scoring =====
+# Frame pairs are independent; only the EMA in smooth() and the running
+# averages depend on earlier frames. Workers therefore compute the calibrated
+# pair scores of one time segment each, seeking straight to the frame before
+# the segment (one frame of overlap), and the main process replays them
+# through MovementScorer.replay(), so smoothing and averages are applied
+# exactly as in the serial loop. Check a build with:
+#   python test2.py --parallel 16 --verify clip.mp4
+PARALLEL_WORKERS = 1          # > 1: test2.py main() scores each clip on this many processes
+PARALLEL_MIN_FRAMES = 3000    # shorter clips are scored serially (pool start-up is not worth it)
+
+def _score_segment(video_path, first, last, scorer_options):
+    """Calibrated pair scores for update indexes first..last-1 (last=None: to the end).
+
+    Returns ({update index: score}, number of updates made), like the serial loop
+    would see them: update k compares frame k+1 with the previous scored frame.
+    """
+    scorer = MovementScorer(1, **scorer_options)
+    cap = cv2.VideoCapture(video_path)
+    try:
+        # the previous scored frame of update `first` (frame 0 for the first segment)
+        start_frame = first - scorer.stride + 1 if first > 0 else 0
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        ret, frame = cap.read()
+        if not ret:
+            return {}, 0
+        scorer.start(frame)
+        # frames between the two belong to the previous segment's skipped updates
+        for _ in range(first - start_frame):
+            if not cap.grab():
+                return {}, 0
+        scores = {}
+        k = first
+        while last is None or k < last:
+            if k % scorer.stride != 0:
+                if not cap.grab():
+                    break
+                k += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = scorer._prepare(frame)
+            gap = 1 if k == 0 else scorer.stride
+            raw = scorer.raw_score(scorer.prev_gray, gray)
+            scores[k] = scorer.calibrated(raw / gap if gap > 1 else raw)
+            scorer.prev_gray = gray
+            k += 1
+        return scores, k - first
+    finally:
+        cap.release()
 
-        prev_gray = gray
-        current_frame += 1
+def score_parallel(video_path, workers, min_frames=PARALLEL_MIN_FRAMES, **scorer_options):
+    """score_capture() for a local file, with optical flow spread over `workers` processes."""
+    from concurrent.futures import ProcessPoolExecutor
 
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("❌ Could not open video file")
+        return None
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
     cap.release()
-    # cv2.destroyAllWindows()
-
-    overall_avg = overall_sum / frame_count if frame_count > 0 else 0
-    while len(part_scores) < 10:
-        part_scores.append(0)
+    scorer_options.setdefault("fps", fps)
+    # an unknown (0 / -1) or tiny frame count cannot be split: score it serially
+    if workers < 2 or frame_count < min_frames or frame_count - 1 < workers:
+        return score_capture(cv2.VideoCapture(video_path), **scorer_options)
+
+    # segment bounds are multiples of the stride, so each segment starts on a scored pair
+    stride = max(1, scorer_options.get("stride", SCORING_STRIDE))
+    updates = frame_count - 1
+    size = -(-updates // workers)
+    size = -(-size // stride) * stride
+    bounds = list(range(0, updates, size))
+    segments = [(first, first + size if i < len(bounds) - 1 else None) for i, first in enumerate(bounds)]
+
+    # the parent's ROI mask is passed as an array, not re-read in every worker
+    options = dict(scorer_options)
+    if isinstance(options.get("roi_mask", ROI_MASK_PATH), str):
+        options["roi_mask"] = load_roi_mask(options.get("roi_mask", ROI_MASK_PATH))
+
+    with timed("optical_flow_parallel"):
+        with ProcessPoolExecutor(max_workers=len(segments)) as pool:
+            results = list(pool.map(_score_segment, [video_path] * len(segments),
+                                    [first for first, _ in segments], [last for _, last in segments],
+                                    [options] * len(segments)))
+
+    scorer = MovementScorer(frame_count, **options)
+    pair_scores = {}
+    total = 0
+    for (first, last), (scores, count) in zip(segments, results):
+        if first != total:
+            # an earlier segment ended early (frame count overestimated); keep what is contiguous
+            break
+        pair_scores.update(scores)
+        total = first + count
+    if total == 0:
+        print("❌ Could not read video frames")
+        return None
+    FRAMES.inc(len(pair_scores), stage="optical_flow")
+    scorer.replay(pair_scores, total)
+    return scorer.result()
+
+def verify_parallel(video_path, workers, tolerance=1e-6, **scorer_options):
+    """Score a clip serially and in parallel; True if every output matches within tolerance."""
+    started = time.perf_counter()
+    serial = analyze_video(video_path, **scorer_options)
+    serial_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    parallel = score_parallel(video_path, workers, min_frames=0, **scorer_options)
+    parallel_seconds = time.perf_counter() - started
+    if serial is None or parallel is None:
+        print("❌ Could not score the clip")
+        return False
 
-    return {
-        'overall': overall_avg,
-        'parts': part_scores[:10],
-        'frame_count': frame_count
+    diffs = {
+        "overall": abs(serial["overall"] - parallel["overall"]),
+        "parts": max(abs(a - b) for a, b in zip(serial["parts"], parallel["parts"])),
+        "per_second": max((abs(a - b) for a, b in zip(serial["per_second"], parallel["per_second"])), default=0),
     }
+    same_shape = (len(serial["per_second"]) == len(parallel["per_second"])
+                  and serial["frame_count"] == parallel["frame_count"])
+    print(f"Serial {serial_seconds:.1f}s, parallel ({workers} workers) {parallel_seconds:.1f}s")
+    for name, diff in diffs.items():
+        print(f"  max |serial - parallel| {name}: {diff:.3g}")
+    ok = same_shape and all(diff <= tolerance for diff in diffs.values())
+    print("✅ Parallel scores match" if ok else "❌ Parallel scores differ from the serial path")
+    return ok
+
+def calibrate_scorer(mode, video_paths, scale=0.35):
+    """Fit CALIBRATION[mode] against Farneback on the same frame pairs (least squares)."""
+    reference = MovementScorer(1, scale=scale, mode="farneback", roi_mask=None)
+    candidate = MovementScorer(1, scale=scale, mode=mode, roi_mask=None, calibration=(1.0, 0.0))
+    ref_scores = []
+    mode_scores = []
+    for path in video_paths:
+        cap = cv2.VideoCapture(path)
+        ret, frame = cap.read()
+        if not ret:
+            print(f"❌ Could not read video frames: {path}")
+            cap.release()
+            continue
+        prev_gray = reference._prepare(frame)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = reference._prepare(frame)
+            ref_scores.append(reference.raw_score(prev_gray, gray))
+            mode_scores.append(candidate.raw_score(prev_gray, gray))
+            prev_gray = gray
+        cap.release()
+
+    if len(mode_scores) < 2:
+        raise ValueError("Not enough frames to calibrate")
+    a, b = np.polyfit(np.array(mode_scores), np.array(ref_scores), 1)
+    return float(a), float(b)
 
 # 4. Save to Firestore
-def save_to_firestore(db, video_path, results):
-    try:
-        def get_level(score):
-            if score < 0.5: return "Very Low"
-            elif score < 1.0: return "Low"
-            elif score < 1.5: return "Medium"
-            elif score < 2.0: return "High"
-            else: return "Very High"
-
-        document_id = f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{str(uuid.uuid4())[:8]}"
-        
-        data = {
-            'video_path': video_path,
-            'overall_score': float(round(results['overall'], 2)),
-            'overall_level': get_level(results['overall']),
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'frame_count': results['frame_count'],
-            'analysis_id': document_id
-        }
+def build_moverate_record(video_path, results, room=None, series_start=0.0, document_id=None):
+    """moverate document; series is the per-second movement (series_codec.py), starting at series_start.
+
+    document_id: stable id (e.g. the clip id) so a rerun overwrites instead of adding a document.
+    """
+    document_id = document_id or f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{str(uuid.uuid4())[:8]}"
+
+    data = {
+        'video_path': video_path,
+        'room': room or CONFIG.camera_for_video(video_path).room,
+        'overall_score': float(round(results['overall'], 2)),
+        'overall_level': get_level(results['overall']),
+        'timestamp': SERVER_TIMESTAMP,
+        'frame_count': results['frame_count'],
+        'scoring_mode': results.get('mode', 'farneback'),
+        'analysis_id': document_id
+    }
+    if results.get('per_second') is not None:
+        data['series'] = series_codec.encode(movement=results['per_second'], start=series_start)
+    return document_id, data
 
-        doc_ref = db.collection('moverate').document(document_id)
-        doc_ref.set(data)
+def save_to_firestore(db, video_path, results, room=None):
+    try:
+        document_id, data = build_moverate_record(video_path, results, room)
+
+        # ผลดิบกับ rollup ของห้องเขียนใน batch เดียวกัน
+        batch = db.batch()
+        batch.set(db.collection('moverate').document(document_id), data)
+        rollups.add(batch, db, data['room'], rollups.clip_time(video_path) or datetime.now(rollups.LOCAL_TZ),
+                    movement=data['overall_score'])
+        with timed("firestore_write"):
+            batch.commit()
         
         print("✅ Data saved to Firestore!")
-        return True
+        return document_id
 
     except Exception as e:
         print(f"❌ Failed to save data: {str(e)}")
         traceback.print_exc()
-        return False
+        return None
 
 # 5. Main loop
 def main():
     print("\n" + "="*50)
     print("📹  Video Monitoring and Analysis System")
     print("="*50 + "\n")
+    start_exporter("moverate")
 
     db = initialize_firebase()
     if not db:
         return
 
-    processed_videos = set()
+    # คลิปที่วิเคราะห์แล้วเก็บใน ledger (ledger.py) จึงไม่วิเคราะห์ซ้ำหลังรีสตาร์ต
+    # และแต่ละรอบจะ list เฉพาะคลิปที่อัปโหลดหลังรอบก่อน
+    ledger = get_ledger()
+    bucket = get_store().bucket
+    ledger.bootstrap(db, bucket)
 
     while True:
         try:
             print("🔄 Checking for new videos...")
-            bucket = storage.bucket()
-            blobs = bucket.list_blobs(prefix="videos/")
-
-            for blob in blobs:
-                if not blob.name.endswith(".mp4"):
-                    continue
-                if blob.name in processed_videos:
-                    continue
-
-                print(f"\n📥 New video found: {blob.name}")
-                downloaded_path = download_video_from_storage(blob.name)
-                if not downloaded_path:
-                    continue
+            ledger.discover(bucket)
 
-                print("🔍 Analyzing video...")
-                results = analyze_video(downloaded_path)
-                if not results:
+            for name in ledger.pending(stages=["moverate"]):
+                if not ledger.claim(name):
                     continue
 
-                print("💾 Saving results...")
-                success = save_to_firestore(db, blob.name, results)
-                if success:
-                    processed_videos.add(blob.name)
-                    os.remove(downloaded_path)
+                print(f"\n📥 New video found: {name}")
+                try:
+                    print("🔍 Analyzing video...")
+                    if PARALLEL_WORKERS > 1:
+                        # the workers seek within the clip, so it is downloaded first
+                        video_path = download_video_from_storage(name)
+                        try:
+                            results = analyze_video(video_path, workers=PARALLEL_WORKERS) if video_path else None
+                        finally:
+                            if video_path:
+                                os.remove(video_path)
+                    else:
+                        results = analyze_blob(bucket.blob(name))
+                    if not results:
+                        ledger.fail(name, "analysis failed")
+                        continue
+
+                    print("💾 Saving results...")
+                    room = CONFIG.camera_for_video(name).room
+                    document_id = save_to_firestore(db, name, results, room)
+                    if document_id:
+                        ledger.record_stage(name, "moverate", {
+                            "doc": document_id, "overall_score": float(round(results['overall'], 2))})
+                        ledger.finish(name)
+                    else:
+                        ledger.fail(name, "save failed")
+                except KeyboardInterrupt:
+                    ledger.release(name)
+                    raise
+                except Exception as e:
+                    ledger.fail(name, e)
+                    raise
 
             time.sleep(15)  # รอ 15 วินาทีแล้วค่อยตรวจอีกครั้ง
 
@@ -207,4 +553,22 @@ def main():
             time.sleep(10)
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Movement analysis")
+    arg_parser.add_argument("--calibrate", choices=sorted(CALIBRATION), help="fit the calibration for a scoring mode")
+    arg_parser.add_argument("--parallel", type=int, metavar="N", help="score the clips on N processes")
+    arg_parser.add_argument("--verify", action="store_true",
+                            help="with --parallel: check the parallel scores against the serial path")
+    arg_parser.add_argument("videos", nargs="*", help="clips used for --calibrate / --parallel")
+    args = arg_parser.parse_args()
+
+    if args.parallel and args.verify:
+        raise SystemExit(0 if all(verify_parallel(path, args.parallel) for path in args.videos) else 1)
+    elif args.parallel:
+        for path in args.videos:
+            print(f"{path}: {analyze_video(path, workers=args.parallel)}")
+    elif args.calibrate:
+        a, b = calibrate_scorer(args.calibrate, args.videos)
+        print(f'✅ CALIBRATION["{args.calibrate}"] = ({a:.4f}, {b:.4f})')
+    else:
+        main()
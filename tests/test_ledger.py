@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import ledger
+from ledger import Ledger
+
+
+@pytest.fixture
+def clips(tmp_path):
+    book = Ledger(str(tmp_path / "ledger.db"))
+    yield book
+    book.close()
+
+
+def add_clip(book, name, uploaded):
+    book._write("INSERT INTO clips (name, camera, room, uploaded, status, updated_at) "
+                "VALUES (?, 'cam', 'Room', ?, 'pending', ?)", (name, uploaded, time.time()))
+
+
+def test_pending_oldest_upload_first(clips):
+    add_clip(clips, "videos/b.mp4", "2026-01-01T00:00:00")
+    add_clip(clips, "videos/a.mp4", "2026-01-02T00:00:00")
+    assert clips.pending() == ["videos/b.mp4", "videos/a.mp4"]
+    assert clips.pending(limit=1) == ["videos/b.mp4"]
+
+
+def test_claim_is_exclusive(clips):
+    add_clip(clips, "videos/a.mp4", "2026-01-01T00:00:00")
+    assert clips.claim("videos/a.mp4")
+    assert not clips.claim("videos/a.mp4")
+    assert clips.pending() == []
+    assert clips.status("videos/a.mp4")["attempts"] == 1
+
+
+def test_stale_claim_is_taken_over(clips, monkeypatch):
+    add_clip(clips, "videos/a.mp4", "2026-01-01T00:00:00")
+    assert clips.claim("videos/a.mp4")
+    monkeypatch.setattr(ledger, "STALE_CLAIM_SECONDS", -1)
+    assert clips.pending() == ["videos/a.mp4"]
+    assert clips.claim("videos/a.mp4")
+
+
+def test_failed_clips_are_retried_until_max_attempts(clips):
+    add_clip(clips, "videos/a.mp4", "2026-01-01T00:00:00")
+    for attempt in range(ledger.MAX_ATTEMPTS):
+        assert clips.pending() == ["videos/a.mp4"]
+        assert clips.claim("videos/a.mp4")
+        clips.fail("videos/a.mp4", RuntimeError("broken clip"))
+    status = clips.status("videos/a.mp4")
+    assert (status["status"], status["error"]) == ("failed", "broken clip")
+    assert clips.pending() == []
+    assert not clips.claim("videos/a.mp4")
+
+    assert clips.retry_failed() == 1
+    assert clips.pending() == ["videos/a.mp4"]
+
+
+def test_release_does_not_count_the_attempt(clips):
+    add_clip(clips, "videos/a.mp4", "2026-01-01T00:00:00")
+    clips.claim("videos/a.mp4")
+    clips.release("videos/a.mp4")
+    status = clips.status("videos/a.mp4")
+    assert (status["status"], status["attempts"]) == ("pending", 0)
+
+
+def test_finish_needs_every_stage(clips):
+    add_clip(clips, "videos/a.mp4", "2026-01-01T00:00:00")
+    clips.claim("videos/a.mp4")
+    clips.record_stage("videos/a.mp4", "people_counter", {"in": 1})
+    clips.finish("videos/a.mp4")
+    assert clips.status("videos/a.mp4")["status"] == "pending"
+    assert clips.pending(stages=("people_counter",)) == []
+    assert clips.pending() == ["videos/a.mp4"]
+
+    clips.claim("videos/a.mp4")
+    clips.record_stage("videos/a.mp4", "moverate", {"overall_score": 0.5})
+    clips.finish("videos/a.mp4")
+    status = clips.status("videos/a.mp4")
+    assert status["status"] == "done"
+    assert status["stages"] == {"people_counter": {"in": 1}, "moverate": {"overall_score": 0.5}}
+    assert clips.counts() == {"done": 1}
+
+
+def test_lookback_name():
+    assert (ledger.lookback_name("videos/cam_", "videos/cam_2026-03-02_081500.mp4", seconds=86400)
+            == "videos/cam_2026-03-01_081500")
+    assert ledger.lookback_name("videos/cam_", "videos/cam_other.mp4") == "videos/cam_other.mp4"
+    assert ledger.lookback_name("videos/cam_", None) is None
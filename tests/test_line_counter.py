@@ -0,0 +1,91 @@
+import numpy as np
+
+from line_counter import LineCounter
+
+# Horizontal line across the middle of a 100 x 100 frame, drawn left to right:
+# walking down the image is "out", walking up is "in".
+LINE = [("door", (0, 50), (100, 50))]
+
+
+def box(x, y, size=10):
+    return [x - size / 2, y - size / 2, x + size / 2, y + size / 2]
+
+
+def test_crossing_down_counts_out():
+    counter = LineCounter(LINE)
+    counter.update(0, [box(50, 40)], [1])
+    counter.update(1, [box(50, 60)], [1])
+    assert (counter.in_count, counter.out_count) == (0, 1)
+
+
+def test_crossing_up_counts_in():
+    counter = LineCounter(LINE)
+    counter.update(0, [box(50, 60)], [1])
+    counter.update(1, [box(50, 40)], [1])
+    assert (counter.in_count, counter.out_count) == (1, 0)
+
+
+def test_both_directions_in_one_frame():
+    counter = LineCounter(LINE)
+    counter.update(0, [box(20, 40), box(80, 60)], [1, 2])
+    counter.update(1, [box(20, 60), box(80, 40)], [1, 2])
+    assert (counter.in_count, counter.out_count) == (1, 1)
+    assert counter.per_line() == [{"name": "door", "in": 1, "out": 1}]
+
+
+def test_moving_along_one_side_does_not_count():
+    counter = LineCounter(LINE)
+    for frame, x in enumerate(range(10, 90, 10)):
+        counter.update(frame, [box(x, 40)], [1])
+    assert (counter.in_count, counter.out_count) == (0, 0)
+
+
+def test_near_miss_beyond_the_segment_end_does_not_count():
+    counter = LineCounter([("door", (20, 50), (60, 50))])
+    counter.update(0, [box(80, 40)], [1])
+    counter.update(1, [box(80, 60)], [1])
+    assert (counter.in_count, counter.out_count) == (0, 0)
+
+    # the same move inside the segment does count
+    counter.update(2, [box(40, 40)], [2])
+    counter.update(3, [box(40, 60)], [2])
+    assert counter.out_count == 1
+
+
+def test_first_sighting_only_records_position():
+    counter = LineCounter(LINE)
+    known = counter.update(0, [box(50, 60)], [7])
+    assert not known.any()
+    known = counter.update(1, [box(50, 60), box(10, 10)], [7, 8])
+    assert known.tolist() == [True, False]
+    assert (counter.in_count, counter.out_count) == (0, 0)
+
+
+def test_each_line_counts_separately():
+    counter = LineCounter([("upper", (0, 30), (100, 30)), ("lower", (0, 70), (100, 70))])
+    counter.update(0, [box(50, 20)], [1])
+    counter.update(1, [box(50, 50)], [1])
+    counter.update(2, [box(50, 80)], [1])
+    assert counter.per_line() == [{"name": "upper", "in": 0, "out": 1},
+                                  {"name": "lower", "in": 0, "out": 1}]
+
+
+def test_tracks_unseen_for_max_age_frames_are_evicted():
+    counter = LineCounter(LINE, max_age=5)
+    counter.update(0, [box(50, 40), box(20, 20)], [1, 2])
+    counter.update(5, [box(20, 20)], [2])
+    assert len(counter) == 2
+    counter.update(6, [box(20, 20)], [2])
+    assert len(counter) == 1
+
+    # track 1 comes back below the line: a new sighting, not a crossing
+    known = counter.update(7, [box(50, 60)], [1])
+    assert not known.any()
+    assert counter.out_count == 0
+
+
+def test_empty_frame():
+    counter = LineCounter(LINE)
+    known = counter.update(0, np.empty((0, 4)), [])
+    assert known.shape == (0,)
+    assert len(counter) == 0
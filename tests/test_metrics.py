@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+
+def test_render_counter_and_gauge(registry):
+    uploads = metrics.Counter("test_uploads_total", "Uploads", ["camera"])
+    depth = metrics.Gauge("test_depth", "Queue depth")
+    uploads.inc(camera="a")
+    uploads.inc(2, camera="a")
+    depth.set(1.5)
+
+    text = metrics.render([metrics.snapshot("worker")])
+    pid = metrics.snapshot("worker")["pid"]
+    assert text.splitlines() == [
+        "# HELP test_uploads_total Uploads",
+        "# TYPE test_uploads_total counter",
+        f'test_uploads_total{{camera="a",process="worker",pid="{pid}"}} 3',
+        "# HELP test_depth Queue depth",
+        "# TYPE test_depth gauge",
+        f'test_depth{{process="worker",pid="{pid}"}} 1.5',
+    ]
+
+
+def test_render_histogram_is_cumulative(registry):
+    latency = metrics.Histogram("test_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    snapshot = metrics.snapshot("worker")
+    labels = f'process="worker",pid="{snapshot["pid"]}"'
+    assert metrics.render([snapshot]).splitlines()[2:] == [
+        f'test_seconds_bucket{{le="0.1",{labels}}} 1',
+        f'test_seconds_bucket{{le="1",{labels}}} 2',
+        f'test_seconds_bucket{{le="+Inf",{labels}}} 3',
+        f"test_seconds_sum{{{labels}}} 5.55",
+        f"test_seconds_count{{{labels}}} 3",
+    ]
+
+
+def test_render_merges_processes_under_one_header(registry):
+    metrics.Gauge("test_depth", "Queue depth").set(1)
+    snapshot = metrics.snapshot("dashboard")
+    other = {**snapshot, "process": "analyze", "pid": 1}
+    text = metrics.render([snapshot, other])
+    assert text.count("# TYPE test_depth gauge") == 1
+    assert 'process="analyze",pid="1"' in text
+
+
+def test_label_values_are_escaped(registry):
+    metrics.Counter("test_total", "Total", ["path"]).inc(path='a"b\\c\n')
+    assert 'path="a\\"b\\\\c\\n"' in metrics.render([metrics.snapshot("worker")])
+
+
+def test_wrong_labels_are_rejected(registry):
+    counter = metrics.Counter("test_total", "Total", ["stage"])
+    with pytest.raises(ValueError):
+        counter.inc(camera="a")
+
+
+def test_reads_on_pool_threads_are_charged_to_the_request():
+    metrics.start_request()
+    metrics.count_reads("videos", 2)
+    worker = threading.Thread(target=metrics.bind_request(lambda: metrics.count_reads("moverate", 3)))
+    worker.start()
+    worker.join()
+    assert metrics._request.reads.count == 5
+    metrics.finish_request("test", 0.01)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import rollups
+from datastore import LocalStore
+
+START = datetime(2026, 3, 2, 8, 0, tzinfo=rollups.LOCAL_TZ)
+
+
+@pytest.mark.parametrize("span, points, resolution", [
+    (timedelta(hours=2), 100, "minute"),       # 120 minute buckets
+    (timedelta(hours=2), 200, "minute"),       # finest available, fewer than asked
+    (timedelta(days=7), 100, "hour"),          # 168 hours; minutes exceed MAX_BUCKETS
+    (timedelta(days=30), 20, "day"),           # 30 days already give 20 points
+    (timedelta(days=30), 200, "hour"),         # 720 hours
+    (timedelta(days=400), 200, "day"),         # hours exceed MAX_BUCKETS
+])
+def test_choose_resolution(span, points, resolution):
+    assert rollups.choose_resolution(START, START + span, points) == resolution
+
+
+def test_bucket_start_follows_bangkok_days():
+    when = datetime(2026, 3, 1, 20, 30, tzinfo=rollups.ZoneInfo("UTC"))     # 03:30 on the 2nd in Bangkok
+    assert rollups.bucket_start(when, "day") == datetime(2026, 3, 2, tzinfo=rollups.LOCAL_TZ)
+    assert rollups.bucket_start(when, "hour") == datetime(2026, 3, 2, 3, tzinfo=rollups.LOCAL_TZ)
+
+
+def test_clip_time_from_name():
+    assert rollups.clip_time("videos/room901_2026-03-02_081500.mp4") == START + timedelta(minutes=15)
+    assert rollups.clip_time("videos/live.mp4") is None
+
+
+@pytest.fixture
+def db(tmp_path):
+    store = LocalStore(str(tmp_path))
+    yield store.db
+    store.close()
+
+
+def add(db, room, when, people=None, movement=None):
+    batch = db.batch()
+    rollups.add(batch, db, room, when, people=people, movement=movement)
+    batch.commit()
+
+
+def test_add_accumulates_every_resolution(db):
+    add(db, "A", START + timedelta(seconds=10), people={"total_count": 3, "in": 2, "out": 1}, movement=1.0)
+    add(db, "A", START + timedelta(seconds=50), people={"total_count": 5, "in": 1, "out": 0}, movement=2.0)
+    for resolution in rollups.RESOLUTIONS:
+        [doc] = db.collection(rollups.COLLECTIONS[resolution]).stream()
+        data = doc.to_dict()
+        assert (data["people_sum"], data["people_samples"], data["people_max"]) == (8, 2, 5)
+        assert (data["in"], data["out"]) == (3, 1)
+        assert (data["move_sum"], data["move_samples"]) == (3.0, 2)
+
+
+def test_history_downsamples_into_bins(db):
+    # one result per minute for two hours, movement 0 in the first hour and 2 in the second
+    for minute in range(120):
+        add(db, "A", START + timedelta(minutes=minute), people={"total_count": 1}, movement=0.0 if minute < 60 else 2.0)
+    add(db, "B", START, people={"total_count": 100})
+
+    result = rollups.history(db, START, START + timedelta(hours=2), room="A", points=2)
+    assert result["resolution"] == "hour"
+    assert result["bin_seconds"] == 3600
+    assert result["move_score"] == [0.0, 2.0]
+    assert result["move_level"] == ["Very Low", "Very High"]
+    assert result["people_avg"] == [1.0, 1.0]
+
+    result = rollups.history(db, START, START + timedelta(hours=2), room="A", points=4)
+    assert result["resolution"] == "minute"
+    assert len(result["labels"]) == 4
+    assert result["move_score"] == [0.0, 0.0, 2.0, 2.0]
+
+
+def test_history_leaves_empty_bins_empty(db):
+    add(db, "A", START, movement=1.0)
+    result = rollups.history(db, START, START + timedelta(hours=3), room="A", points=3)
+    assert result["move_score"] == [1.0, None, None]
+    assert result["people_avg"] == [None, None, None]
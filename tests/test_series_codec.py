@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import series_codec
+
+
+def test_round_trip_both_channels():
+    movement = [0.0, 0.25, 1.5, 3.75]
+    occupancy = [0, 2, 3, 1]
+    blob = series_codec.encode(movement=movement, occupancy=occupancy, start=1700000000.0, step=1.0)
+    assert len(blob) == series_codec.HEADER.size + 4 * 2 * 2
+
+    series = series_codec.decode(blob)
+    assert (series["start"], series["step"], series["count"]) == (1700000000.0, 1.0, 4)
+    np.testing.assert_array_equal(series["movement"], np.array(movement, dtype="<f2"))
+    np.testing.assert_array_equal(series["occupancy"], occupancy)
+
+
+def test_single_channel():
+    series = series_codec.decode(series_codec.encode(occupancy=[1, 2]))
+    assert "movement" not in series
+    assert series["occupancy"].tolist() == [1, 2]
+
+
+def test_decode_returns_read_only_views():
+    blob = series_codec.encode(movement=[1.0, 2.0])
+    series = series_codec.decode(blob)
+    assert not series["movement"].flags.writeable
+    assert not series["movement"].flags.owndata
+
+
+def test_occupancy_is_rounded_and_clipped():
+    series = series_codec.decode(series_codec.encode(occupancy=[1.6, -1e9, 1e9]))
+    assert series["occupancy"].tolist() == [2, -32768, 32767]
+
+
+def test_empty_series():
+    series = series_codec.decode(series_codec.encode(movement=[]))
+    assert series["count"] == 0
+    assert len(series["movement"]) == 0
+
+
+def test_channels_must_have_the_same_length():
+    with pytest.raises(ValueError):
+        series_codec.encode(movement=[1.0, 2.0], occupancy=[1])
+
+
+def test_needs_a_channel():
+    with pytest.raises(ValueError):
+        series_codec.encode()
+
+
+@pytest.mark.parametrize("blob", [
+    b"SCSR",
+    b"NOPE" + bytes(series_codec.HEADER.size - 4),
+    series_codec.HEADER.pack(series_codec.MAGIC, series_codec.VERSION + 1, 1, 0.0, 1.0, 0),
+])
+def test_rejects_invalid_blobs(blob):
+    with pytest.raises(ValueError):
+        series_codec.decode(blob)
@@ -0,0 +1,213 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import count_reads
+
+logger = logging.getLogger(__name__)
+
+# อายุของ signed URL และเวลาที่ต้องเซ็นใหม่ก่อนหมดอายุ (วินาที)
+SIGNED_URL_TTL = 3600
+SIGNED_URL_MARGIN = 300
+# ซิงก์ทั้งหมดใหม่เป็นระยะ เพื่อล้างวิดีโอที่ถูกลบออกไปแล้ว
+FULL_SYNC_SECONDS = 3600
+# ไฟล์ SQLite ที่เก็บตำแหน่งเล่น ใช้ร่วมกันทุก worker process บนเครื่องเดียวกัน
+PLAYBACK_PATH = os.environ.get("SMARTCLASS_PLAYBACK", "playback.db")
+
+
+class PlaybackCursor:
+    """ตำแหน่งเล่นของแต่ละคิวใน SQLite แทนตัวแปรใน process
+
+    เมื่อรันแดชบอร์ดหลาย worker (wsgi.py) ทุก process เลื่อน cursor ตัวเดียวกัน
+    จอที่เปิดหน้าเว็บอยู่จึงเล่นวิดีโอวนต่อกันตามลำดับ ไม่ว่า request จะไปตก worker ไหน
+    """
+
+    def __init__(self, path=PLAYBACK_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS playback (queue TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+
+    def advance(self, key, length):
+        """คืน (ตำแหน่งที่จะเล่น, wrapped) แล้วเลื่อน cursor ไปหนึ่ง; wrapped=True เมื่อเล่นครบรอบแล้ว"""
+        with self._lock:
+            # BEGIN IMMEDIATE: อ่านและเขียนตำแหน่งเป็นขั้นตอนเดียว ไม่ชนกับ process อื่น
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT position FROM playback WHERE queue = ?", (key,)).fetchone()
+                position = row[0] if row else 0
+                wrapped = position >= length
+                if wrapped:
+                    position = 0
+                self._conn.execute("INSERT OR REPLACE INTO playback (queue, position) VALUES (?, ?)",
+                                   (key, position + 1))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return position, wrapped
+
+
+class VideoQueue:
+    """คิววิดีโอสำหรับเล่นบนแดชบอร์ด (ใหม่สุดก่อน)
+
+    - ซิงก์เฉพาะเอกสาร videos ที่ใหม่กว่าครั้งก่อน (query ตาม timestamp)
+    - ตรวจว่าไฟล์มีอยู่จริงด้วย list_blobs ครั้งเดียวต่อการซิงก์ แทน blob.exists() ทีละไฟล์
+    - เซ็น URL เฉพาะตอนจะเล่น และเก็บ URL ไว้ใช้ซ้ำจนใกล้หมดอายุ
+    - ตำแหน่งเล่น (cursor) ถูกป้องกันด้วย lock จึงใช้กับ Flask แบบ threaded ได้
+    - ระบุ room เพื่อเล่นเฉพาะวิดีโอของห้องนั้น (ต้องมี composite index (room, timestamp)
+      และเอกสารเก่าที่ไม่มี field room ต้องถูกเติมด้วย backfill_rooms.py ก่อน)
+    - ระบุ cursor (PlaybackCursor) เพื่อใช้ตำแหน่งเล่นร่วมกันหลาย process
+    """
+
+    def __init__(self, db, bucket, prefix="videos/", room=None, cursor=None):
+        self.db = db
+        self.bucket = bucket
+        self.prefix = prefix
+        self.room = room
+        self.cursor = cursor
+
+        self._lock = threading.RLock()
+        self._entries = []          # [{'name', 'timestamp', 'blob'}] ใหม่สุดก่อน
+        self._names = set()
+        self._last_timestamp = None
+        self._last_full_sync = None
+        self._cursor = 0
+        self._signed_urls = {}      # name -> (url, expires_at)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _list_blobs(self, names):
+        """ดึง metadata ของ blob ที่ต้องการด้วย list_blobs ครั้งเดียว"""
+        # ชื่อไฟล์ <กล้อง>_YYYY-mm-dd_HHMMSS.mp4 เรียงตามชื่อ จึงเริ่ม list จากชื่อที่น้อยสุดได้
+        start_offset = f"{self.prefix}{min(names)}" if names else None
+        wanted = {f"{self.prefix}{name}" for name in names}
+        blobs = {}
+        for blob in self.bucket.list_blobs(prefix=self.prefix, start_offset=start_offset):
+            if blob.name in wanted:
+                blobs[blob.name[len(self.prefix):]] = blob
+        return blobs
+
+    def sync(self, full=False):
+        """เพิ่มวิดีโอใหม่เข้าคิว; full=True จะโหลดคิวทั้งหมดใหม่"""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_full_sync is None or now - self._last_full_sync > FULL_SYNC_SECONDS:
+                full = True
+
+            query = self.db.collection("videos")
+            if self.room is not None:
+                query = query.where("room", "==", self.room)
+            query = query.order_by("timestamp")
+            if not full and self._last_timestamp is not None:
+                # >= เผื่อเอกสารที่ timestamp ซ้ำกัน แล้วกรองชื่อที่มีอยู่แล้วทิ้ง
+                query = query.where("timestamp", ">=", self._last_timestamp)
+
+            seen = set()
+            new_docs = []
+            reads = 0
+            for doc in query.stream():
+                reads += 1
+                try:
+                    video_data = doc.to_dict()
+                    file_name = video_data.get("fileName", "")
+                    if not file_name or file_name in seen:
+                        continue
+                    if not full and file_name in self._names:
+                        continue
+                    new_docs.append((file_name, video_data.get("timestamp")))
+                    seen.add(file_name)
+                except Exception as e:
+                    logger.error(f"Error processing video document {doc.id}: {e}")
+            count_reads("videos", reads)
+
+            if not new_docs and not full:
+                return 0
+
+            blobs = self._list_blobs([name for name, _ in new_docs])
+            added = [{'name': name, 'timestamp': ts, 'blob': blobs[name]}
+                     for name, ts in new_docs if name in blobs]
+            added.reverse()  # ใหม่สุดก่อน
+
+            if full:
+                self._entries = added
+                self._names = {e['name'] for e in added}
+                self._signed_urls = {n: u for n, u in self._signed_urls.items() if n in self._names}
+                self._last_full_sync = now
+            else:
+                self._entries = added + self._entries
+                self._names.update(e['name'] for e in added)
+
+            timestamps = [ts for _, ts in new_docs if ts is not None]
+            if timestamps:
+                self._last_timestamp = max(timestamps)
+
+            logger.info(f"Video queue synced: {len(added)} new, {len(self._entries)} total")
+            return len(added)
+
+    def signed_url(self, entry):
+        """signed URL ของวิดีโอ (ใช้ URL เดิมจนใกล้หมดอายุ)"""
+        name = entry['name']
+        now = time.time()
+        with self._lock:
+            cached = self._signed_urls.get(name)
+            if cached and cached[1] - now > SIGNED_URL_MARGIN:
+                return cached[0]
+
+        url = entry['blob'].generate_signed_url(
+            version="v4",
+            expiration=SIGNED_URL_TTL,
+            method="GET"
+        )
+        with self._lock:
+            self._signed_urls[name] = (url, now + SIGNED_URL_TTL)
+        return url
+
+    def next(self):
+        """วิดีโอถัดไปในคิว; เมื่อเล่นครบรอบจะซิงก์วิดีโอใหม่แล้วเริ่มจากใหม่สุด"""
+        with self._lock:
+            if self.cursor is not None:
+                position, wrapped = self.cursor.advance(self.room or "*", len(self._entries))
+            else:
+                position, wrapped = self._cursor, self._cursor >= len(self._entries)
+            if wrapped or not self._entries:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Error updating video queue: {e}")
+                position = 0
+
+            if not self._entries:
+                return None
+
+            # คิวของแต่ละ process อาจยาวไม่เท่ากันชั่วคราว (ซิงก์คนละเวลา)
+            entry = self._entries[position % len(self._entries)]
+            self._cursor = position + 1
+
+        return self._item(entry)
+
+    def latest(self, name=None):
+        """วิดีโอใหม่สุดในคิว (ไม่เลื่อน cursor); ระบุ name ที่เพิ่งเข้ามาเพื่อซิงก์เฉพาะตอนยังไม่มีในคิว"""
+        with self._lock:
+            if name is not None and name not in self._names:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Error updating video queue: {e}")
+            if not self._entries:
+                return None
+            entry = self._entries[0]
+        return self._item(entry)
+
+    def _item(self, entry):
+        return {
+            'url': self.signed_url(entry),
+            'name': entry['name'],
+            'timestamp': entry['timestamp'],
+            'updated': entry['blob'].updated
+        }
@@ -0,0 +1,18 @@
+import metrics
+from app import app, update_video_queue
+
+# จุดเริ่มของแดชบอร์ดสำหรับใช้งานจริง (แทน python app.py ที่ใช้ Flask dev server)
+#
+#   gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 wsgi:app      (ไม่ใช้ --preload: thread เบื้องหลังต้องเริ่มในแต่ละ worker)
+#
+# ทุก worker ใช้ตำแหน่งเล่นวิดีโอร่วมกันจาก playback.db (video_queue.PlaybackCursor)
+# และเขียน metrics ของตัวเองลง metrics/ ให้ /metrics ของ worker ไหนก็ได้รวมครบทุกตัว
+# /events (server-sent events) ค้างการเชื่อมต่อไว้หนึ่ง thread ต่อจอ แต่ละ worker รับได้ไม่เกิน
+# SMARTCLASS_MAX_EVENT_STREAMS (ค่าเริ่มต้น 4 ให้น้อยกว่า --threads) จอที่เกินได้ 503 แล้วใช้ polling แทน
+# ถ้าใช้ waitress (Windows): waitress-serve --threads 16 --port 5000 wsgi:app
+
+metrics.start_exporter("dashboard")
+# โหลดคิววิดีโอครั้งแรกตอน worker เริ่ม ไม่ให้ request แรกต้องรอ
+update_video_queue()
+
+application = app